@@ -0,0 +1,516 @@
+"""
+轉發效能基準測試。
+
+在同一個程序內啟動一個 paramiko ServerInterface 假伺服器（接受 direct-tcpip）
+與本機 echo / sink 伺服器，不需要網路即可量測 tunnel_engine 的
+forward_tunnel / transfer：
+
+    python benchmark.py --output result.json
+    python benchmark.py --output new.json --compare result.json
+
+量測項目：大量傳輸 MB/s、請求/回應延遲 p50/p99、每秒新連線數、
+突發連線的建立延遲、同時連線上限，以及各階段的記憶體用量。
+--transports 1 2 4 另外量測多條連線同時大量傳輸時，合計 MB/s 隨 Transport 數的變化。
+"""
+import argparse
+import json
+import os
+import platform
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import paramiko
+
+import tunnel_engine
+from tunnel_engine import (MB, CryptoProfile, TransportGroup, TunnelLimits, TunnelStats, forward_tunnel,
+                           transport_pool)
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+DEFAULT_SIZES_MB = (1, 16, 64)
+DEFAULT_LATENCY_ROUNDS = 2000
+DEFAULT_CONNECT_SECONDS = 3.0
+DEFAULT_MAX_CONNECTIONS = 500
+DEFAULT_BURST = 64
+DEFAULT_STREAMS = 8
+DEFAULT_SCALING_MB = 16
+IO_TIMEOUT = 10.0
+
+
+def _listen():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1024)
+    return sock
+
+
+def _free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _serve_forever(sock, handler):
+    def loop():
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=handler, args=(conn,), daemon=True).start()
+    threading.Thread(target=loop, daemon=True).start()
+
+
+def _echo(conn):
+    """原樣回傳收到的資料，對方半關閉後也關閉"""
+    try:
+        while True:
+            data = conn.recv(256 * 1024)
+            if not data:
+                break
+            conn.sendall(data)
+    except OSError:
+        pass
+    conn.close()
+
+
+def _sink(conn):
+    """只計算收到的位元組數，對方半關閉後回傳總數"""
+    total = 0
+    try:
+        while True:
+            data = conn.recv(256 * 1024)
+            if not data:
+                break
+            total += len(data)
+        conn.sendall(str(total).encode())
+    except OSError:
+        pass
+    conn.close()
+
+
+class StandInServer(paramiko.ServerInterface):
+    """只接受密碼登入與 direct-tcpip 的假 SSH 伺服器，記錄每個 channel 要求的目的地"""
+
+    def __init__(self):
+        self.destinations = {}
+
+    def check_auth_password(self, username, password):
+        if username == BENCH_USER and password == BENCH_PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "direct-tcpip":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.destinations[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+
+class LocalSSHServer:
+    """
+    程序內的 SSH 伺服器。每個 direct-tcpip channel 都會連到請求的目的地，
+    並以獨立執行緒轉送，模擬 sshd 的行為（這部分不在量測範圍內）。
+    """
+
+    def __init__(self):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = _listen()
+        self.port = self.sock.getsockname()[1]
+        self.transports = []
+        _serve_forever(self.sock, self._serve)
+
+    def _serve(self, conn):
+        # 與用戶端相同，避免 channel 的小封包被 Nagle 延遲而量到 40ms 的假延遲
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        # 像 sshd 一樣提供 zlib，是否壓縮由用戶端的 --compress 決定
+        transport.use_compression(True)
+        self.transports.append(transport)
+        server = StandInServer()
+        try:
+            transport.start_server(server=server)
+        except Exception:
+            return
+        while transport.is_active():
+            channel = transport.accept(1.0)
+            if channel is not None:
+                destination = server.destinations.pop(channel.get_id(), None)
+                threading.Thread(target=self._bridge, args=(channel, destination), daemon=True).start()
+
+    @staticmethod
+    def _bridge(channel, destination):
+        try:
+            target = socket.create_connection(destination, timeout=IO_TIMEOUT)
+        except (TypeError, OSError):
+            channel.close()
+            return
+        target.settimeout(None)
+        open_sides = {channel, target}
+        # 大量連線時 fd 會超過 select() 的上限，改用 selectors
+        selector = selectors.DefaultSelector()
+        for side in open_sides:
+            selector.register(side, selectors.EVENT_READ)
+        try:
+            while open_sides:
+                for key, _ in selector.select():
+                    src = key.fileobj
+                    dst = target if src is channel else channel
+                    data = src.recv(256 * 1024)
+                    if not data:
+                        open_sides.discard(src)
+                        selector.unregister(src)
+                        if dst is channel:
+                            channel.shutdown_write()
+                        else:
+                            target.shutdown(socket.SHUT_WR)
+                        continue
+                    dst.sendall(data)
+        except Exception:
+            pass
+        selector.close()
+        target.close()
+        try:
+            channel.close()
+        except EOFError:
+            pass  # 量測結束時 transport 可能已關閉
+
+    def close(self):
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+
+
+def _rss_mb():
+    """目前程序的常駐記憶體（MB），不支援的平台回傳 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / MB, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (MB if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        return None
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("連線提前結束")
+        data += chunk
+    return bytes(data)
+
+
+def bench_bulk(port, size):
+    """送出 size 位元組到 sink，等待對方回報總數，回傳 MB/s"""
+    payload = memoryview(os.urandom(MB))
+    sock = socket.create_connection(("127.0.0.1", port), timeout=IO_TIMEOUT)
+    started = time.perf_counter()
+    remaining = size
+    while remaining:
+        n = min(remaining, len(payload))
+        sock.sendall(payload[:n])
+        remaining -= n
+    sock.shutdown(socket.SHUT_WR)
+    reply = b""
+    while True:
+        chunk = sock.recv(64)
+        if not chunk:
+            break
+        reply += chunk
+    elapsed = time.perf_counter() - started
+    sock.close()
+    if int(reply or 0) != size:
+        raise RuntimeError(f"sink 只收到 {reply!r} / {size} 位元組")
+    return size / elapsed / MB
+
+
+def bench_parallel_bulk(port, size, streams):
+    """streams 條連線同時各送 size 位元組到 sink，回傳合計 MB/s"""
+    errors = []
+
+    def client():
+        try:
+            bench_bulk(port, size)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(streams)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+    return size * streams / elapsed / MB
+
+
+def bench_latency(port, rounds, message_size=64):
+    """在同一條連線上做 rounds 次請求/回應，回傳 (p50, p99) 毫秒"""
+    message = b"x" * message_size
+    sock = socket.create_connection(("127.0.0.1", port), timeout=IO_TIMEOUT)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        sock.sendall(message)
+        _recv_exact(sock, message_size)
+        samples.append((time.perf_counter() - started) * 1000)
+    sock.close()
+    samples.sort()
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def bench_connect_rate(port, duration):
+    """持續 duration 秒建立新連線並完成一次來回，回傳每秒連線數"""
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        sock = socket.create_connection(("127.0.0.1", port), timeout=IO_TIMEOUT)
+        sock.sendall(b"p")
+        _recv_exact(sock, 1)
+        sock.close()
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def bench_burst(port, count):
+    """同時發起 count 個連線，量測每個連線從 connect 到第一次來回完成的 (p50, p99) 毫秒"""
+    samples = []
+    lock = threading.Lock()
+    start = threading.Event()
+
+    def client():
+        start.wait()
+        started = time.perf_counter()
+        try:
+            sock = socket.create_connection(("127.0.0.1", port), timeout=IO_TIMEOUT)
+            sock.sendall(b"p")
+            _recv_exact(sock, 1)
+            sock.close()
+        except (OSError, ConnectionError):
+            return
+        with lock:
+            samples.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(count)]
+    for t in threads:
+        t.start()
+    start.set()
+    for t in threads:
+        t.join()
+    if not samples:
+        return 0.0, 0.0
+    samples.sort()
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def bench_max_concurrent(port, limit):
+    """逐一開啟並保持連線，直到失敗或達到 limit，回傳成功維持的連線數"""
+    held = []
+    try:
+        for _ in range(limit):
+            try:
+                sock = socket.create_connection(("127.0.0.1", port), timeout=IO_TIMEOUT)
+                sock.sendall(b"p")
+                _recv_exact(sock, 1)
+            except (OSError, ConnectionError):
+                break
+            held.append(sock)
+        return len(held)
+    finally:
+        for sock in held:
+            sock.close()
+
+
+def _raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def _limits(args, **kwargs):
+    return TunnelLimits(window_size=args.window, max_packet_size=args.max_packet, **kwargs)
+
+
+def _group(transports):
+    return transports[0] if len(transports) == 1 else TransportGroup(transports)
+
+
+def run_mode(transport, targets, mode, args):
+    """對單一轉發模式跑完所有量測項目，targets 為 {"echo": (host, port), "sink": (host, port)}"""
+    echo_port, sink_port = _free_port(), _free_port()
+    result = {"rss_mb_start": _rss_mb()}
+    listeners = []
+    try:
+        for local_port, target in ((echo_port, "echo"), (sink_port, "sink")):
+            host, port = targets[target]
+            limits = _limits(args, warm=args.warm)
+            sock, _ = forward_tunnel(local_port, host, port, transport, TunnelStats(target), mode, limits)
+            listeners.append(sock)
+        time.sleep(0.2)
+
+        result["bulk_mb_per_s"] = {
+            f"{size}MB": round(bench_bulk(sink_port, size * MB), 1) for size in args.sizes
+        }
+        result["rss_mb_after_bulk"] = _rss_mb()
+        p50, p99 = bench_latency(echo_port, args.rounds)
+        result["latency_ms"] = {"p50": round(p50, 3), "p99": round(p99, 3)}
+        result["connections_per_s"] = round(bench_connect_rate(echo_port, args.connect_seconds), 1)
+        p50, p99 = bench_burst(echo_port, args.burst)
+        result["burst_setup_ms"] = {"p50": round(p50, 3), "p99": round(p99, 3)}
+        threads_before = threading.active_count()
+        result["max_concurrent"] = bench_max_concurrent(echo_port, args.max_connections)
+        result["rss_mb_after_concurrent"] = _rss_mb()
+        # 包含假伺服器端的轉送執行緒，只適合同一台機器前後比較
+        result["threads_during_concurrent"] = threading.active_count() - threads_before
+    finally:
+        for sock in listeners:
+            sock.close()
+    return result
+
+
+def run_scaling(transports, targets, mode, args):
+    """依序以 args.transports 中的每個 K，量測 args.streams 條連線同時傳輸的合計 MB/s"""
+    result = {}
+    host, port = targets["sink"]
+    for count in args.transports:
+        local_port = _free_port()
+        sock, _ = forward_tunnel(local_port, host, port, _group(transports[:count]), TunnelStats("sink"), mode,
+                                 _limits(args, transports=count))
+        try:
+            time.sleep(0.2)
+            speed = bench_parallel_bulk(local_port, args.scaling_mb * MB, args.streams)
+            result[f"{count}_transports"] = round(speed, 1)
+        finally:
+            sock.close()
+    return result
+
+
+def run_suite(args):
+    _raise_fd_limit()
+    echo_sock, sink_sock = _listen(), _listen()
+    _serve_forever(echo_sock, _echo)
+    _serve_forever(sink_sock, _sink)
+    targets = {"echo": echo_sock.getsockname(), "sink": sink_sock.getsockname()}
+
+    server = LocalSSHServer()
+    profile = CryptoProfile(args.cipher, args.mac, args.compress)
+    keys, transports = [], []
+    for slot in range(max(args.transports)):
+        key, transport = transport_pool.acquire(BENCH_USER, "127.0.0.1", server.port, BENCH_PASSWORD,
+                                                profile=profile, slot=slot)
+        keys.append(key)
+        transports.append(transport)
+    transport = transports[0]
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "paramiko": paramiko.__version__,
+            "platform": platform.platform(),
+            "relay_buffer_size": tunnel_engine.RELAY_BUFFER_SIZE,
+            "warm_channels": args.warm,
+            "cipher": transport.local_cipher,
+            "mac": transport.local_mac,
+            "compression": transport.local_compression,
+            "window_size": args.window,
+            "max_packet_size": args.max_packet,
+            "parallel_streams": args.streams,
+        },
+        "results": {},
+    }
+    try:
+        for mode in args.modes:
+            print(f"▶ {mode} 模式量測中...")
+            report["results"][mode] = run_mode(transport, targets, mode, args)
+            report["results"][mode]["parallel_bulk_mb_per_s"] = run_scaling(transports, targets, mode, args)
+    finally:
+        for key in keys:
+            transport_pool.release(key)
+        server.close()
+    return report
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare(old, new):
+    """逐項列出與前一次結果的差異（百分比）"""
+    before = _flatten("", old.get("results", {}), {})
+    after = _flatten("", new.get("results", {}), {})
+    for name in sorted(after):
+        if name in before and before[name]:
+            change = (after[name] - before[name]) / before[name] * 100
+            print(f"{name:50s} {before[name]:>12} -> {after[name]:>12} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SSH 通道轉發效能基準測試")
+    parser.add_argument("--modes", nargs="+", default=["thread", "asyncio"], choices=("thread", "asyncio"))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES_MB), help="大量傳輸的資料量（MB）")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_LATENCY_ROUNDS, help="延遲量測的來回次數")
+    parser.add_argument("--connect-seconds", type=float, default=DEFAULT_CONNECT_SECONDS, help="量測新連線速率的秒數")
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS, help="同時連線測試的上限")
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help="同時發起的連線數（量測突發時的建立延遲）")
+    parser.add_argument("--warm", type=int, default=0, help="每條通道預先開好的 channel 數（對應選項 warm）")
+    parser.add_argument("--cipher", default="", help="優先使用的 cipher，例如 aes128-gcm@openssh.com")
+    parser.add_argument("--mac", default="", help="優先使用的 MAC，例如 hmac-sha2-256-etm@openssh.com")
+    parser.add_argument("--compress", action="store_true", help="啟用 zlib 壓縮")
+    parser.add_argument("--transports", nargs="+", type=int, default=[1],
+                        help="平行傳輸量測使用的 Transport 數，例如 1 2 4（對應選項 transports）")
+    parser.add_argument("--streams", type=int, default=DEFAULT_STREAMS, help="平行傳輸量測同時進行的連線數")
+    parser.add_argument("--scaling-mb", type=int, default=DEFAULT_SCALING_MB, help="平行傳輸量測每條連線的資料量（MB）")
+    parser.add_argument("--window", type=int, help="channel 接收視窗（位元組，對應選項 window）")
+    parser.add_argument("--max-packet", type=int, help="channel 最大封包（位元組，對應選項 max_packet）")
+    parser.add_argument("--output", help="結果 JSON 檔路徑（未指定時輸出到螢幕）")
+    parser.add_argument("--compare", help="與先前的結果 JSON 比較")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"結果已寫入 {args.output}")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,50 @@
-import tkinter as tk
-from tkinter import PhotoImage
-from tkinter import messagebox
-import subprocess
-import socket
+import time
+STARTUP_STARTED = time.perf_counter()  # --profile-startup 以此為起點
+
+import sys
 import os
+import base64
 import threading
-import select
-import errno
-import sys
 import tempfile
-import requests
-import pystray  # 系統匣支援
-from pystray import MenuItem as item
-from PIL import Image  # pystray 需要 PIL 處理圖像
+import multiprocessing
 
-CONFIG_FILE = "ssh通道.config"
-MAX_ROWS = 10
-DEFAULT_ROWS = 5
+from tunnel_engine import (TunnelEngine, TunnelSpec, TunnelConfig, ConfigWatcher, load_config, save_config,
+                           default_config_path, parse_options, format_options, preload, log, log_buffer,
+                           parse_log_level, store_crypto_profile)
 
-import paramiko
+if __name__ == "__main__":
+    # 打包成執行檔時 worker 程序會以同一個執行檔啟動，須先交給 multiprocessing 處理
+    multiprocessing.freeze_support()
+
+if __name__ == "__main__" and "--headless" in sys.argv:
+    # 無介面模式：不匯入 tkinter / pystray / PIL，直接交給轉發引擎
+    from tunnel_engine import main
+    sys.exit(main(sys.argv[1:]))
+
+if __name__ != "__mp_main__":
+    # workers=N 的 worker 以 spawn 啟動時會把本檔匯入為 __mp_main__，worker 只需要 tunnel_engine，不載入 GUI
+    import tkinter as tk
+    from tkinter import PhotoImage
+    from tkinter import messagebox
+# pystray / PIL 載入較慢，等視窗出現後才在背景建立系統匣時匯入
+
+STARTUP_PHASES = [("匯入模組", time.perf_counter())]
+VISIBLE_ROWS = 10   # 畫面上實際建立的列數，通道數量本身沒有上限
+DEFAULT_ROWS = 5    # 沒有設定檔時預先放幾條空白通道
+STATUS_COLORS = {"connected": "green", "reconnecting": "orange"}  # 其餘狀態顯示紅色
+STATUS_REFRESH_MS = 500       # 表格讀取通道狀態與流量的固定間隔；引擎的執行緒不直接排程畫面更新
+CONNECTIONS_REFRESH_MS = 1000  # 連線清單視窗的更新間隔
+LOG_REFRESH_MS = 1000          # 記錄視窗檢查新記錄的間隔
+LOG_VIEW_LINES = 500           # 記錄視窗顯示的最後幾筆
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+ICON_URL = "https://filedn.com/lv23Kcszmo74qetwMgmdPw8/shared/ssh_tunnel.png"
+ICON_DOWNLOAD_TIMEOUT = 10  # 下載圖示的逾時（秒），在背景執行緒進行，不影響啟動
+# 內建的 32x32 PNG 圖示：第一次啟動、尚未下載到圖示（或沒有網路）時使用
+ICON_PNG = (
+    "iVBORw0KGgoAAAANSUhEUgAAACAAAAAgCAYAAABzenr0AAAAiElEQVR42u3X0QnAMAgEUEfJVB2t6zZ/odCWeMXzpKmQbx9BTTR7"
+    "iLbtR+QxT0QnhTBZyW8R2ckviLUBquQDURpwDjmAhYAADMS0BtgIVxEyEe4uYCGgNmQg4DkQjXg1iKQA6Q1Ia0DaBdI54Ek+C/pb"
+    "kAZAoOGA7/6I/l9xCYB8NSuxnKrW8w4qWIAXh5+o+QAAAABJRU5ErkJggg=="
+)
 
 def get_temp_dir():
     """取得適合的暫存目錄"""
@@ -29,91 +55,155 @@ def get_temp_dir():
     else:
         return tempfile.gettempdir()  # Linux
 
+def cached_image_path(filename="ssh_tunnel.png"):
+    """圖示在暫存目錄下 ssh_tunnel_rsps1008 資料夾中的快取路徑"""
+    return os.path.join(get_temp_dir(), "ssh_tunnel_rsps1008", filename)
+
 def download_image(url, filename="ssh_tunnel.png"):
-    """從網址下載圖片並存入暫存目錄下的 ssh_tunnel_rsps1008 資料夾"""
-    temp_dir = get_temp_dir()
-    folder_path = os.path.join(temp_dir, "ssh_tunnel_rsps1008")
-    
-    # 若資料夾不存在，則新增資料夾
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    
-    file_path = os.path.join(folder_path, filename)
+    """
+    從網址下載圖片並存入快取路徑，已有快取時直接回傳；失敗時回傳 None。
+    會等待網路，只能在背景執行緒呼叫。
+    """
+    file_path = cached_image_path(filename)
     
     # 若檔案已存在，直接回傳檔案路徑
     if os.path.exists(file_path):
         return file_path
     
-    # 檔案不存在時，下載圖片
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(file_path, "wb") as file:
-            file.write(response.content)
+    import urllib.request
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=ICON_DOWNLOAD_TIMEOUT) as response:
+            data = response.read()
+        # 先寫入暫存檔再改名，下載到一半中斷也不會留下損壞的快取
+        with open(file_path + ".part", "wb") as file:
+            file.write(data)
+        os.replace(file_path + ".part", file_path)
         return file_path
-    return None
+    except Exception as e:
+        log.warning("⚠️ 下載圖示失敗，使用內建圖示: %s", e)
+        return None
 
-def forward_tunnel(local_port, remote_host, remote_port, transport):
+def format_rate(bytes_per_second):
+    if bytes_per_second >= 1024 * 1024:
+        return f"{bytes_per_second / (1024 * 1024):.1f}M"
+    return f"{bytes_per_second / 1024:.0f}K"
+
+
+class TunnelItem:
     """
-    建立本地端口轉發，並回傳監聽 socket 以及 handler 線程。
+    一條通道的資料：設定、是否啟用、目前狀態，以及啟用時引擎中的通道物件。
+    state 由引擎的執行緒直接寫入；traffic 由 GUI 的定時更新依統計計算，兩者都只在主執行緒讀取後畫到表格。
     """
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind(("127.0.0.1", local_port))
-    except Exception as e:
-        print(f"❌ 無法綁定本機端口 {local_port}: {e}")
-        return None, None
-
-    sock.listen(5)
-    print(f"🚀 本機端口 {local_port} 開始監聽，轉發到 {remote_host}:{remote_port}")
 
-    def handler():
-        while True:
-            try:
-                client_socket, addr = sock.accept()
-                channel = transport.open_channel(
-                    "direct-tcpip", (remote_host, remote_port), addr
-                )
-                if channel is None:
-                    print(f"❌ 無法開啟通道，請確認 SSH 設定是否允許轉發")
-                    client_socket.close()
-                    continue
-                threading.Thread(target=transfer, args=(client_socket, channel), daemon=True).start()
-            except OSError as e:
-                if e.errno != errno.WSAENOTSOCK:  # 10038 對應的錯誤碼
-                    print(f"⚠️ 其他 socket 錯誤: {e}")
-            except Exception as e:
-                print(f"⚠️ 轉發失敗: {e}")
-                break
-        sock.close()
+    def __init__(self, spec=None):
+        self.spec = spec or TunnelSpec()
+        self.enabled = False
+        self.state = "stopped"
+        self.tunnel = None
+        self.generation = 0  # 每次啟用加一，用來忽略上一次啟用遺留的狀態通知
+        self.traffic = None  # 最近一次取樣：{"connections", "up", "down", "reconnect_attempts", "next_retry"}
+        self._sample = None  # (時間, bytes_out, bytes_in)，用來算出兩次取樣之間的速率
+
+    def sample(self, now):
+        """讀取引擎統計並更新 traffic；只對畫面上看得到的列呼叫，成本與流量、連線數無關"""
+        tunnel = self.tunnel
+        if tunnel is None:
+            self.traffic = self._sample = None
+            return
+        counters = tunnel.stats.counters()
+        up = down = 0.0
+        if self._sample is not None and now > self._sample[0]:
+            elapsed = now - self._sample[0]
+            up = max(0, counters["bytes_out"] - self._sample[1]) / elapsed
+            down = max(0, counters["bytes_in"] - self._sample[2]) / elapsed
+        self._sample = (now, counters["bytes_out"], counters["bytes_in"])
+        self.traffic = {
+            "connections": counters["active_connections"],
+            "up": up,
+            "down": down,
+            "reconnect_attempts": counters["reconnect_attempts"],
+            "next_retry": counters["next_retry"],
+        }
+
+    def traffic_text(self):
+        if not self.enabled or self.traffic is None:
+            return ""
+        traffic = self.traffic
+        if self.state == "reconnecting":
+            wait = traffic["next_retry"] - time.time()
+            when = f"{wait:.0f} 秒後重試" if wait > 0 else "重試中"
+            return f"重新連線：{when}（第 {traffic['reconnect_attempts']} 次）"
+        return f"{traffic['connections']} 連線 ↑{format_rate(traffic['up'])} ↓{format_rate(traffic['down'])}"
+
+
+class TunnelTable:
+    """
+    表格的資料模型：所有通道、依搜尋條件篩選出的 view，以及畫面第一列對應 view 中的位置。
+    不含 Tk 元件；App 依 visible() 把 TunnelItem 綁到固定的 rows 列上。
+    """
 
-    t = threading.Thread(target=handler, daemon=True)
-    t.start()
-    return sock, t
+    def __init__(self, rows=VISIBLE_ROWS):
+        self.rows = rows
+        self.items = []   # 所有通道（TunnelItem）
+        self.view = []    # 符合搜尋條件的通道
+        self.offset = 0   # 表格第一列對應 view 中的位置
+
+    def apply_filter(self, keyword=""):
+        """依搜尋字串（不分大小寫，比對備註）重建 view，並回到第一頁"""
+        keyword = keyword.strip().lower()
+        if keyword:
+            self.view = [item for item in self.items if keyword in item.spec.remark.lower()]
+        else:
+            self.view = list(self.items)
+        self.offset = 0
+
+    def scroll_to(self, offset):
+        """捲動到 offset（限制在可捲動的範圍內），位置有變化時回傳 True"""
+        offset = max(0, min(offset, len(self.view) - self.rows))
+        if offset == self.offset:
+            return False
+        self.offset = offset
+        return True
+
+    def scroll(self, action, value, unit=None):
+        """Scrollbar 的 command：拖曳為 moveto，點擊箭頭 / 空白處為 scroll"""
+        if action == "moveto":
+            return self.scroll_to(round(float(value) * len(self.view)))
+        if action == "scroll":
+            step = self.rows if unit == "pages" else 1
+            return self.scroll_to(self.offset + int(value) * step)
+        return False
+
+    def visible(self):
+        """畫面上每一列要顯示的 TunnelItem，view 不足的列為 None"""
+        visible = self.view[self.offset:self.offset + self.rows]
+        return visible + [None] * (self.rows - len(visible))
+
+    def scrollbar(self):
+        """Scrollbar.set() 的 (first, last)"""
+        if not self.view:
+            return 0.0, 1.0
+        return self.offset / len(self.view), min(1.0, (self.offset + self.rows) / len(self.view))
+
+    def to_enable(self):
+        """「全部啟用」的對象：目前篩選出、尚未啟用且欄位完整的通道"""
+        return [item for item in self.view if not item.enabled and item.spec.is_complete()]
+
+    def to_disable(self):
+        """「全部停用」的對象：目前篩選出、已啟用或仍有通道物件的通道"""
+        return [item for item in self.view if item.enabled or item.tunnel]
 
-def transfer(source, destination):
-    while True:
-        try:
-            r, w, x = select.select([source, destination], [], [])
-            if source in r:
-                data = source.recv(1024)
-                if len(data) == 0:
-                    break
-                destination.send(data)
-            if destination in r:
-                data = destination.recv(1024)
-                if len(data) == 0:
-                    break
-                source.send(data)
-        except Exception as e:
-            print(f"⚠️ 資料轉發錯誤: {e}")
-            break
-    source.close()
-    destination.close()
 
 class TunnelRow:
+    """
+    表格中可重複使用的一列。列數固定為 VISIBLE_ROWS，捲動或篩選時以 bind() 換上不同的 TunnelItem，
+    因此通道再多，畫面上的元件數量也不變。
+    """
+
     def __init__(self, master, row, app):
         self.app = app
+        self.item = None
         self.frame = tk.Frame(master)
         self.frame.grid(row=row, column=0, padx=5, pady=2, sticky="w")
 
@@ -122,42 +212,76 @@ class TunnelRow:
         self.target_ip_entry = tk.Entry(self.frame, width=14)
         self.target_port_entry = tk.Entry(self.frame, width=8)
         self.remark_entry = tk.Entry(self.frame, width=14)
+        # 額外選項 key=value;key=value，例如 type=socks5 為動態轉發（不需填對方 IP / Port）
+        self.options_entry = tk.Entry(self.frame, width=16)
 
         self.local_entry.grid(row=0, column=0, padx=2)
         self.target_ip_entry.grid(row=0, column=1, padx=2)
         self.target_port_entry.grid(row=0, column=2, padx=2)
         self.remark_entry.grid(row=0, column=3, padx=2)
+        self.options_entry.grid(row=0, column=4, padx=2)
+        # 編輯完成（離開欄位或按 Enter）就寫回 TunnelItem
+        for entry in self.entries():
+            entry.bind("<FocusOut>", lambda event: self.commit())
+            entry.bind("<Return>", lambda event: self.commit())
 
         # 狀態燈
         self.status_label = tk.Label(self.frame, text="●", fg="red", font=("Arial", 25), anchor="center", justify="center", width=4)
-        self.status_label.grid(row=0, column=4, padx=0, sticky="nsew")
-        
+        self.status_label.grid(row=0, column=5, padx=0, sticky="nsew")
+        # 點兩下狀態燈：開啟只顯示這條通道的記錄
+        self.status_label.bind("<Double-Button-1>", lambda event: self.item and self.app.show_log(self.item.spec.name))
 
         # 是否啟用此通道的 Checkbutton
         self.enable_var = tk.BooleanVar(value=False)
         self.checkbutton = tk.Checkbutton(self.frame, variable=self.enable_var, command=self.on_check_change, anchor="center", justify="center", width=3)
-        self.checkbutton.grid(row=0, column=5, padx=5)
-        
-        self.frame.grid_columnconfigure(4, weight=1)
-
-        # SSH 相關變數
-        self.ssh_client = None
-        self.transport = None
-        self.tunnel_socket = None  # 確保變數初始化
-        self.tunnel_thread = None  # 確保變數初始化
-        self.connected = False
-        
-        self.checkbutton = tk.Checkbutton(
-            self.frame,
-            variable=self.enable_var,
-            command=self.on_check_change,
-            anchor="center",
-            justify="center",
-            width=40,   # 可以調整數值
-            height=50,  # 可以調整數值
-            indicatoron=0  # 取消預設的勾選框
-        )
+        self.checkbutton.grid(row=0, column=6, padx=5)
+
+        # 連線數與上下行速率；重新連線時顯示下一次重試
+        self.traffic_label = tk.Label(self.frame, text="", width=26, anchor="w")
+        self.traffic_label.grid(row=0, column=7, padx=5)
+        self.shown = None  # 目前畫面上的 (顏色, 勾選, 文字)，沒有變化就不呼叫 Tk
 
+        self.frame.grid_columnconfigure(5, weight=1)
+
+    def entries(self):
+        return (self.local_entry, self.target_ip_entry, self.target_port_entry, self.remark_entry, self.options_entry)
+
+    def bind(self, item):
+        """顯示另一個 TunnelItem；item 為 None 時隱藏這一列"""
+        self.commit()
+        self.item = item
+        if item is None:
+            self.frame.grid_remove()
+            return
+        spec = item.spec
+        values = (spec.local_port, spec.target_ip, spec.target_port, spec.remark, format_options(spec.options))
+        for entry, value in zip(self.entries(), values):
+            entry.delete(0, tk.END)
+            entry.insert(0, value)
+        self.frame.grid()
+        self.refresh()
+
+    def refresh(self):
+        """依 TunnelItem 更新狀態燈、勾選狀態與流量（需在主執行緒呼叫）"""
+        if self.item is None:
+            return
+        shown = (STATUS_COLORS.get(self.item.state, "red"), self.item.enabled, self.item.traffic_text())
+        if shown == self.shown:
+            return
+        self.shown = shown
+        self.status_label.config(fg=shown[0])
+        self.enable_var.set(shown[1])
+        self.traffic_label.config(text=shown[2])
+
+    def commit(self):
+        """把欄位內容寫回 TunnelItem"""
+        if self.item is None:
+            return
+        values = self.get_values()
+        options = parse_options(self.options_entry.get().strip())
+        spec = self.item.spec
+        if values != (spec.local_port, spec.target_ip, spec.target_port, spec.remark) or options != spec.options:
+            self.item.spec = TunnelSpec(*values, options=options)
 
     def get_values(self):
         return (
@@ -174,94 +298,24 @@ class TunnelRow:
         若有效，則以執行緒方式嘗試建立隧道；
         如果取消勾選，就以執行緒方式停止隧道。
         """
+        self.commit()
         if self.enable_var.get():
-            # 使用者勾選 -> 檢查欄位
-            local_port, target_ip, target_port, _ = self.get_values()
-            if not (local_port and target_ip and target_port):
-                # 若欄位未填寫完整，就立刻取消勾選
-                print("本地 Port、對方 IP、對方 Port 有未填寫，取消勾選。")
+            if not self.item.spec.is_complete():
+                # 若欄位未填寫完整，就立刻取消勾選（type=socks5 只需要本地 Port）
+                log.warning("本地 Port、對方 IP、對方 Port 有未填寫，取消勾選。")
                 self.enable_var.set(False)
                 return
-            else:
-                # 欄位都填了 -> 使用執行緒連線
-                threading.Thread(target=self.start_tunnel, daemon=True).start()
+            self.app.sync_server()
+            tunnel = self.app.enable_item(self.item)
+            threading.Thread(target=tunnel.start, daemon=True).start()
         else:
-            # 使用者取消勾選 -> 使用執行緒停止隧道
-            threading.Thread(target=self.stop_tunnel, daemon=True).start()
-
-    def start_tunnel(self):
-        local_port, target_ip, target_port, _ = self.get_values()
-        remote_server = self.app.remote_entry.get().strip()
-        password = self.app.password_entry.get().strip()
-
-        if "@" not in remote_server:
-            print(f"錯誤：遠端伺服器格式錯誤 {remote_server}，請使用 user@host")
-            self.set_status("red")
-            return
-
-        ssh_user, ssh_host = remote_server.split("@")
-        try:
-            print(f"嘗試連線到 {ssh_host}，使用帳號 {ssh_user}...")
-            self.ssh_client = paramiko.SSHClient()
-            self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.ssh_client.connect(ssh_host, port=22, username=ssh_user, password=password,
-                                    timeout=5, banner_timeout=5, auth_timeout=5)
-            self.transport = self.ssh_client.get_transport()
-            self.transport.set_keepalive(30)
-
-            # 保存 forward_tunnel 回傳的監聽 socket 與 handler 線程
-            self.tunnel_socket, self.tunnel_thread = forward_tunnel(
-                int(local_port), target_ip, int(target_port), self.transport
-            )
-            self.connected = True
-            self.set_status("green")
-            print(f"✅ 成功建立隧道: {local_port} -> {target_ip}:{target_port}")
-
-        except Exception as e:
-            self.connected = False
-            self.set_status("red")
-            print(f"❌ SSH 連線失敗: {e}")
-
-            if self.enable_var.get():
-                print(f"10 秒後再次嘗試通道：{local_port} -> {target_ip}:{target_port}")
-                threading.Timer(10.0, self.start_tunnel).start()
-
-    def stop_tunnel(self):
-        if self.tunnel_socket:
-            try:
-                self.tunnel_socket.close()
-                print("監聽 socket 已關閉")
-            except Exception as e:
-                print(f"關閉監聽 socket 時發生錯誤: {e}")
-            self.tunnel_socket = None
-
-        if self.transport:
-            try:
-                self.transport.close()
-                print("SSH 連線已關閉")
-            except Exception as e:
-                print(f"關閉 SSH 連線時發生錯誤: {e}")
-            self.transport = None
-
-        if self.ssh_client:
-            try:
-                self.ssh_client.close()
-                print("SSH 客戶端已關閉")
-            except Exception as e:
-                print(f"關閉 SSH 客戶端時發生錯誤: {e}")
-            self.ssh_client = None
+            tunnel = self.app.disable_item(self.item)
+            threading.Thread(target=self.app.stop_tunnel, args=(self.item, tunnel), daemon=True).start()
 
-        self.connected = False
-        self.set_status("red")
-        
-    def set_status(self, color):
-        # 使用 after 回到主執行緒更新 GUI
-        def _update():
-            self.status_label.config(fg=color)
-        self.app.master.after(0, _update)
 
 class App:
-    def __init__(self, master):
+    def __init__(self, master, background=True):
+        """background 為 False 時不在背景載入系統匣、paramiko 與圖示（--profile-startup 用來確認啟動路徑本身載入了哪些模組）"""
         self.master = master
         master.title("SSH 通道管理")
 
@@ -277,27 +331,53 @@ class App:
         self.password_entry = tk.Entry(self.config_frame, width=30, show="*")
         self.password_entry.grid(row=1, column=1, padx=5, sticky="w")
 
-        # 通道資訊
-        self.tunnel_rows = []
+        # 轉發引擎與通道資訊（GUI 只負責輸入與顯示）
+        self.engine = TunnelEngine()
+        # crypto=auto 選出的加密設定立即存檔（從背景執行緒回呼，交回 UI 執行緒處理）
+        self.engine.on_profile_chosen = lambda profile: self.master.after(0, self.save_crypto_profile, profile)
+        self.table = TunnelTable(VISIBLE_ROWS)  # 所有通道、篩選結果與捲動位置
+        self.tunnel_rows = []  # 固定 VISIBLE_ROWS 列，捲動時重複使用
+        self._items_lock = threading.RLock()  # 保護 TunnelItem.tunnel 的建立與取出
 
         # 通道設定區塊
         self.row_frame = tk.Frame(master)
         self.row_frame.pack(padx=10, pady=10)
+
+        # 以備註搜尋 / 篩選
+        search_frame = tk.Frame(self.row_frame)
+        search_frame.grid(row=0, column=0, columnspan=2, sticky="w", pady=(0, 5))
+        tk.Label(search_frame, text="搜尋備註").grid(row=0, column=0, padx=5)
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.apply_filter())
+        tk.Entry(search_frame, textvariable=self.search_var, width=24).grid(row=0, column=1, padx=5)
+        self.count_label = tk.Label(search_frame, text="")
+        self.count_label.grid(row=0, column=2, padx=5)
+
         header = tk.Frame(self.row_frame)
-        header.grid(row=0, column=0, sticky="w")
+        header.grid(row=1, column=0, sticky="w")
         tk.Label(header, text="本地 Port", width=8).grid(row=0, column=0, padx=2)
         tk.Label(header, text="對方 IP", width=14).grid(row=0, column=1, padx=2)
         tk.Label(header, text="對方 Port", width=8).grid(row=0, column=2, padx=2)
         tk.Label(header, text="備註", width=14).grid(row=0, column=3, padx=2)
-        tk.Label(header, text="狀態", width=5).grid(row=0, column=4, padx=10)
-        tk.Label(header, text="啟用", width=5).grid(row=0, column=5, padx=5)
+        tk.Label(header, text="選項", width=16).grid(row=0, column=4, padx=2)
+        tk.Label(header, text="狀態", width=5).grid(row=0, column=5, padx=10)
+        tk.Label(header, text="啟用", width=5).grid(row=0, column=6, padx=5)
+        tk.Label(header, text="連線 / 流量", width=26, anchor="w").grid(row=0, column=7, padx=5)
 
         self.rows_container = tk.Frame(self.row_frame)
-        self.rows_container.grid(row=1, column=0, sticky="w")
-
-        # 初始化預設列
-        for i in range(DEFAULT_ROWS):
-            self.add_row()
+        self.rows_container.grid(row=2, column=0, sticky="w")
+        self.scrollbar = tk.Scrollbar(self.row_frame, orient="vertical", command=self.on_scroll)
+        self.scrollbar.grid(row=2, column=1, sticky="ns")
+        for i in range(VISIBLE_ROWS):
+            self.tunnel_rows.append(TunnelRow(self.rows_container, row=i, app=self))
+        # 滑鼠滾輪：Windows / macOS 為 <MouseWheel>，Linux 為 Button-4 / Button-5；
+        # 由 on_wheel 判斷游標是否在通道列上，其他視窗（記錄、連線清單）的滾輪不受影響
+        master.bind_all("<MouseWheel>", lambda event: self.on_wheel(event, -1 if event.delta > 0 else 1))
+        master.bind_all("<Button-4>", lambda event: self.on_wheel(event, -1))
+        master.bind_all("<Button-5>", lambda event: self.on_wheel(event, 1))
+        # 預設的空白通道，load_config 成功時會被設定檔內容取代
+        self.table.items = [TunnelItem() for i in range(DEFAULT_ROWS)]
+        self.apply_filter()
 
         # 下方按鈕：全部啟用、全部停用、及 新增通道
         self.button_frame = tk.Frame(master)
@@ -314,6 +394,12 @@ class App:
 
         # 載入設定檔（不會載入勾選狀態）
         self.load_config()
+        self.engine.start_logging()  # 依 log_level / log_file 選項；記錄也會出現在「記錄」視窗
+        self.engine.start_metrics_server()  # 設定檔有 metrics_port 選項時才啟動
+        # 設定檔被外部修改時（例如部署工具改了某條轉發），交回 UI 執行緒只套用差異
+        self.config_watcher = ConfigWatcher(default_config_path(),
+                                            lambda config: self.master.after(0, self.reload_config, config))
+        self.config_watcher.start()
        
         # 打開 host 檔案
         self.edit_hosts_button = tk.Button(self.button_frame, text="編輯 hosts", command=self.open_hosts_file)
@@ -322,13 +408,28 @@ class App:
         # 儲存 config 檔案
         self.save_config_button = tk.Button(self.button_frame, text="儲存 config", command=self.save_config_button)
         self.save_config_button.grid(row=0, column=4, padx=5)
+
+        # 目前轉發中的連線（存活時間、閒置時間、流量）
+        self.connections_button = tk.Button(self.button_frame, text="連線清單", command=self.show_connections)
+        self.connections_button.grid(row=0, column=5, padx=5)
+        self.connections_window = None
+
+        # 最近的記錄，可依通道名稱與等級篩選
+        self.log_button = tk.Button(self.button_frame, text="記錄", command=self.show_log)
+        self.log_button.grid(row=0, column=6, padx=5)
+        self.log_window = None
+
+        # 效能分析：不中斷通道，停止時把取樣結果與連線追蹤（選項 trace）寫到設定檔所在的資料夾
+        self.profile_button = tk.Button(self.button_frame, text="效能分析", command=self.toggle_profiler)
+        self.profile_button.grid(row=0, column=7, padx=5)
         
-        image_url = "https://filedn.com/lv23Kcszmo74qetwMgmdPw8/shared/ssh_tunnel.png"
-        self.icon_path = download_image(image_url)  # 確保 icon_path 存在
-        
-        if self.icon_path:
-            self.icon_image = PhotoImage(file=self.icon_path)
-            master.wm_iconphoto(True, self.icon_image)  # 設定 Tkinter 圖示
+        # 有快取就用快取的圖示，否則先用內建圖示，並在背景下載，完成後再換上
+        cached = cached_image_path()
+        self.icon_path = cached if os.path.exists(cached) else None
+        self.tray_icon = None
+        self.set_icon(self.icon_path)
+        if self.icon_path is None and background:
+            threading.Thread(target=self.fetch_icon, name="icon_download", daemon=True).start()
 
         # 關閉視窗事件
         # 設定「X」按鈕直接關閉程式
@@ -336,7 +437,36 @@ class App:
 
         # 監聽最小化事件
         self.master.bind("<Unmap>", self.on_minimize)
-        self.create_tray_icon()  # 啟動系統匣
+        # 系統匣與 paramiko 都在背景載入，不延遲視窗出現
+        if background:
+            threading.Thread(target=self.create_tray_icon, name="tray_icon", daemon=True).start()
+            threading.Thread(target=preload, name="preload", daemon=True).start()
+        self.master.after(STATUS_REFRESH_MS, self.tick)
+
+    def set_icon(self, path):
+        """設定 Tkinter 視窗圖示；path 為 None 時使用內建圖示"""
+        if path:
+            self.icon_image = PhotoImage(file=path)
+        else:
+            self.icon_image = PhotoImage(data=ICON_PNG)
+        self.master.wm_iconphoto(True, self.icon_image)
+
+    def fetch_icon(self):
+        """背景執行緒：下載圖示，成功後交回 UI 執行緒換上"""
+        path = download_image(ICON_URL)
+        if path:
+            self.master.after(0, self.on_icon_downloaded, path)
+
+    def on_icon_downloaded(self, path):
+        self.icon_path = path
+        try:
+            self.set_icon(path)
+        except tk.TclError as e:
+            log.warning("⚠️ 無法載入下載的圖示: %s", e)
+            return
+        if self.tray_icon is not None:
+            from PIL import Image
+            self.tray_icon.icon = Image.open(path)
 
     def restore_window(self, icon, item):
         """從系統匣恢復窗口"""
@@ -345,35 +475,128 @@ class App:
     
     def on_minimize(self, event):
         """當使用者點擊最小化時，隱藏 Tkinter 窗口，並顯示到系統匣"""
-        if self.master.state() == "iconic":  # 確保是最小化狀態
+        # 系統匣尚未建立（或 pystray 無法使用）時維持一般的最小化，否則視窗會無法還原
+        if self.master.state() == "iconic" and self.tray_icon is not None:  # 確保是最小化狀態
             self.master.withdraw()  # 隱藏窗口
             self.tray_icon.visible = True  # 顯示系統匣圖示
     
     def on_closing(self):
         """退出應用程式"""
-        self.tray_icon.stop()  # 停止系統匣
+        if self.tray_icon is not None:
+            self.tray_icon.stop()  # 停止系統匣
         self.master.destroy()  # 關閉 Tkinter 應用
 
     def create_tray_icon(self):
-        """建立系統匣圖示"""
-        if not self.icon_path:
+        """建立系統匣圖示（在背景執行緒執行，pystray / PIL 在此才匯入）"""
+        try:
+            import io
+            import pystray  # 系統匣支援
+            from PIL import Image  # pystray 需要 PIL 處理圖像
+        except ImportError as e:
+            log.warning("⚠️ 無法使用系統匣: %s", e)
             return
 
         # 轉換圖示為 PIL 格式
-        icon_image = Image.open(self.icon_path)
+        icon_image = Image.open(self.icon_path or io.BytesIO(base64.b64decode(ICON_PNG)))
 
         # 建立系統匣圖示
-        self.tray_icon = pystray.Icon("SSH 管理程式", icon_image, "SSH 管理程式", menu=pystray.Menu(
+        tray_icon = pystray.Icon("SSH 管理程式", icon_image, "SSH 管理程式", menu=pystray.Menu(
             pystray.MenuItem("還原程式", self.restore_window, default=True),
             pystray.MenuItem("退出程式", self.on_closing)
         ))
-        self.tray_icon.icon = icon_image
-        self.tray_icon.visible = False
-        self.tray_icon.on_click = self.restore_window
+        tray_icon.icon = icon_image
+        tray_icon.visible = False
+        tray_icon.on_click = self.restore_window
+        self.tray_icon = tray_icon
 
         # 以執行緒方式啟動系統匣
         threading.Thread(target=self.tray_icon.run, daemon=True).start()
         
+    def show_connections(self):
+        if self.connections_window is not None:
+            self.connections_window.lift()
+            return
+        window = tk.Toplevel(self.master)
+        window.title("連線清單")
+        text = tk.Text(window, width=110, height=20, font=("Consolas", 9))
+        text.pack(fill="both", expand=True)
+        window.protocol("WM_DELETE_WINDOW", self.close_connections)
+        self.connections_window = window
+        self.connections_text = text
+        self.refresh_connections()
+
+    def close_connections(self):
+        window, self.connections_window = self.connections_window, None
+        if window is not None:
+            window.destroy()
+
+    def refresh_connections(self):
+        if self.connections_window is None:
+            return
+        lines = [f"{'通道':<16}{'來源':<22}{'目的地':<26}{'存活(秒)':>10}{'閒置(秒)':>10}{'送出':>12}{'接收':>12}{'MB/s':>8}"]
+        for conn in self.engine.connections():
+            lines.append(f"{conn['tunnel'][:15]:<16}{conn['client']:<22}{conn['target'][:25]:<26}"
+                         f"{conn['seconds']:>10}{conn['idle_seconds']:>10}"
+                         f"{conn['bytes_out']:>12}{conn['bytes_in']:>12}{conn['mb_per_s']:>8}")
+        if len(lines) == 1:
+            lines.append("（目前沒有連線）")
+        self.connections_text.config(state="normal")
+        self.connections_text.delete("1.0", tk.END)
+        self.connections_text.insert(tk.END, "\n".join(lines))
+        self.connections_text.config(state="disabled")
+        self.master.after(CONNECTIONS_REFRESH_MS, self.refresh_connections)
+
+    def show_log(self, tunnel=""):
+        if self.log_window is not None:
+            self.log_tunnel_var.set(tunnel)
+            self.log_window.lift()
+            return
+        window = tk.Toplevel(self.master)
+        window.title("記錄")
+        filter_frame = tk.Frame(window)
+        filter_frame.pack(fill="x", padx=5, pady=5)
+        tk.Label(filter_frame, text="通道").grid(row=0, column=0, padx=5)
+        self.log_tunnel_var = tk.StringVar(value=tunnel)
+        tk.Entry(filter_frame, textvariable=self.log_tunnel_var, width=20).grid(row=0, column=1, padx=5)
+        tk.Label(filter_frame, text="最低等級").grid(row=0, column=2, padx=5)
+        self.log_level_var = tk.StringVar(value="INFO")
+        tk.OptionMenu(filter_frame, self.log_level_var, *LOG_LEVELS).grid(row=0, column=3, padx=5)
+        text = tk.Text(window, width=120, height=25, font=("Consolas", 9))
+        text.pack(fill="both", expand=True)
+        window.protocol("WM_DELETE_WINDOW", self.close_log)
+        self.log_window = window
+        self.log_text = text
+        self._log_shown = None
+        self.refresh_log()
+
+    def close_log(self):
+        window, self.log_window = self.log_window, None
+        if window is not None:
+            window.destroy()
+
+    def refresh_log(self):
+        if self.log_window is None:
+            return
+        # 沒有新記錄、篩選條件也沒變時不重畫
+        shown = (log_buffer.serial, self.log_tunnel_var.get(), self.log_level_var.get())
+        if shown != self._log_shown:
+            self._log_shown = shown
+            records = log_buffer.records(shown[1], parse_log_level(shown[2]), LOG_VIEW_LINES)
+            lines = [f"{time.strftime('%H:%M:%S', time.localtime(r['time']))} {r['level']:<7} "
+                     f"[{r['tunnel']}] {r['message']}" for r in records]
+            self.log_text.config(state="normal")
+            self.log_text.delete("1.0", tk.END)
+            self.log_text.insert(tk.END, "\n".join(lines))
+            self.log_text.config(state="disabled")
+            self.log_text.see(tk.END)
+        self.master.after(LOG_REFRESH_MS, self.refresh_log)
+
+    def toggle_profiler(self):
+        running = self.engine.toggle_profiler(os.path.dirname(default_config_path()))
+        self.profile_button.config(text="停止分析" if running else "效能分析")
+        if not running:
+            messagebox.showinfo("效能分析", self.engine.profiler.summary())
+
     def save_config_button(self):
         self.save_config()
         messagebox.showinfo("提示", "設定檔已儲存")
@@ -406,107 +629,277 @@ class App:
                 messagebox.showerror("錯誤", f"無法以管理員權限打開 hosts 檔案: {e}")
 
     def add_row(self):
-        if len(self.tunnel_rows) >= MAX_ROWS:
-            messagebox.showinfo("提示", f"最多只能新增 {MAX_ROWS} 組通道")
+        """新增一條空白通道，並捲動到它的位置（會先清除搜尋條件）"""
+        self.commit_rows()
+        self.table.items.append(TunnelItem())
+        if self.search_var.get():
+            self.search_var.set("")  # 觸發 apply_filter
+        else:
+            self.apply_filter()
+        self.scroll_to(len(self.table.view))
+
+    def commit_rows(self):
+        for row in self.tunnel_rows:
+            row.commit()
+
+    def apply_filter(self):
+        """依搜尋字串重建篩選結果，並回到第一頁"""
+        self.commit_rows()
+        self.table.apply_filter(self.search_var.get())
+        self.count_label.config(text=f"顯示 {len(self.table.view)} / {len(self.table.items)} 條")
+        self.redraw()
+
+    def scroll_to(self, offset):
+        if self.table.scroll_to(offset):
+            self.redraw()
+
+    def on_scroll(self, action, value, unit=None):
+        if self.table.scroll(action, value, unit):
+            self.redraw()
+
+    def on_wheel(self, event, step):
+        """游標在通道列或捲軸上時才捲動一列"""
+        # Windows 的滾輪事件送往有焦點的元件，以游標位置判斷
+        try:
+            widget = self.master.winfo_containing(event.x_root, event.y_root)
+        except KeyError:  # 游標在非 tkinter 建立的元件上（例如下拉選單）
             return
-        row = TunnelRow(self.rows_container, row=len(self.tunnel_rows), app=self)
-        self.tunnel_rows.append(row)
+        name = str(widget or "")
+        for parent in (str(self.rows_container), str(self.scrollbar)):
+            if name == parent or name.startswith(parent + "."):
+                self.scroll_to(self.table.offset + step)
+                return
 
-    def enable_all(self):
+    def redraw(self):
+        for row, item in zip(self.tunnel_rows, self.table.visible()):
+            row.bind(item)
+        self.scrollbar.set(*self.table.scrollbar())
+
+    def refresh_rows(self):
+        """只更新畫面上看得到的列"""
+        for row in self.tunnel_rows:
+            row.refresh()
+
+    def tick(self):
         """
-        全部啟用：若本地 Port、對方 IP、對方 Port 三欄都有填寫，才勾選，否則跳過。
+        固定間隔的畫面更新：引擎的執行緒只改寫 TunnelItem.state 與統計數值，
+        由這裡一次讀取看得到的列並重畫，狀態變化再頻繁、流量再大，每次的成本都只有 VISIBLE_ROWS 列。
         """
+        now = time.monotonic()
         for row in self.tunnel_rows:
-            local_port, target_ip, target_port, _ = row.get_values()
-            if local_port and target_ip and target_port:
-                row.enable_var.set(True)
-                row.on_check_change()
-            else:
-                row.enable_var.set(False)
-                row.on_check_change()
+            if row.item is not None:
+                row.item.sample(now)
+        self.refresh_rows()
+        self.master.after(STATUS_REFRESH_MS, self.tick)
+
+    def enable_item(self, item):
+        """在引擎中建立通道（不啟動），回傳 Tunnel；呼叫前須先 sync_server()"""
+        with self._items_lock:
+            item.enabled = True
+            item.generation += 1
+            generation = item.generation
+
+            def on_status(state):
+                # 由引擎的執行緒呼叫：只記下狀態，下一次 tick 才畫到表格上
+                if item.generation == generation:
+                    item.state = state
+
+            item.tunnel = self.engine.add_tunnel(item.spec, on_status=on_status)
+            return item.tunnel
+
+    def disable_item(self, item):
+        """標記為停用並取出引擎中的通道，交給 stop_tunnel 在背景停止"""
+        with self._items_lock:
+            item.enabled = False
+            tunnel, item.tunnel = item.tunnel, None
+            return tunnel
+
+    def stop_tunnel(self, item, tunnel):
+        if tunnel:
+            self.engine.remove_tunnel(tunnel)
+        else:
+            item.state = "stopped"
+
+    def enable_all(self):
+        """
+        全部啟用：對目前篩選出的通道，三欄都有填寫的才啟用。
+        建立與啟動通道都在背景執行緒進行，不會卡住畫面。
+        """
+        self.commit_rows()
+        self.sync_server()
+        items = self.table.to_enable()
+        for item in items:
+            item.enabled = True
+        self.refresh_rows()
+
+        def worker():
+            for item in items:
+                with self._items_lock:
+                    # 背景啟用期間使用者可能又停用了某些通道
+                    if not item.enabled or item.tunnel is not None:
+                        continue
+                    tunnel = self.enable_item(item)
+                threading.Thread(target=tunnel.start, daemon=True).start()
+
+        threading.Thread(target=worker, daemon=True).start()
 
     def disable_all(self):
-        """全部停用：直接把所有通道都取消勾選。"""
-        for row in self.tunnel_rows:
-            row.enable_var.set(False)
-            row.on_check_change()
+        """全部停用：把目前篩選出的通道都停用，停止動作在背景執行緒依序進行。"""
+        items = self.table.to_disable()
+        tunnels = [(item, self.disable_item(item)) for item in items]
+        self.refresh_rows()
+
+        def worker():
+            for item, tunnel in tunnels:
+                self.stop_tunnel(item, tunnel)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def sync_server(self):
+        """把畫面上的遠端伺服器與密碼同步到引擎（需在主執行緒呼叫）"""
+        self.engine.set_server(self.remote_entry.get().strip(), self.password_entry.get().strip())
 
     def load_config(self):
         """
-        載入檔案時，只讀取本地 Port、對方 IP、對方 Port、備註四欄。
+        載入檔案時，只讀取本地 Port、對方 IP、對方 Port、備註四欄（及額外選項）。
         不載入「啟用狀態」，預設一律為未勾選。
         """
-        config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILE)
-        if os.path.exists(config_path):
-            try:
-                with open(config_path, "r", encoding="utf-8") as f:
-                    lines = f.readlines()
-                # 若第一行為全域設定 (以 "GLOBAL," 為開頭)
-                if len(lines) > 0 and lines[0].startswith("GLOBAL,"):
-                    global_line = lines[0].strip()
-                    parts = global_line.split(",")
-                    if len(parts) >= 3:
-                        self.remote_entry.delete(0, tk.END)
-                        self.remote_entry.insert(0, parts[1])
-                        self.password_entry.delete(0, tk.END)
-                        self.password_entry.insert(0, parts[2])
-                    lines = lines[1:]  # 移除全域設定行
-
-                # 若檔案中的通道數量 > 目前 rows，就動態增加 rows
-                while len(lines) > len(self.tunnel_rows) and len(self.tunnel_rows) < MAX_ROWS:
-                    self.add_row()
-
-                # 逐行讀取每條通道設定 (只載入四個欄位)
-                for i, line in enumerate(lines):
-                    parts = line.strip().split(",")
-                    if len(parts) >= 3 and i < len(self.tunnel_rows):
-                        self.tunnel_rows[i].local_entry.delete(0, tk.END)
-                        self.tunnel_rows[i].local_entry.insert(0, parts[0])
-
-                        self.tunnel_rows[i].target_ip_entry.delete(0, tk.END)
-                        self.tunnel_rows[i].target_ip_entry.insert(0, parts[1])
-
-                        self.tunnel_rows[i].target_port_entry.delete(0, tk.END)
-                        self.tunnel_rows[i].target_port_entry.insert(0, parts[2])
-
-                        remark = parts[3] if len(parts) >= 4 else ""
-                        self.tunnel_rows[i].remark_entry.delete(0, tk.END)
-                        self.tunnel_rows[i].remark_entry.insert(0, remark)
-
-                    # 啟用狀態不讀，預設不勾選
+        try:
+            config = load_config(default_config_path())
+        except Exception as e:
+            log.error("載入設定失敗: %s", e)
+            return
 
-            except Exception as e:
-                print("載入設定失敗:", e)
+        if config.remote or config.password:
+            self.remote_entry.delete(0, tk.END)
+            self.remote_entry.insert(0, config.remote)
+            self.password_entry.delete(0, tk.END)
+            self.password_entry.insert(0, config.password)
+        self.engine.options = config.options
+
+        # 啟用狀態不讀，預設不勾選；通道數量沒有上限
+        self.table.items = [TunnelItem(spec) for spec in config.tunnels]
+        while len(self.table.items) < DEFAULT_ROWS:
+            self.table.items.append(TunnelItem())
+        self.apply_filter()
+
+    def reload_config(self, config):
+        """
+        套用外部修改後的設定檔：以本地 Port 對應現有通道，保留它們的勾選狀態，
+        只有已啟用且目的地、選項或伺服器有變更的通道會重新啟動，設定檔中已刪除的通道會停用並移除。
+        是否重新啟動以執行中通道的設定比較，表格中尚未套用的修改不影響判斷；只改備註時直接更新執行中通道的名稱。
+        """
+        self.commit_rows()
+        with self._items_lock:
+            before = {item: (item.tunnel, self.engine.signature(item.tunnel.spec))
+                      for item in self.table.items if item.tunnel}
+        # 先解除畫面列與 TunnelItem 的綁定，避免之後把舊的欄位內容寫回新的設定
+        for row in self.tunnel_rows:
+            row.bind(None)
+
+        self.remote_entry.delete(0, tk.END)
+        self.remote_entry.insert(0, config.remote)
+        self.password_entry.delete(0, tk.END)
+        self.password_entry.insert(0, config.password)
+        self.engine.update_settings(config.remote, config.password, config.options)
+
+        by_port = {item.spec.local_port: item for item in self.table.items if item.spec.local_port}
+        items, restart, added = [], [], 0
+        for spec in config.tunnels:
+            item = by_port.pop(spec.local_port, None) if spec.local_port else None
+            if item is None:
+                items.append(TunnelItem(spec))
+                added += 1
+                continue
+            if item in before:
+                tunnel, signature = before[item]
+                if self.engine.signature(spec) != signature:
+                    restart.append(item)
+                elif spec.remark != tunnel.spec.remark:
+                    tunnel.rename(spec.remark)
+            item.spec = spec
+            items.append(item)
+        # 尚未填本地 Port 的空白列保留，其餘設定檔中已沒有的通道停用並移除
+        items.extend(item for item in self.table.items if not item.spec.local_port)
+        removed = [(item, self.disable_item(item)) for item in by_port.values() if item.enabled or item.tunnel]
+        restarted = [(item, self.disable_item(item)) for item in restart]
+        for item, _ in restarted:
+            item.enabled = True  # 重新啟動期間維持勾選
+        self.table.items = items
+        while len(self.table.items) < DEFAULT_ROWS:
+            self.table.items.append(TunnelItem())
+        self.apply_filter()
+        log.info("🔄 設定檔已套用：新增 %d、移除 %d、重新啟動 %d 條通道，其餘維持不動", added, len(by_port), len(restarted))
+
+        def worker():
+            for item, tunnel in removed:
+                self.stop_tunnel(item, tunnel)
+            for item, tunnel in restarted:
+                if tunnel:
+                    self.engine.remove_tunnel(tunnel)
+                with self._items_lock:
+                    # 重新啟動期間使用者可能取消了勾選
+                    if not item.enabled or item.tunnel is not None:
+                        continue
+                    new_tunnel = self.enable_item(item)
+                threading.Thread(target=new_tunnel.start, daemon=True).start()
+
+        threading.Thread(target=worker, daemon=True).start()
 
     def save_config(self):
         """
-        存檔時，只記錄本地 Port、對方 IP、對方 Port、備註。
+        存檔時，只記錄本地 Port、對方 IP、對方 Port、備註（及額外選項）。
         不紀錄「啟用狀態」，因為需求是每次啟動都預設關閉。
         """
-        config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILE)
+        self.commit_rows()
+        config = TunnelConfig(
+            self.remote_entry.get().strip(),
+            self.password_entry.get().strip(),
+            self.engine.options,
+            [item.spec for item in self.table.items],
+        )
         try:
-            with open(config_path , "w", encoding="utf-8") as f:
-                # 寫入全域設定行
-                remote = self.remote_entry.get().strip()
-                password = self.password_entry.get().strip()
-                f.write(f"GLOBAL,{remote},{password}\n")
-
-                # 寫入各通道設定: local, ip, port, remark
-                for row in self.tunnel_rows:
-                    local, ip, port, remark = row.get_values()
-                    f.write(f"{local},{ip},{port},{remark}\n")
+            save_config(default_config_path(), config)
         except Exception as e:
-            print("儲存設定失敗:", e)
+            log.error("儲存設定失敗: %s", e)
+            return
+        # 程式自己的存檔不算外部修改
+        self.config_watcher.mark_seen()
+
+    def save_crypto_profile(self, profile):
+        """crypto=auto 量測完成：只把加密設定寫回設定檔，表格中尚未儲存的修改不會被一起存入"""
+        try:
+            saved = store_crypto_profile(default_config_path(), profile)
+        except Exception as e:
+            log.error("儲存加密設定失敗: %s", e)
+            return
+        if saved:
+            self.config_watcher.mark_seen()
 
     def on_closing(self):
         # 離開前，先停止所有已啟用的 SSH 連線
-        for row in self.tunnel_rows:
-            row.stop_tunnel()
+        self.config_watcher.stop()
+        self.close_connections()
+        self.close_log()
+        self.engine.close()
         self.save_config()
         self.master.destroy()
 
+def report_startup(root):
+    """--profile-startup：視窗畫出後列出各階段耗時，並確認較慢的模組都沒有在啟動時載入"""
+    root.update_idletasks()
+    STARTUP_PHASES.append(("視窗顯示", time.perf_counter()))
+    previous = STARTUP_STARTED
+    for phase, moment in STARTUP_PHASES:
+        print(f"{phase:<8} {(moment - previous) * 1000:8.1f} ms  (累計 {(moment - STARTUP_STARTED) * 1000:8.1f} ms)")
+        previous = moment
+    loaded = [name for name in ("paramiko", "asyncio", "requests", "PIL", "pystray") if name in sys.modules]
+    print(f"啟動時已載入的大型模組: {', '.join(loaded) or '無'}")
+    root.destroy()
+
 if __name__ == "__main__":
     root = tk.Tk()
+    STARTUP_PHASES.append(("建立 Tk", time.perf_counter()))
     # DPI 相關設定，解決高 DPI 螢幕下的字體與介面模糊問題 (Windows)
     try:
         from ctypes import windll
@@ -521,5 +914,9 @@ if __name__ == "__main__":
     except Exception as e:
         print("DPI 設定失敗:", e)
 
-    app = App(root)
+    profile_startup = "--profile-startup" in sys.argv
+    app = App(root, background=not profile_startup)
+    STARTUP_PHASES.append(("建立介面", time.perf_counter()))
+    if profile_startup:
+        root.after(0, report_startup, root)
     root.mainloop()
@@ -0,0 +1,136 @@
+"""TunnelLimits 的連線准入：名額、排隊、fd 預算，以及 asyncio 模式在事件迴圈上排隊"""
+import asyncio
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import benchmark
+import tunnel_engine
+from tunnel_engine import FDS_PER_CONNECTION, TunnelEngine, TunnelLimits, TunnelSpec, fd_budget
+
+FULL = "連線數已達上限 1"
+
+
+def test_options_are_parsed_and_clamped():
+    limits = TunnelLimits.from_options({"max_conns": "3", "max_opening": "0", "overflow": "drop",
+                                        "queue_timeout": "x", "backlog": "-5"})
+    assert (limits.max_connections, limits.max_opening, limits.backlog) == (3, 1, 1)
+    assert limits.overflow == tunnel_engine.OVERFLOW_POLICY
+    assert limits.queue_timeout == tunnel_engine.QUEUE_TIMEOUT
+
+
+def test_reject_policy_and_release():
+    limits = TunnelLimits(max_connections=1, overflow="reject")
+    assert limits.admit() is None
+    assert limits.admit() == FULL
+    limits.release()
+    assert limits.admit() is None
+    limits.release()
+
+
+def test_thread_queue_waits_for_release():
+    limits = TunnelLimits(max_connections=1, queue_timeout=5)
+    assert limits.admit() is None
+    threading.Timer(0.05, limits.release).start()
+    assert limits.admit() is None
+    limits.queue_timeout = 0.05
+    assert limits.admit() == FULL
+    limits.release()
+
+
+def test_fd_budget_is_shared_and_returned():
+    in_use = fd_budget.in_use
+    limits = TunnelLimits(max_connections=2, max_fds=in_use + FDS_PER_CONNECTION)
+    assert limits.admit() is None
+    assert limits.admit().startswith("檔案描述元預算")
+    # 因 fd 預算被拒絕時，連線名額也要歸還
+    limits.release()
+    assert fd_budget.in_use == in_use
+    assert limits.admit() is None
+    limits.release()
+
+
+def test_async_queue_hands_slots_over_in_order():
+    limits = TunnelLimits(max_connections=1, queue_timeout=5)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        assert await limits.admit_async(loop) is None
+        second = loop.create_task(limits.admit_async(loop))
+        third = loop.create_task(limits.admit_async(loop))
+        await asyncio.sleep(0)
+        assert len(limits._waiters) == 2
+        limits.release()
+        assert await second is None
+        assert not third.done()
+        # 轉發結束可能發生在其他執行緒（例如 thread 模式的開通失敗）
+        threading.Thread(target=limits.release).start()
+        assert await third is None
+        limits.queue_timeout = 0.05
+        assert await limits.admit_async(loop) == FULL
+        assert not limits._waiters
+        limits.release()
+
+    asyncio.run(scenario())
+    assert limits.admit() is None   # 名額全部歸還
+    limits.release()
+
+
+def test_async_reject_policy_does_not_queue():
+    limits = TunnelLimits(max_connections=1, overflow="reject")
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        assert await limits.admit_async(loop) is None
+        assert await limits.admit_async(loop) == FULL
+        assert not limits._waiters
+
+    asyncio.run(scenario())
+    limits.release()
+
+
+@pytest.fixture
+def async_tunnel(monkeypatch):
+    server = benchmark.LocalSSHServer()
+    echo = benchmark._listen()
+    benchmark._serve_forever(echo, benchmark._echo)
+    monkeypatch.setattr(tunnel_engine, "SSH_PORT", server.port)
+    engine = TunnelEngine(f"{benchmark.BENCH_USER}@127.0.0.1", benchmark.BENCH_PASSWORD, {"mode": "asyncio"})
+    port = benchmark._free_port()
+    tunnel = engine.add_tunnel(TunnelSpec(port, "127.0.0.1", echo.getsockname()[1], "queue",
+                                          {"max_conns": "1", "max_opening": "1", "queue_timeout": "5"}))
+    assert tunnel.connect() == "connected"
+    yield tunnel, port
+    engine.stop_all()
+
+
+def _connect(port):
+    return socket.create_connection(("127.0.0.1", port), timeout=10)
+
+
+def _ping(client):
+    payload = os.urandom(16)
+    client.sendall(payload)
+    return benchmark._recv_exact(client, 16) == payload
+
+
+def test_queued_connections_wait_on_the_event_loop(async_tunnel):
+    tunnel, port = async_tunnel
+    limits = tunnel.tunnel_socket.limits
+    first = _connect(port)
+    assert _ping(first)
+    queued = [_connect(port) for _ in range(4)]
+    deadline = time.monotonic() + 5
+    while len(limits._waiters) < 4:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    # 排隊中的連線都在事件迴圈上等待，開通用的執行緒池（max_opening=1）沒有被佔住
+    busy = [t for t in threading.enumerate() if t.name.startswith("open_channel")]
+    assert len(busy) <= 1
+    first.close()
+    for client in queued:
+        assert _ping(client)
+        client.close()
@@ -0,0 +1,114 @@
+"""選項欄位、設定檔讀寫，以及重新載入時依 signature 決定要重啟哪些通道"""
+import pytest
+
+from tunnel_engine import (TunnelConfig, TunnelEngine, TunnelSpec, format_options, load_config, parse_options,
+                           save_config)
+
+
+@pytest.mark.parametrize("text", [
+    "mode=asyncio",
+    "type=socks5;dns=local",
+    "rate=1M;conn_rate=64K;window=16M;trace=0.05",
+])
+def test_options_round_trip(text):
+    assert format_options(parse_options(text)) == text
+
+
+def test_parse_options_ignores_blanks_and_items_without_value():
+    assert parse_options(" rate = 2M ;;flag; log_file=a=b.log") == {"rate": "2M", "log_file": "a=b.log"}
+    assert parse_options("") == {}
+
+
+def test_config_file_round_trip(tmp_path):
+    path = tmp_path / "tunnels.config"
+    config = TunnelConfig("user@host", "secret", {"mode": "asyncio", "metrics_port": "9100"}, [
+        TunnelSpec("8080", "10.0.0.1", "80", "web"),
+        TunnelSpec("1080", options={"type": "socks5", "dns": "local"}),
+    ])
+    save_config(path, config)
+    loaded = load_config(path)
+    assert (loaded.remote, loaded.password, loaded.options) == ("user@host", "secret", config.options)
+    assert [(s.local_port, s.target_ip, s.target_port, s.remark, s.options) for s in loaded.tunnels] == [
+        ("8080", "10.0.0.1", "80", "web", {}),
+        ("1080", "", "", "", {"type": "socks5", "dns": "local"}),
+    ]
+
+
+def test_signature_ignores_remark_metrics_and_logging():
+    engine = TunnelEngine("user@host", "pw", {"rate": "1M"})
+    spec = TunnelSpec("8080", "10.0.0.1", "80", "web")
+    before = engine.signature(spec)
+    engine.options = {"rate": "1M", "metrics_port": "9100", "log_level": "debug", "log_file": "t.log"}
+    assert engine.signature(TunnelSpec("8080", "10.0.0.1", "80", "renamed")) == before
+    engine.options = {"rate": "2M"}
+    assert engine.signature(spec) != before
+    assert engine.signature(TunnelSpec("8080", "10.0.0.1", "80", options={"rate": "1M"})) == before
+
+
+@pytest.fixture
+def offline_engine():
+    # 伺服器欄位沒有 user@，通道啟動時直接回報 invalid，不會連線也不會排入重試
+    engine = TunnelEngine("no-server", "pw")
+    yield engine
+    engine.stop_all()
+
+
+def _ports(specs):
+    return sorted(spec.local_port for spec in specs)
+
+
+def test_apply_config_only_touches_changed_tunnels(offline_engine):
+    first = TunnelConfig("no-server", "pw", {}, [
+        TunnelSpec("8001", "10.0.0.1", "80", "a"),
+        TunnelSpec("8002", "10.0.0.2", "80", "b"),
+        TunnelSpec("8003", "10.0.0.3", "80", "c"),
+    ])
+    changes = offline_engine.apply_config(first)
+    assert _ports(changes["started"]) == ["8001", "8002", "8003"]
+    kept = {tunnel.spec.local_port: tunnel for tunnel in offline_engine.tunnels}["8001"]
+
+    second = TunnelConfig("no-server", "pw", {}, [
+        TunnelSpec("8001", "10.0.0.1", "80", "renamed"),   # 只改備註
+        TunnelSpec("8002", "10.0.0.2", "443", "b"),        # 目的地改變
+        TunnelSpec("8004", "10.0.0.4", "80", "d"),         # 新增；8003 被刪除
+        TunnelSpec("8005", "", "", "incomplete"),          # 欄位不完整，略過
+    ])
+    changes = offline_engine.apply_config(second)
+    assert _ports(changes["started"]) == ["8004"]
+    assert _ports(changes["stopped"]) == ["8003"]
+    assert _ports(changes["restarted"]) == ["8002"]
+    running = {tunnel.spec.local_port: tunnel for tunnel in offline_engine.tunnels}
+    assert sorted(running) == ["8001", "8002", "8004"]
+    assert running["8001"] is kept and kept.spec.remark == "renamed"
+    assert kept.stats.snapshot()["name"] == "renamed"
+
+
+def test_rename_reaches_remote_stats_and_worker():
+    from tunnel_workers import RemoteTunnel
+
+    class FakeWorker:
+        sent = []
+
+        def send(self, message):
+            self.sent.append(message)
+            return True
+
+    engine = TunnelEngine("no-server", "pw")
+    tunnel = RemoteTunnel(engine, pool=None, spec=TunnelSpec("8001", "10.0.0.1", "80", "old"))
+    tunnel.worker = FakeWorker()
+    stale = tunnel.stats.snapshot()
+    tunnel.rename("new")
+    # rename 送到 worker 之前回報的快照仍帶著舊名稱，匯出時以主程序的名稱為準
+    tunnel.stats.update(stale)
+    assert tunnel.stats.snapshot()["name"] == "new"
+    assert FakeWorker.sent == [("rename", tunnel.id, "new")]
+
+
+def test_apply_config_restarts_all_when_global_option_changes(offline_engine):
+    specs = [TunnelSpec("8001", "10.0.0.1", "80"), TunnelSpec("8002", "10.0.0.2", "80", options={"rate": "1M"})]
+    offline_engine.apply_config(TunnelConfig("no-server", "pw", {}, specs))
+    changes = offline_engine.apply_config(TunnelConfig("no-server", "pw", {"rate": "2M"}, specs))
+    # 通道自己的 rate 覆蓋 GLOBAL，生效的設定沒變
+    assert _ports(changes["restarted"]) == ["8001"]
+    changes = offline_engine.apply_config(TunnelConfig("no-server", "pw", {"rate": "2M"}, specs))
+    assert changes == {"started": [], "stopped": [], "restarted": []}
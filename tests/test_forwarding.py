@@ -0,0 +1,65 @@
+"""端對端：以 benchmark.LocalSSHServer 當 SSH 伺服器，經由 Tunnel 轉發到本機的 echo 服務"""
+import os
+import socket
+import struct
+
+import pytest
+
+import benchmark
+import tunnel_engine
+from tunnel_engine import TunnelEngine, TunnelSpec
+
+
+@pytest.fixture(scope="module")
+def ssh_server():
+    return benchmark.LocalSSHServer()
+
+
+@pytest.fixture(scope="module")
+def echo_port():
+    sock = benchmark._listen()
+    benchmark._serve_forever(sock, benchmark._echo)
+    return sock.getsockname()[1]
+
+
+@pytest.fixture(params=["thread", "asyncio"])
+def engine(request, ssh_server, monkeypatch):
+    monkeypatch.setattr(tunnel_engine, "SSH_PORT", ssh_server.port)
+    engine = TunnelEngine(f"{benchmark.BENCH_USER}@127.0.0.1", benchmark.BENCH_PASSWORD, {"mode": request.param})
+    yield engine
+    engine.stop_all()
+
+
+def _start(engine, spec):
+    tunnel = engine.add_tunnel(spec)
+    assert tunnel.connect() == "connected"
+    return tunnel
+
+
+def _echo_round_trip(sock, size=256 * 1024):
+    payload = os.urandom(size)
+    sock.sendall(payload)
+    received = benchmark._recv_exact(sock, size)
+    assert received == payload
+
+
+def test_local_forward(engine, echo_port):
+    port = benchmark._free_port()
+    tunnel = _start(engine, TunnelSpec(port, "127.0.0.1", echo_port, "echo"))
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as client:
+        _echo_round_trip(client)
+    snapshot = tunnel.stats.snapshot()
+    assert snapshot["total_connections"] == 1
+    assert snapshot["bytes_out"] >= 256 * 1024
+
+
+def test_socks5_forward(engine, echo_port):
+    port = benchmark._free_port()
+    _start(engine, TunnelSpec(port, options={"type": "socks5"}))
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as client:
+        client.sendall(b"\x05\x01\x00")
+        assert benchmark._recv_exact(client, 2) == b"\x05\x00"
+        client.sendall(b"\x05\x01\x00\x03\x09localhost" + struct.pack(">H", echo_port))
+        assert benchmark._recv_exact(client, 10)[:2] == b"\x05\x00"
+        _echo_round_trip(client)
+
@@ -0,0 +1,101 @@
+"""記錄：環狀緩衝區的篩選與容量、背景執行緒寫出的佇列記錄器"""
+import logging
+import threading
+
+import pytest
+
+import tunnel_engine
+from tunnel_engine import LogBuffer, log, parse_log_level, setup_logging, tunnel_log
+
+
+def _record(message, level=logging.INFO, tunnel=None):
+    record = logging.LogRecord(log.name, level, __file__, 0, message, (), None)
+    if tunnel is not None:
+        record.tunnel = tunnel
+    return record
+
+
+def test_buffer_keeps_only_the_latest_records():
+    buffer = LogBuffer(capacity=3)
+    for i in range(5):
+        buffer.emit(_record(f"m{i}"))
+    assert [r["message"] for r in buffer.records()] == ["m2", "m3", "m4"]
+    assert buffer.serial == 5
+
+
+def test_buffer_filters_by_tunnel_and_level():
+    buffer = LogBuffer()
+    buffer.emit(_record("a", tunnel="Web-8080"))
+    buffer.emit(_record("b", logging.WARNING, tunnel="web-8081"))
+    buffer.emit(_record("c", logging.ERROR, tunnel="db-5432"))
+    buffer.emit(_record("d", logging.ERROR))
+    assert [r["message"] for r in buffer.records(tunnel="WEB")] == ["a", "b"]
+    assert [r["message"] for r in buffer.records(level=logging.WARNING)] == ["b", "c", "d"]
+    assert [r["message"] for r in buffer.records(level=logging.ERROR, limit=1)] == ["d"]
+    assert buffer.records(tunnel="db")[0] == {"time": pytest.approx(buffer._records[2].created),
+                                               "level": "ERROR", "tunnel": "db-5432", "message": "c"}
+
+
+@pytest.mark.parametrize("name, level", [("debug", logging.DEBUG), ("WARNING", logging.WARNING),
+                                         ("bogus", logging.INFO), (None, logging.INFO)])
+def test_parse_log_level(name, level):
+    assert parse_log_level(name) == level
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.threads = []
+
+    def emit(self, record):
+        self.records.append(record)
+        self.threads.append(threading.current_thread().name)
+
+
+class _Formatted:
+    """記下是在哪個執行緒被轉成字串的"""
+
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = threading.current_thread().name
+        return "formatted"
+
+
+@pytest.fixture
+def restore_logging():
+    yield
+    setup_logging(console=False)
+
+
+def test_records_are_formatted_on_the_listener_thread(restore_logging, tmp_path):
+    collect = _Collect()
+    log_file = tmp_path / "tunnel.log"
+    setup_logging("debug", str(log_file), console=False, handlers=[collect])
+    argument = _Formatted()
+    tunnel_log("web").debug("值 %s", argument)
+    log.info("沒有通道")
+    assert argument.thread is None          # 呼叫端只把記錄放進佇列
+    tunnel_engine._stop_logging()           # 寫完佇列中的記錄
+    assert argument.thread not in (None, threading.current_thread().name)
+    assert collect.threads and threading.current_thread().name not in collect.threads
+    lines = log_file.read_text(encoding="utf-8").splitlines()
+    assert lines[0].endswith("DEBUG   [web] 值 formatted")
+    assert lines[1].endswith("INFO    [-] 沒有通道")
+
+
+def test_reconfigure_switches_file_and_stop_is_idempotent(restore_logging, tmp_path):
+    first, second = tmp_path / "first.log", tmp_path / "second.log"
+    setup_logging("info", str(first), console=False)
+    log.info("一")
+    setup_logging("warning", str(second), console=False)   # 切換前先寫完佇列
+    log.info("被過濾")
+    log.warning("二")
+    tunnel_engine._stop_logging()
+    tunnel_engine._stop_logging()
+    assert not tunnel_engine._log_listener.started
+    assert first.read_text(encoding="utf-8").rstrip().endswith("一")
+    assert second.read_text(encoding="utf-8").rstrip().endswith("二")
+    assert "被過濾" not in second.read_text(encoding="utf-8")
@@ -0,0 +1,69 @@
+"""render_prometheus() 的輸出格式"""
+from tunnel_engine import TunnelStats, render_prometheus
+
+
+def _metrics(**extra):
+    stats = TunnelStats("web")
+    stats.labels = {"local_port": "8080", "target": '10.0.0.1:80 "x"'}
+    stats.connection_opened()
+    stats.add(sent=100, received=2048)
+    stats.observe_open(0.003)
+    stats.observe_open(60.0)
+    stats.open_failed()
+    snapshot = stats.snapshot()
+    snapshot.pop("traces")
+    snapshot["up"] = 1
+    return dict({"tunnels": [snapshot], "threads": 7}, **extra)
+
+
+def _samples(text):
+    """{指標名稱與標籤: 值}，略過 HELP / TYPE 註解"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = value
+    return samples
+
+
+def test_every_family_has_help_and_type():
+    text = render_prometheus(_metrics())
+    assert text.endswith("\n")
+    names = {line.split()[2] for line in text.splitlines() if line.startswith("# TYPE")}
+    helped = {line.split()[2] for line in text.splitlines() if line.startswith("# HELP")}
+    assert names == helped
+    for sample in _samples(text):
+        family = sample.split("{", 1)[0]
+        assert family in names or family.rsplit("_", 1)[0] in names
+
+
+def test_tunnel_values_and_escaped_labels():
+    samples = _samples(render_prometheus(_metrics()))
+    labels = 'tunnel="web",local_port="8080",target="10.0.0.1:80 \\"x\\""'
+    assert samples[f"ssh_tunnel_up{{{labels}}}"] == "1"
+    assert samples[f'ssh_tunnel_bytes_total{{{labels},direction="out"}}'] == "100"
+    assert samples[f'ssh_tunnel_bytes_total{{{labels},direction="in"}}'] == "2048"
+    assert samples[f"ssh_tunnel_connections_active{{{labels}}}"] == "1"
+    assert samples[f"ssh_tunnel_open_failures_total{{{labels}}}"] == "1"
+    assert samples["ssh_tunnel_process_threads"] == "7"
+
+
+def test_open_latency_histogram_is_cumulative():
+    samples = _samples(render_prometheus(_metrics()))
+    buckets = [(name, int(value)) for name, value in samples.items()
+               if name.startswith("ssh_tunnel_channel_open_seconds_bucket")]
+    counts = [count for _, count in buckets]
+    assert counts == sorted(counts)
+    assert buckets[-1][0].endswith('le="+Inf"}') and buckets[-1][1] == 2
+    assert counts[-2] == 1   # 60 秒超過最大的區間，只算在 +Inf
+    count = next(value for name, value in samples.items() if name.startswith("ssh_tunnel_channel_open_seconds_count"))
+    assert count == "2"
+
+
+def test_asyncio_section_only_when_present():
+    assert "ssh_tunnel_asyncio" not in render_prometheus(_metrics())
+    loop_stats = {"connections_per_second": 12.5, "active_connections": 3, "total_connections": 40, "thread_count": 9}
+    samples = _samples(render_prometheus(_metrics(asyncio=loop_stats)))
+    assert samples["ssh_tunnel_asyncio_connections_per_second"] == "12.5"
+    assert samples["ssh_tunnel_asyncio_connections_active"] == "3"
+    assert samples["ssh_tunnel_asyncio_connections_total"] == "40"
@@ -0,0 +1,128 @@
+"""連線回收（idle_timeout / max_lifetime）與資源預算（max_fds、max_channels）"""
+import socket
+import time
+
+import pytest
+
+import benchmark
+import tunnel_engine
+from tunnel_engine import (FD_RESERVE, FDS_PER_CONNECTION, ConnectionReaper, Flow, ResourceBudget, TunnelEngine,
+                           TunnelLimits, TunnelSpec, TunnelStats, admit_and_open, default_fd_budget,
+                           transport_channels)
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def reaper(monkeypatch):
+    reaper = ConnectionReaper(interval=0.02)
+    monkeypatch.setattr(tunnel_engine, "connection_reaper", reaper)
+    return reaper
+
+
+def test_expired_reports_lifetime_before_idle(reaper):
+    flow = Flow("client", idle_timeout=5, max_lifetime=60)
+    now = flow.started
+    assert flow.expired(now + 1) is None
+    assert flow.expired(now + 6) == "閒置超過 5 秒"
+    flow.consume(sent=1)
+    assert flow.expired(flow.last_active + 4) is None
+    assert flow.expired(now + 61) == "超過存活時間 60 秒"
+    flow.close()
+    assert not reaper._flows
+
+
+def test_flows_without_limits_are_not_registered(reaper):
+    flow = Flow("client")
+    assert not reaper._flows and reaper._thread is None
+    flow.close()
+
+
+def test_reaper_aborts_idle_flows_and_stops_when_empty(reaper):
+    stats = TunnelStats("reap")
+    closed = []
+    idle = Flow("idle", stats=stats, idle_timeout=0.05)
+    idle.closer = lambda: closed.append(idle)
+    busy = Flow("busy", stats=stats, max_lifetime=60)
+    _wait_until(lambda: closed)
+    assert idle.aborted == "閒置超過 0.05 秒" and busy.aborted is None
+    assert stats.reaped_connections == 1
+    idle.close()
+    busy.close()
+    _wait_until(lambda: reaper._thread is None)
+
+
+def test_resource_budget():
+    budget = ResourceBudget()
+    assert budget.acquire(3, 6) and budget.acquire(3, 6)
+    assert not budget.acquire(3, 6)
+    budget.release(3)
+    assert budget.acquire(3, 6)
+    assert budget.acquire(100, 0)   # 0 代表不限制
+    assert budget.in_use == 106
+
+
+@pytest.mark.parametrize("soft, expected", [(1024, 1024 - FD_RESERVE), (FD_RESERVE, FDS_PER_CONNECTION),
+                                            ("infinity", 0)])
+def test_default_fd_budget_follows_rlimit(monkeypatch, soft, expected):
+    resource = pytest.importorskip("resource")
+    if soft == "infinity":
+        soft = resource.RLIM_INFINITY
+    monkeypatch.setattr(resource, "getrlimit", lambda kind: (soft, resource.RLIM_INFINITY))
+    assert default_fd_budget() == expected
+
+
+class FakeSocket:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTransport:
+    def open_channel(self, *args, **kwargs):
+        raise AssertionError("已達 max_channels 時不應開啟 channel")
+
+
+def test_max_channels_rejects_and_returns_the_slot():
+    transport = FakeTransport()
+    transport_channels(transport).ids.update({1, 2})
+    limits = TunnelLimits(max_connections=1, max_channels=2, overflow="reject", max_fds=0)
+    stats = TunnelStats("channels")
+    client = FakeSocket()
+    assert admit_and_open(client, ("127.0.0.1", 1), transport, "10.0.0.1", 80, stats, limits) is None
+    assert client.closed and stats.rejected_connections == 1
+    assert limits.admit() is None      # 名額已歸還
+    limits.release()
+
+
+@pytest.fixture(params=["thread", "asyncio"])
+def engine(request, monkeypatch):
+    server = benchmark.LocalSSHServer()
+    monkeypatch.setattr(tunnel_engine, "SSH_PORT", server.port)
+    monkeypatch.setattr(tunnel_engine.connection_reaper, "interval", 0.05)
+    engine = TunnelEngine(f"{benchmark.BENCH_USER}@127.0.0.1", benchmark.BENCH_PASSWORD, {"mode": request.param})
+    yield engine
+    engine.stop_all()
+
+
+def test_idle_connection_is_closed_end_to_end(engine):
+    echo = benchmark._listen()
+    benchmark._serve_forever(echo, benchmark._echo)
+    port = benchmark._free_port()
+    tunnel = engine.add_tunnel(TunnelSpec(port, "127.0.0.1", echo.getsockname()[1], "idle",
+                                          {"idle_timeout": "0.2"}))
+    assert tunnel.connect() == "connected"
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as client:
+        client.sendall(b"ping")
+        assert benchmark._recv_exact(client, 4) == b"ping"
+        started = time.monotonic()
+        assert client.recv(1) == b""    # 閒置後被回收，本機連線被關閉
+        assert time.monotonic() - started < 5
+    _wait_until(lambda: tunnel.stats.snapshot()["active_connections"] == 0)
+    assert tunnel.stats.reaped_connections == 1
@@ -0,0 +1,123 @@
+"""ReconnectSupervisor 的退避與合併重試，以及 TransportPool 的探測逾時"""
+import logging
+import threading
+import time
+
+import pytest
+
+import tunnel_engine
+from tunnel_engine import (HEALTH_PROBE_MIN_TIMEOUT, HEALTH_PROBE_RTT_FACTOR, RECONNECT_MAX_DELAY,
+                           ReconnectSupervisor, TransportPool, TunnelSpec, TunnelStats, log)
+
+
+class FakeTunnel:
+    """依序回傳 results 的 connect()；用完後一律回傳 "connected" """
+
+    def __init__(self, port, results=(), server=("user", "host", 22)):
+        self.spec = TunnelSpec(str(port), "10.0.0.1", "80")
+        self.stats = TunnelStats(str(port))
+        self.enabled = True
+        self.results = list(results)
+        self.server = server
+        self.connects = 0
+        self.started = threading.Event()
+
+    def server_id(self):
+        return self.server
+
+    def connect(self):
+        self.connects += 1
+        return self.results.pop(0) if self.results else "connected"
+
+    def start(self):
+        self.started.set()
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    monkeypatch.setattr(ReconnectSupervisor, "backoff", staticmethod(lambda attempt: 0.01))
+    return ReconnectSupervisor()
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("attempt", range(12))
+def test_backoff_is_capped_and_jittered(attempt):
+    delay = min(RECONNECT_MAX_DELAY, tunnel_engine.RECONNECT_BASE_DELAY * 2 ** attempt)
+    for _ in range(20):
+        assert delay / 2 <= ReconnectSupervisor.backoff(attempt) <= delay
+
+
+def test_one_leader_handshakes_for_the_whole_server(supervisor):
+    leader = FakeTunnel(8001, ["ssh_failed", "ssh_failed"])
+    others = [FakeTunnel(8002), FakeTunnel(8003)]
+    for tunnel in [leader] + others:
+        supervisor.schedule(tunnel)
+    for tunnel in others:
+        assert tunnel.started.wait(5)
+    # 失敗的兩輪都只由 leader 握手，成功後其餘通道直接啟動，不各自 connect()
+    assert leader.connects == 3
+    assert [tunnel.connects for tunnel in others] == [0, 0]
+    assert leader.stats.reconnect_attempts == 3
+
+
+def test_backoff_resets_only_after_stable_period(supervisor, monkeypatch):
+    tunnel = FakeTunnel(8001)
+    supervisor.schedule(tunnel)
+    group = supervisor._groups[tunnel.server_id()]
+    _wait_until(lambda: "connected_at" in group)
+    supervisor.schedule(tunnel)           # 剛連上就斷線
+    assert group["attempt"] == 1
+    _wait_until(lambda: "connected_at" in group)
+    group["connected_at"] -= tunnel_engine.RECONNECT_STABLE_SECONDS
+    supervisor.schedule(tunnel)           # 維持夠久之後才斷線
+    assert group["attempt"] == 0
+
+
+def test_local_failures_retry_per_port(supervisor):
+    tunnel = FakeTunnel(8001, ["local_failed"])
+    supervisor.schedule(tunnel, local=True)
+    _wait_until(lambda: tunnel.connects == 2)
+    assert ("local", "8001") in supervisor._groups
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_waiting_count_includes_leader_in_flight(supervisor, caplog):
+    caplog.set_level(logging.INFO, logger=log.name)
+    records = _Records()   # 呼叫過 setup_logging() 後記錄不再傳到 root，直接掛在 ssh_tunnel 上
+    log.addHandler(records)
+    release = threading.Event()
+    leader = FakeTunnel(8001, ["ssh_failed"])
+    leader.connect = lambda: release.wait(5) and "ssh_failed"
+    try:
+        supervisor.schedule(leader)
+        _wait_until(lambda: supervisor._groups[leader.server_id()]["leader"] is leader)
+        supervisor.schedule(FakeTunnel(8002))   # leader 仍在握手
+        assert "2 條通道等待中" in records.messages[-1]
+    finally:
+        release.set()
+        leader.enabled = False
+        log.removeHandler(records)
+
+
+def test_probe_timeout_scales_with_rtt():
+    entry = {"probe_timeouts": {}, "rtt": 0.001}
+    assert TransportPool.probe_timeout(entry) == HEALTH_PROBE_MIN_TIMEOUT < 1.0
+    entry["rtt"] = 0.5
+    assert TransportPool.probe_timeout(entry) == pytest.approx(HEALTH_PROBE_RTT_FACTOR * 0.5)
+    # 指定了 probe_timeout 時取各通道要求中最大者
+    entry["probe_timeouts"] = {"a": 1.0, "b": 7.0}
+    assert TransportPool.probe_timeout(entry) == 7.0
@@ -0,0 +1,115 @@
+"""TokenBucket / FairShaper 的速率計算；以假時鐘控制時間，不需要真的等待"""
+import pytest
+
+import tunnel_engine
+from tunnel_engine import SHAPING_BURST_SECONDS, SHAPING_MIN_CHUNK, FairShaper, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeFlow:
+    def __init__(self, rate):
+        self._rate = rate
+
+    def rate(self):
+        return self._rate
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(TokenBucket, "clock", staticmethod(clock))
+    return clock
+
+
+def test_burst_defaults_to_rate_window_with_minimum(clock):
+    assert TokenBucket(10 * 1024 * 1024).burst == 10 * 1024 * 1024 * SHAPING_BURST_SECONDS
+    assert TokenBucket(1000).burst == SHAPING_MIN_CHUNK
+
+
+def test_consume_within_burst_does_not_wait(clock):
+    bucket = TokenBucket(1000, burst=500)
+    assert bucket.consume(300) == 0.0
+    assert bucket.consume(200) == 0.0
+
+
+def test_debt_is_repaid_at_rate(clock):
+    bucket = TokenBucket(1000, burst=500)
+    # 500 的容量用完後再欠 1500，需要 1.5 秒才還清
+    assert bucket.consume(2000) == pytest.approx(1.5)
+    clock.now += 1.5
+    assert bucket.consume(0) == 0.0
+    assert bucket.tokens == pytest.approx(0.0)
+
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(1000, burst=500)
+    bucket.consume(500)
+    clock.now += 60
+    bucket.consume(0)
+    assert bucket.tokens == 500
+    assert bucket.consume(600) == pytest.approx(0.1)
+
+
+def test_set_rate_keeps_debt_and_changes_capacity(clock):
+    bucket = TokenBucket(1000, burst=500)
+    bucket.consume(1500)               # 欠 1000
+    clock.now += 0.5                   # 以舊速率補回 500
+    bucket.set_rate(2000, burst=4000)
+    assert (bucket.rate, bucket.burst) == (2000, 4000)
+    assert bucket.consume(0) == pytest.approx(0.25)   # 剩下的 500 以新速率償還
+
+
+def test_fair_shaper_lets_interactive_flows_through(clock):
+    shaper = FairShaper(1000, burst=500)
+    shaper.attach()
+    shaper.attach()
+    # 平均分配為 500/s；低於其 FAIR_SHARE_INTERACTIVE 的連線不必等待，但用量照扣
+    interactive = FakeFlow(100)
+    bulk = FakeFlow(900)
+    assert shaper.consume(1500, bulk) == pytest.approx(1.0)
+    assert shaper.consume(100, interactive) == 0.0
+    assert shaper.consume(0, bulk) == pytest.approx(1.1)
+
+
+def test_short_connections_cannot_bypass_the_limit(clock):
+    shaper = FairShaper(1000, burst=500)
+    waits = []
+    for _ in range(10):
+        # 每條新連線的速率都從 0 算起，全部符合互動流量的條件
+        shaper.attach()
+        waits.append(shaper.consume(200, FakeFlow(0)))
+        shaper.detach()
+    # 桶內的 500 用完後，免等待的額度也只有一個 burst（500），之後的連線照欠款等待
+    assert waits[:4] == [0.0] * 4
+    assert all(wait > 0 for wait in waits[4:])
+    assert waits[-1] == pytest.approx((2000 - 500) / 1000)
+    clock.now += 10
+    assert shaper.consume(200, FakeFlow(0)) == 0.0   # 欠款與額度都補回後恢復免等待
+
+
+def test_fair_share_grows_as_flows_detach(clock):
+    shaper = FairShaper(1000, burst=100)
+    for _ in range(4):
+        shaper.attach()
+    flow = FakeFlow(200)   # 4 條連線時平均 250/s，200 不算互動流量
+    assert shaper.consume(1100, flow) == pytest.approx(1.0)
+    shaper.detach()
+    shaper.detach()
+    shaper.detach()
+    assert shaper.consume(0, flow) == 0.0   # 只剩 1 條時平均 1000/s，200 低於一半
+
+
+def test_transport_shaper_follows_latest_rate():
+    transport = type("FakeTransport", (), {})()
+    shaper = tunnel_engine.transport_shaper(transport, 1000)
+    assert tunnel_engine.transport_shaper(transport, 1000) is shaper
+    assert tunnel_engine.transport_shaper(transport, 4000) is shaper
+    assert shaper.rate == 4000
+    assert shaper.exempt.rate == 4000 * tunnel_engine.FAIR_SHARE_INTERACTIVE
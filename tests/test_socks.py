@@ -0,0 +1,107 @@
+"""SOCKS5 交握的解析與錯誤回覆；以 socketpair 模擬用戶端，不需要 SSH 伺服器"""
+import asyncio
+import socket
+import struct
+import threading
+
+import pytest
+
+from tunnel_engine import (SOCKS_ADDRESS_NOT_SUPPORTED, SOCKS_COMMAND_NOT_SUPPORTED, SocksError,
+                           socks5_handshake, socks5_handshake_async, socks_admit_and_open)
+
+GREETING = b"\x05\x01\x00"
+
+
+def _request(address_type, address, port, command=1):
+    return bytes((5, command, 0, address_type)) + address + struct.pack(">H", port)
+
+
+@pytest.fixture
+def pair():
+    server, client = socket.socketpair()
+    client.settimeout(5)
+    yield server, client
+    server.close()
+    client.close()
+
+
+def _recv(client, size):
+    # 伺服器關閉時若還有沒讀完的請求，用戶端會收到 reset，因此只讀預期的長度
+    data = b""
+    while len(data) < size:
+        chunk = client.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _handshake(server, client, data, reply_size=2):
+    """送出 data 後在伺服器端交握，回傳 (結果或例外, 用戶端收到的位元組)"""
+    client.sendall(data)
+    client.shutdown(socket.SHUT_WR)
+    try:
+        result = socks5_handshake(server)
+    except SocksError as e:
+        result = e
+    return result, _recv(client, reply_size)
+
+
+@pytest.mark.parametrize("address_type, address, expected", [
+    (1, socket.inet_aton("10.1.2.3"), "10.1.2.3"),
+    (3, b"\x0bexample.com", "example.com"),
+    (4, socket.inet_pton(socket.AF_INET6, "2001:db8::1"), "2001:db8::1"),
+])
+def test_connect_request_is_parsed(pair, address_type, address, expected):
+    result, received = _handshake(*pair, GREETING + _request(address_type, address, 8080))
+    assert result == (expected, 8080)
+    assert received == b"\x05\x00"
+
+
+def test_greeting_split_across_segments(pair):
+    server, client = pair
+    data = GREETING + _request(1, socket.inet_aton("127.0.0.1"), 22)
+    sender = threading.Thread(target=lambda: [client.sendall(data[i:i + 1]) for i in range(len(data))])
+    sender.start()
+    assert socks5_handshake(server) == ("127.0.0.1", 22)
+    sender.join()
+
+
+@pytest.mark.parametrize("data, code, reply", [
+    (b"\x04\x01\x00", None, b""),                                         # SOCKS4
+    (b"\x05\x01\x02", None, b"\x05\xff"),                                 # 只接受帳號密碼認證
+    (GREETING + _request(1, b"\0\0\0\0", 80, command=2), SOCKS_COMMAND_NOT_SUPPORTED, b"\x05\x00"),  # BIND
+    (GREETING + bytes((5, 1, 0, 9)), SOCKS_ADDRESS_NOT_SUPPORTED, b"\x05\x00"),
+    (GREETING + b"\x05\x01", None, b"\x05\x00"),                          # 請求送到一半就關閉
+])
+def test_handshake_errors(pair, data, code, reply):
+    result, received = _handshake(*pair, data, len(reply))
+    assert isinstance(result, SocksError)
+    assert result.code == code
+    assert received == reply
+
+
+@pytest.mark.parametrize("data, reply", [
+    (GREETING + _request(1, b"\0\0\0\0", 80, command=2), b"\x05\x00" + bytes((5, 7, 0, 1, 0, 0, 0, 0, 0, 0))),
+    (GREETING + bytes((5, 1, 0, 9)), b"\x05\x00" + bytes((5, 8, 0, 1, 0, 0, 0, 0, 0, 0))),
+    (b"\x05\x01\x02", b"\x05\xff"),
+])
+def test_admit_and_open_replies_error_code_and_closes(pair, data, reply):
+    server, client = pair
+    client.sendall(data)
+    # 交握失敗時不會用到 transport 與 limits
+    assert socks_admit_and_open(server, ("127.0.0.1", 5000), None) is None
+    assert server.fileno() == -1
+    assert _recv(client, len(reply)) == reply
+
+
+def test_async_handshake_matches_blocking_version(pair):
+    server, client = pair
+    server.setblocking(False)
+    client.sendall(GREETING + _request(3, b"\x09localhost", 443))
+
+    async def run():
+        return await socks5_handshake_async(asyncio.get_running_loop(), server)
+
+    assert asyncio.run(run()) == ("localhost", 443)
+    assert client.recv(2) == b"\x05\x00"
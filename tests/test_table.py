@@ -0,0 +1,105 @@
+"""通道表格的資料模型：篩選、捲動、畫面列對應與全部啟用 / 停用的對象；不需要顯示器"""
+import pytest
+
+pytest.importorskip("tkinter")  # ssh.py 在模組層級匯入 tkinter
+
+from ssh import TunnelItem, TunnelTable
+from tunnel_engine import TunnelSpec
+
+
+def _table(count, rows=10, remark=lambda i: f"tunnel-{i}"):
+    table = TunnelTable(rows)
+    table.items = [TunnelItem(TunnelSpec(str(8000 + i), "10.0.0.1", "80", remark(i))) for i in range(count)]
+    table.apply_filter()
+    return table
+
+
+def _ports(items):
+    return [item.spec.local_port if item else None for item in items]
+
+
+def test_visible_pads_with_none_when_view_is_short():
+    table = _table(3, rows=5)
+    assert _ports(table.visible()) == ["8000", "8001", "8002", None, None]
+    assert table.scrollbar() == (0.0, 1.0)
+
+
+def test_hundreds_of_tunnels_only_bind_visible_rows():
+    table = _table(500)
+    assert len(table.visible()) == 10
+    assert table.scroll_to(250)
+    assert _ports(table.visible()) == [str(8250 + i) for i in range(10)]
+    assert table.scrollbar() == (0.5, 0.52)
+
+
+def test_scroll_is_clamped_to_last_page():
+    table = _table(25)
+    assert table.scroll_to(100)
+    assert table.offset == 15
+    assert not table.scroll_to(99)     # 已在最後一頁，位置不變
+    assert table.scroll_to(-5)
+    assert table.offset == 0
+    assert not _table(5).scroll_to(3)  # 不滿一頁時不能捲動
+
+
+def test_scrollbar_commands():
+    table = _table(100)
+    assert table.scroll("scroll", "1", "units") and table.offset == 1
+    assert table.scroll("scroll", "1", "pages") and table.offset == 11
+    assert table.scroll("scroll", "-1", "pages") and table.offset == 1
+    assert table.scroll("moveto", "0.5") and table.offset == 50
+    assert table.scroll("moveto", "1.0") and table.offset == 90
+    assert not table.scroll("unknown", "1")
+
+
+def test_filter_matches_remark_case_insensitively_and_resets_offset():
+    table = _table(30, remark=lambda i: "Web-prod" if i % 3 == 0 else "db")
+    table.scroll_to(10)
+    table.apply_filter("  WEB ")
+    assert table.offset == 0
+    assert _ports(table.view) == [str(8000 + i) for i in range(0, 30, 3)]
+    table.apply_filter("")
+    assert len(table.view) == 30
+    table.apply_filter("nothing")
+    assert table.view == [] and table.visible() == [None] * 10
+
+
+def test_bulk_enable_and_disable_only_touch_the_filtered_view():
+    table = _table(6, remark=lambda i: "a" if i < 4 else "b")
+    table.items.append(TunnelItem(TunnelSpec("", "", "", "a")))   # 欄位不完整
+    table.items[1].enabled = True
+    table.apply_filter("a")
+    assert _ports(table.to_enable()) == ["8000", "8002", "8003"]
+    assert _ports(table.to_disable()) == ["8001"]
+
+
+class FakeStats:
+    def __init__(self):
+        self.values = {"active_connections": 2, "bytes_out": 0, "bytes_in": 0, "reconnect_attempts": 0,
+                       "next_retry": 0.0}
+
+    def counters(self):
+        return dict(self.values)
+
+
+def test_item_sample_reports_rates_between_ticks():
+    item = TunnelItem(TunnelSpec("8000", "10.0.0.1", "80"))
+    item.enabled = True
+    item.state = "connected"
+    item.tunnel = type("FakeTunnel", (), {"stats": FakeStats()})()
+    item.sample(100.0)
+    assert item.traffic_text() == "2 連線 ↑0K ↓0K"
+    item.tunnel.stats.values.update(bytes_out=1024 * 1024, bytes_in=256 * 1024)
+    item.sample(100.5)
+    assert item.traffic_text() == "2 連線 ↑2.0M ↓512K"
+    item.tunnel = None
+    item.sample(101.0)
+    assert item.traffic is None and item.traffic_text() == ""
+
+
+def test_item_traffic_text_while_reconnecting():
+    item = TunnelItem(TunnelSpec("8000", "10.0.0.1", "80"))
+    item.enabled = True
+    item.state = "reconnecting"
+    item.traffic = {"connections": 0, "up": 0, "down": 0, "reconnect_attempts": 3, "next_retry": 0.0}
+    assert item.traffic_text() == "重新連線：重試中（第 3 次）"
@@ -0,0 +1,114 @@
+"""連線追蹤（選項 trace）、Chrome trace 匯出與取樣式效能分析"""
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import benchmark
+import tunnel_engine
+from tunnel_engine import ConnectionTrace, TunnelEngine, TunnelLimits, TunnelSpec, TunnelStats, chrome_trace
+from tunnel_profiler import SamplingProfiler
+
+
+def test_trace_finishes_once_into_stats():
+    stats = TunnelStats("trace")
+    trace = ConnectionTrace("127.0.0.1:5000", stats)
+    trace.target = "10.0.0.1:80"
+    trace.mark("admitted")
+    trace.finish("rejected")
+    trace.finish()
+    assert len(stats.traces) == 1
+    result = stats.traces[0]
+    assert [phase for phase, _ in result["phases"]] == ["accept", "admitted", "rejected"]
+    assert result["client"] == "127.0.0.1:5000" and result["target"] == "10.0.0.1:80"
+    assert result["phases"][0][1] == 0.0 <= result["phases"][1][1] <= result["phases"][2][1]
+
+
+@pytest.mark.parametrize("text, rate", [("0", 0.0), ("0.25", 0.25), ("5", 1.0), ("-1", 0.0)])
+def test_trace_rate_is_clamped(text, rate):
+    assert TunnelLimits.from_options({"trace": text}).trace_rate == rate
+
+
+def test_trace_sampling():
+    assert TunnelLimits().trace(("127.0.0.1", 1)) is None
+    trace = TunnelLimits(trace_rate=1).trace(("127.0.0.1", 1))
+    assert isinstance(trace, ConnectionTrace) and trace.client == "127.0.0.1:1"
+
+
+def test_chrome_trace_groups_by_tunnel():
+    traces = [
+        {"tunnel": "web", "client": "c1", "target": "t", "started": 10.0,
+         "phases": [["accept", 0.0], ["admitted", 1.0], ["close", 5.0]]},
+        {"tunnel": "db", "client": "c2", "target": "t", "started": 11.0, "phases": [["accept", 0.0], ["close", 2.0]]},
+        {"tunnel": "web", "client": "c3", "target": "t", "started": 12.0, "phases": [["accept", 0.0], ["close", 1.0]]},
+    ]
+    events = chrome_trace(traces)["traceEvents"]
+    processes = {e["args"]["name"]: e["pid"] for e in events if e["name"] == "process_name"}
+    assert processes == {"web": 1, "db": 2}
+    spans = [e for e in events if e["ph"] == "X"]
+    assert {e["tid"] for e in spans if e["pid"] == 1} == {1, 3}
+    first = [e for e in spans if e["tid"] == 1]
+    assert [(e["name"], e["ts"], e["dur"]) for e in first] == [
+        ("connection", 10e6, 5000.0), ("accept -> admitted", 10e6, 1000.0), ("admitted -> close", 10e6 + 1000, 4000.0)]
+
+
+@pytest.fixture(params=["thread", "asyncio"])
+def engine(request, monkeypatch):
+    server = benchmark.LocalSSHServer()
+    monkeypatch.setattr(tunnel_engine, "SSH_PORT", server.port)
+    engine = TunnelEngine(f"{benchmark.BENCH_USER}@127.0.0.1", benchmark.BENCH_PASSWORD, {"mode": request.param})
+    yield engine
+    engine.stop_all()
+
+
+def test_sampled_connection_records_every_phase(engine, tmp_path):
+    echo = benchmark._listen()
+    benchmark._serve_forever(echo, benchmark._echo)
+    port = benchmark._free_port()
+    tunnel = engine.add_tunnel(TunnelSpec(port, "127.0.0.1", echo.getsockname()[1], "traced", {"trace": "1"}))
+    assert tunnel.connect() == "connected"
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as client:
+        client.sendall(b"ping")
+        assert benchmark._recv_exact(client, 4) == b"ping"
+    deadline = time.monotonic() + 5
+    while not engine.traces():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    trace = engine.traces()[0]
+    assert trace["tunnel"] == "traced" and trace["target"] == f"127.0.0.1:{echo.getsockname()[1]}"
+    assert [phase for phase, _ in trace["phases"]] == [
+        "accept", "admitted", "open_request", "open_reply", "first_byte_out", "first_byte_in", "close"]
+    path = engine.export_traces(str(tmp_path / "traces.json"))
+    with open(path, encoding="utf-8") as file:
+        assert json.load(file)["traceEvents"]
+
+
+def _busy_loop(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def test_profiler_samples_named_threads(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_loop, args=(stop,), name="busy_7", daemon=True)
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001)
+    try:
+        assert profiler.start()
+        assert not profiler.start()         # 已在執行
+        time.sleep(0.1)
+    finally:
+        assert profiler.stop()
+        stop.set()
+    assert not profiler.stop() and not profiler.running
+    assert profiler.sample_count > 0 and profiler.elapsed > 0
+    # 執行緒名稱的編號被去掉，同一種執行緒合併成一條堆疊
+    busy = [stack for stack in profiler.samples if stack.startswith("busy;")]
+    assert busy and all("_busy_loop (test_tracing.py:" in stack for stack in busy)
+    assert not any(stack.startswith("sampling_profiler") for stack in profiler.samples)
+    assert profiler.summary().startswith(f"取樣 {profiler.sample_count} 次")
+    path = profiler.dump(str(tmp_path / "profile.txt"))
+    with open(path, encoding="utf-8") as file:
+        assert file.read() == profiler.collapsed()
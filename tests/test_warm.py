@@ -0,0 +1,115 @@
+"""WarmChannelPool 的預開、補充與閒置淘汰，以及 warm 相關選項"""
+import itertools
+import time
+
+import pytest
+
+from tunnel_engine import (WARM_IDLE_TIMEOUT, WARM_MIN_IDLE, TunnelLimits, TunnelStats, WarmChannelPool,
+                           transport_channels)
+
+
+class FakeChannel:
+    ids = itertools.count()
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.id = next(self.ids)
+        self.closed = False
+        self.eof_received = False
+        self.name = None
+
+    def get_id(self):
+        return self.id
+
+    def get_transport(self):
+        return self.transport
+
+    def set_name(self, name):
+        self.name = name
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTransport:
+    def __init__(self, active=True):
+        self.active = active
+        self.opened = []
+
+    def is_active(self):
+        return self.active
+
+    def open_channel(self, kind, dest, origin, timeout=None, window_size=None, max_packet_size=None):
+        assert kind == "direct-tcpip" and dest == ("10.0.0.1", 80)
+        channel = FakeChannel(self)
+        self.opened.append(channel)
+        return channel
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def pool():
+    transport = FakeTransport()
+    pool = WarmChannelPool(transport, "10.0.0.1", 80, size=2, stats=TunnelStats("warm"))
+    _wait_until(lambda: len(pool._channels) == 2)
+    yield pool
+    pool.close()
+
+
+def test_pool_fills_and_refills_after_get(pool):
+    channel = pool.get()
+    assert channel in pool.transport.opened and channel.name == "10.0.0.1:80"
+    _wait_until(lambda: len(pool._channels) == 2)
+    assert len(pool.transport.opened) == 3
+    assert pool.stats.warm_hits == 1 and pool.open_latency > 0
+    # 交出去的與池中的 channel 都算在 Transport 上
+    assert len(transport_channels(pool.transport)) == 3
+
+
+def test_closed_channels_are_skipped(pool):
+    for _, channel in pool._channels:
+        channel.eof_received = True
+    pool.transport.active = False      # 不再補充，池子取完就是空的
+    assert pool.get() is None
+    assert pool.stats.warm_misses == 1
+    assert all(channel.closed for channel in pool.transport.opened)
+    assert len(transport_channels(pool.transport)) == 0
+
+
+def test_idle_channels_are_evicted(pool):
+    with pool._cond:
+        pool.transport.active = False
+        stale = pool._channels[0][1]
+        pool._channels[0] = (time.monotonic() - pool.idle_timeout - 1, stale)
+        pool._evict_idle()
+        assert stale.closed and len(pool._channels) == 1
+
+
+def test_close_releases_pooled_channels():
+    transport = FakeTransport()
+    pool = WarmChannelPool(transport, "10.0.0.1", 80, size=3)
+    _wait_until(lambda: len(pool._channels) == 3)
+    pool.close()
+    assert all(channel.closed for channel in transport.opened)
+    assert pool.get() is None
+
+
+def test_inactive_transport_is_not_filled():
+    transport = FakeTransport(active=False)
+    pool = WarmChannelPool(transport, "10.0.0.1", 80, size=2)
+    time.sleep(0.1)
+    assert transport.opened == []
+    pool.close()
+
+
+@pytest.mark.parametrize("text, expected", [("5", 5.0), ("0.1", WARM_MIN_IDLE), ("0", WARM_IDLE_TIMEOUT),
+                                            ("x", WARM_IDLE_TIMEOUT)])
+def test_warm_idle_option_is_clamped(text, expected):
+    limits = TunnelLimits.from_options({"warm": "2", "warm_idle": text})
+    assert limits.warm == 2 and limits.warm_idle == expected
@@ -0,0 +1,118 @@
+"""多程序轉發：worker 的分配、統計快照、記錄回傳，以及 workers=2 的端對端轉發"""
+import logging
+import os
+import socket
+import time
+
+import pytest
+
+import benchmark
+import tunnel_engine
+import tunnel_workers
+from tunnel_engine import STATUS_COUNTERS, TunnelEngine, TunnelSpec, log, tunnel_log
+from tunnel_workers import RemoteTunnel, WorkerPool, _PipeLogHandler, _RemoteStats
+
+
+def _wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_remote_stats_before_and_after_first_report():
+    stats = _RemoteStats("web", {"local_port": "8080", "target": "10.0.0.1:80"})
+    snapshot = stats.snapshot()
+    assert snapshot["name"] == "web" and snapshot["labels"]["local_port"] == "8080"
+    assert snapshot["bytes_out"] == 0
+    stats.update(dict(snapshot, bytes_out=10, active_connections=2, extra="x"))
+    assert stats.snapshot()["bytes_out"] == 10
+    assert stats.counters() == dict({key: 0 for key in STATUS_COUNTERS}, bytes_out=10, active_connections=2)
+
+
+def test_pipe_log_handler_sends_formatted_records():
+    sent = []
+    handler = _PipeLogHandler(sent.append)
+    log.addHandler(handler)
+    level = log.level
+    log.setLevel(logging.INFO)
+    try:
+        tunnel_log("web").warning("連線 %s 失敗", 3)
+    finally:
+        log.removeHandler(handler)
+        log.setLevel(level)
+    kind, record = sent[-1]
+    assert kind == "log"
+    assert (record["msg"], record["tunnel"], record["levelname"]) == ("連線 3 失敗", "web", "WARNING")
+    # 主程序以 makeLogRecord 還原，tunnel 欄位與訊息都保留
+    restored = logging.makeLogRecord(record)
+    assert restored.getMessage() == "連線 3 失敗" and restored.tunnel == "web"
+
+
+class FakeWorker:
+    created = []
+
+    def __init__(self, context, index):
+        self.index = index
+        self.tunnels = {}
+        self.alive = True
+        self.closed = False
+        self.created.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTunnel:
+    def __init__(self, tunnel_id):
+        self.id = tunnel_id
+
+
+def test_pool_assigns_to_least_loaded_and_replaces_dead_workers(monkeypatch):
+    monkeypatch.setattr(tunnel_workers, "_Worker", FakeWorker)
+    FakeWorker.created = []
+    pool = WorkerPool(2)
+    tunnels = [FakeTunnel(i) for i in range(4)]
+    assigned = [pool.assign(tunnel).index for tunnel in tunnels]
+    assert assigned == [0, 1, 0, 1] and len(FakeWorker.created) == 2
+    pool.forget(tunnels[0])
+    pool.forget(tunnels[2])
+    assert [len(worker.tunnels) for worker in pool._workers] == [0, 2]
+    assert pool.assign(FakeTunnel(8)).index == 0
+    FakeWorker.created[1].alive = False   # worker 程序結束，下次分配時重建
+    replacement = pool.assign(FakeTunnel(9))
+    assert len(FakeWorker.created) == 3 and replacement is FakeWorker.created[2]
+    pool.shutdown()
+    assert pool._workers == [None, None]
+    assert FakeWorker.created[0].closed and FakeWorker.created[2].closed
+
+
+def test_workers_forward_in_separate_processes(monkeypatch):
+    server = benchmark.LocalSSHServer()
+    monkeypatch.setattr(tunnel_engine, "SSH_PORT", server.port)
+    echo = benchmark._listen()
+    benchmark._serve_forever(echo, benchmark._echo)
+    engine = TunnelEngine(f"{benchmark.BENCH_USER}@127.0.0.1", benchmark.BENCH_PASSWORD, {"workers": "2"})
+    try:
+        ports = [benchmark._free_port() for _ in range(2)]
+        tunnels = [engine.add_tunnel(TunnelSpec(port, "127.0.0.1", echo.getsockname()[1], f"w{port}"))
+                   for port in ports]
+        assert all(isinstance(tunnel, RemoteTunnel) for tunnel in tunnels)
+        for tunnel in tunnels:
+            tunnel.start()
+        # SSH_PORT 由主程序帶入 spawn 出的 worker，兩條通道分到不同程序
+        _wait_until(lambda: all(tunnel.state == "connected" for tunnel in tunnels), timeout=30)
+        pids = {tunnel.worker.process.pid for tunnel in tunnels}
+        assert len(pids) == 2 and os.getpid() not in pids
+        for port in ports:
+            with socket.create_connection(("127.0.0.1", port), timeout=10) as client:
+                client.sendall(b"ping")
+                assert benchmark._recv_exact(client, 4) == b"ping"
+        _wait_until(lambda: all(tunnel.stats.snapshot()["bytes_out"] >= 4 for tunnel in tunnels))
+        tunnels[0].stop()
+        assert tunnels[0].state == "stopped"
+        assert not tunnels[0].worker.tunnels.get(tunnels[0].id)
+        with pytest.raises(OSError):
+            socket.create_connection(("127.0.0.1", ports[0]), timeout=2).close()
+    finally:
+        engine.close()
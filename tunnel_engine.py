@@ -0,0 +1,3308 @@
+"""
+SSH 通道轉發引擎（不依賴 tkinter / pystray / PIL）。
+ssh.py 的 GUI 只是這個引擎的前端；也可以直接以無介面模式執行：
+
+    python ssh.py --headless --config ssh通道.config
+"""
+import socket
+import os
+import threading
+import select
+import errno
+import sys
+import time
+import signal
+import hashlib
+import hmac
+import random
+import argparse
+import bisect
+import ipaddress
+import json
+import multiprocessing
+import selectors
+import collections
+import importlib
+import math
+import weakref
+import logging
+import logging.handlers
+import queue
+import functools
+
+
+class _LazyModule:
+    """
+    第一次存取屬性時才 import 的模組代理。
+    paramiko 與 asyncio 合計要載入數百毫秒，GUI 啟動時用不到，延後到第一次連線或選用 asyncio 模式時才載入。
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            # import 本身有模組鎖保護，多條執行緒同時觸發也只會載入一次
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+paramiko = _LazyModule("paramiko")
+asyncio = _LazyModule("asyncio")
+
+
+def preload():
+    """預先載入 paramiko（GUI 在視窗出現後於背景呼叫），第一次連線時就不必再等待載入"""
+    paramiko.Transport
+
+CONFIG_FILE = "ssh通道.config"
+CONFIG_POLL_INTERVAL = 1.0    # 檢查設定檔是否被修改的間隔（秒）
+SSH_PORT = 22
+RECONNECT_BASE_DELAY = 0.5    # 第一次重新連線前的等待（秒），之後每次加倍
+RECONNECT_MAX_DELAY = 30.0    # 重新連線等待的上限（秒）
+HEALTH_PROBE_INTERVAL = 0.25  # 探測 Transport 是否存活的間隔（秒），0 代表停用
+HEALTH_PROBE_MIN_TIMEOUT = 0.5  # 探測逾時的下限（秒），未設定 probe_timeout 時取 RTT 倍數與此值的較大者
+HEALTH_PROBE_RTT_FACTOR = 4     # 未設定 probe_timeout 時，逾時為量測到的 RTT 乘上此倍數
+HEALTH_PROBE_RTT_SMOOTHING = 0.2  # 每次探測的 RTT 併入平滑估計的比重
+RECONNECT_STABLE_SECONDS = 10.0  # 重新連線後要維持這麼久才把退避次數歸零，避免反覆斷線時立刻重試
+# crypto=auto 時參與量測的演算法（略過 CBC、3DES 等舊演算法）
+CRYPTO_CANDIDATE_CIPHERS = ("aes128-gcm@openssh.com", "aes256-gcm@openssh.com", "aes128-ctr", "aes256-ctr")
+CRYPTO_CANDIDATE_MACS = ("hmac-sha2-256-etm@openssh.com", "hmac-sha2-512-etm@openssh.com")
+CRYPTO_BENCH_SECONDS = 0.1    # 每個組合的量測時間（秒）
+CRYPTO_KEY_SIZES = {"aes128-gcm@openssh.com": 16, "aes256-gcm@openssh.com": 32, "aes128-ctr": 16, "aes256-ctr": 32}
+CRYPTO_MAC_DIGESTS = {"hmac-sha2-256-etm@openssh.com": "sha256", "hmac-sha2-512-etm@openssh.com": "sha512"}
+CRYPTO_BENCH_PACKET = 32 * 1024  # 與 paramiko 的最大封包大小相同
+
+# 轉發模式："thread" 每個連線一條執行緒；"asyncio" 所有通道共用單一事件迴圈
+FORWARD_MODE = os.environ.get("SSH_TUNNEL_FORWARD_MODE", "thread")
+MB = 1024 * 1024
+RELAY_BUFFER_SIZE = 256 * 1024  # transfer() 每個方向的讀取緩衝區大小
+RELAY_POLL_INTERVAL = 0.01      # SSH 視窗已滿時輪詢 channel 是否可寫的間隔（秒）
+ASYNC_BUFFER_SIZE = 64 * 1024   # asyncio 模式下每個方向最多暫存的位元組數
+ASYNC_WINDOW_RETRY = 0.01       # SSH 視窗已滿時重試送出的間隔（秒）
+ASYNC_RATE_WINDOW = 5.0         # 計算每秒新連線數的時間窗（秒）
+ASYNC_STATS_INTERVAL = 60.0     # 輸出統計的間隔（秒）
+# open_channel 延遲直方圖的上界（秒）
+OPEN_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_HOST = "127.0.0.1"      # metrics 端點只綁定本機
+# 連線准入的預設值，可用通道或 GLOBAL 的選項欄位覆寫（backlog、max_opening、max_conns、overflow、open_timeout、queue_timeout）
+LISTEN_BACKLOG = 128            # listen() 的 backlog，突發連線時不會直接被拒絕
+MAX_OPENING = 16                # 每條通道同時進行中的 open_channel 上限
+MAX_CONNECTIONS = 0             # 每條通道同時轉發的連線上限，0 代表不限制
+OVERFLOW_POLICY = "queue"       # 連線數已滿時："queue" 排隊等待，"reject" 立即關閉
+OPEN_TIMEOUT = 10.0             # open_channel 等待伺服器回覆的上限（秒）
+QUEUE_TIMEOUT = 30.0            # 排隊超過此秒數仍沒有空位就放棄該連線
+# 預先開好的 channel（選項 warm=N 啟用，預設 0 不啟用）
+WARM_IDLE_TIMEOUT = 60.0        # 預開 channel 閒置超過此秒數就關閉重開，避免被對方逾時斷線
+WARM_RETRY_DELAY = 1.0          # 預開失敗後等待多久再補
+WARM_MIN_IDLE = 1.0             # warm_idle 的下限（秒），也讓補充執行緒的等待間隔至少為其一半
+# 每條通道使用的 Transport 數（選項 transports=K），以及 channel 的接收視窗 / 最大封包（選項 window、max_packet）
+TRANSPORTS_PER_TUNNEL = 1
+MAX_TRANSPORTS_PER_TUNNEL = 16
+# 頻寬整形（選項 rate、conn_rate、transport_rate，單位為位元組/秒，可加 K / M）
+SHAPING_BURST_SECONDS = 0.1     # 權杖桶容量為 rate × 此秒數，決定可瞬間送出的量
+SHAPING_MIN_CHUNK = 16 * 1024   # 有限速時每次讀取至少這麼多，避免封包過碎
+FLOW_RATE_WINDOW = 1.0          # 每條連線速率估計（指數衰減）的時間常數（秒）
+FAIR_SHARE_INTERACTIVE = 0.5    # 近期用量低於平均分配的這個比例，視為互動流量而不必等待
+# 連線回收與資源預算（選項 idle_timeout、max_lifetime 以秒為單位，0 代表不限；max_fds、max_channels 建議寫在 GLOBAL 行）
+REAPER_INTERVAL = 1.0           # 檢查閒置 / 超過存活時間連線的間隔（秒）
+FDS_PER_CONNECTION = 3          # 每條轉發連線佔用的 fd：本機 socket，加上 paramiko channel 供 select 使用的一對 pipe
+FD_RESERVE = 64                 # 自動推算 max_fds 時保留給 SSH 連線、監聽 socket 與設定檔等的 fd 數
+# 連線追蹤（選項 trace=取樣比例，例如 trace=0.05 追蹤 5% 的連線；預設 0 不追蹤）
+TRACE_BUFFER_SIZE = 200         # 每條通道保留最近完成的追蹤筆數
+# GUI 定時讀取的統計欄位（TunnelStats.counters()），讀取成本與流量、連線數無關
+STATUS_COUNTERS = ("active_connections", "bytes_out", "bytes_in", "reconnect_attempts", "next_retry")
+# SOCKS5 動態轉發（選項 type=socks5）
+SOCKS_HANDSHAKE_TIMEOUT = 10.0  # 用戶端完成 SOCKS 交握的時限（秒）
+SOCKS_DNS_TTL = 300.0           # dns=local 時解析結果的快取秒數
+SOCKS_DNS_NEGATIVE_TTL = 10.0   # 解析失敗的快取秒數
+SOCKS_DNS_CACHE_SIZE = 1024     # 快取的主機名稱數上限
+SOCKS_SUCCEEDED = 0
+SOCKS_GENERAL_FAILURE = 1
+SOCKS_HOST_UNREACHABLE = 4
+SOCKS_COMMAND_NOT_SUPPORTED = 7
+SOCKS_ADDRESS_NOT_SUPPORTED = 8
+# 記錄（GLOBAL 選項 log_level、log_file；無介面模式也可用 --log-level、--log-file）
+LOG_LEVEL = "info"
+LOG_BUFFER_SIZE = 5000          # 記憶體中保留的最近記錄筆數，供 GUI 記錄窗格與 log_buffer.records() 查詢
+LOG_FILE_MAX_BYTES = 5 * MB     # 記錄檔超過此大小就輪替
+LOG_FILE_BACKUPS = 3            # 輪替時保留的舊記錄檔數
+LOG_CONSOLE_FORMAT = "%(asctime)s %(message)s"
+LOG_FILE_FORMAT = "%(asctime)s %(levelname)-7s [%(tunnel)s] %(message)s"
+
+log = logging.getLogger("ssh_tunnel")
+
+
+def tunnel_log(name):
+    """附帶通道名稱的記錄器；記錄檔、GUI 記錄窗格與 log_buffer.records() 都可依名稱篩選"""
+    return logging.LoggerAdapter(log, {"tunnel": name})
+
+
+def _log(stats):
+    return stats.log if stats is not None else log
+
+
+class LogBuffer(logging.Handler):
+    """
+    保留最近 capacity 筆記錄的環狀緩衝區。存放的是 LogRecord 本身，查詢時才格式化訊息；
+    serial 為累計收到的筆數，GUI 用來判斷是否需要重畫。
+    """
+
+    def __init__(self, capacity=LOG_BUFFER_SIZE):
+        super().__init__()
+        self._records = collections.deque(maxlen=capacity)
+        self.serial = 0
+
+    def emit(self, record):
+        self._records.append(record)
+        self.serial += 1
+
+    def records(self, tunnel=None, level=logging.NOTSET, limit=None):
+        """
+        依通道名稱（不分大小寫的部分比對）與最低等級篩選，由舊到新回傳
+        [{"time", "level", "tunnel", "message"}]；limit 只取最後幾筆。
+        """
+        with self.lock:
+            records = list(self._records)
+        tunnel = (tunnel or "").lower()
+        result = []
+        for record in reversed(records):
+            name = str(getattr(record, "tunnel", "") or "")
+            if record.levelno < level or tunnel not in name.lower():
+                continue
+            result.append({
+                "time": record.created,
+                "level": record.levelname,
+                "tunnel": name,
+                "message": record.getMessage(),
+            })
+            if limit and len(result) >= limit:
+                break
+        result.reverse()
+        return result
+
+
+log_buffer = LogBuffer()
+_log_queue = None
+_log_listener = None
+
+
+def parse_log_level(name):
+    """把 "debug"、"info"、"warning"、"error" 轉成 logging 的等級，無法辨識時使用 LOG_LEVEL"""
+    level = logging.getLevelName(str(name or LOG_LEVEL).upper())
+    return level if isinstance(level, int) else logging.getLevelName(LOG_LEVEL.upper())
+
+
+def setup_logging(level=LOG_LEVEL, log_file=None, console=True, handlers=()):
+    """
+    設定 ssh_tunnel 記錄器。呼叫端只把尚未格式化的 LogRecord 放進佇列就返回（轉發的執行緒不做 I/O），
+    由背景執行緒寫入 log_buffer、主控台、輪替的記錄檔（log_file）與額外的 handlers。
+    可重複呼叫以變更等級或記錄檔，切換前會先寫完佇列中的記錄。
+    """
+    global _log_queue, _log_listener
+    log.setLevel(parse_log_level(level))
+    targets = [log_buffer]
+    if console:
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(logging.Formatter(LOG_CONSOLE_FORMAT, "%H:%M:%S"))
+        targets.append(stream)
+    if log_file:
+        try:
+            file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_FILE_MAX_BYTES,
+                                                                backupCount=LOG_FILE_BACKUPS, encoding="utf-8")
+            file_handler.setFormatter(logging.Formatter(LOG_FILE_FORMAT))
+            targets.append(file_handler)
+        except OSError as e:
+            log.error("❌ 無法開啟記錄檔 %s: %s", log_file, e)
+    targets.extend(handlers)
+
+    if _log_listener is None:
+        import atexit
+        _log_queue = queue.SimpleQueue()
+        log.addHandler(_DeferredQueueHandler(_log_queue))
+        log.propagate = False
+        atexit.register(_stop_logging)
+    else:
+        _stop_logging()
+    _log_listener = _LogListener(_log_queue, *targets)
+    _log_listener.start()
+
+
+def _stop_logging():
+    """寫完佇列中的記錄並關閉記錄檔；程式結束時由 atexit 呼叫"""
+    listener = _log_listener
+    if listener is None or not listener.started:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        if handler is not log_buffer:
+            handler.close()
+
+
+class _DeferredQueueHandler(logging.Handler):
+    """
+    只把 LogRecord 放進佇列。logging.handlers.QueueHandler 會在呼叫端先格式化訊息，
+    這裡把格式化留給背景執行緒（同一程序內不需要序列化），參數保持原樣。
+    """
+
+    def __init__(self, records):
+        super().__init__()
+        self.queue = records
+
+    def emit(self, record):
+        self.queue.put_nowait(record)
+
+
+class _LogListener(logging.handlers.QueueListener):
+    """在背景執行緒中把佇列裡的記錄交給各個 handler；started 表示背景執行緒是否在執行"""
+
+    started = False
+
+    def start(self):
+        super().start()
+        self.started = True
+
+    def stop(self):
+        super().stop()
+        self.started = False
+
+    def prepare(self, record):
+        # 沒有指定通道的記錄也要有 tunnel 欄位，記錄檔的格式才能套用
+        if not hasattr(record, "tunnel"):
+            record.tunnel = "-"
+        return record
+
+
+def _measure_throughput(encrypt, data, duration):
+    total = 0
+    started = time.perf_counter()
+    while True:
+        encrypt(data)
+        total += len(data)
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            return total / elapsed / MB
+
+
+def is_aead(cipher):
+    """AES-GCM 自帶驗證，協商出的 MAC 不會被使用"""
+    return cipher.endswith("-gcm@openssh.com")
+
+
+def supported_algorithms():
+    """這個 paramiko 版本可協商的 cipher 與 MAC，取自一條不會連線的 Transport 的 get_security_options()"""
+    left, right = socket.socketpair()
+    try:
+        options = paramiko.Transport(left).get_security_options()
+        return {"ciphers": set(options.ciphers), "digests": set(options.digests)}
+    finally:
+        left.close()
+        right.close()
+
+
+def benchmark_crypto(duration=CRYPTO_BENCH_SECONDS):
+    """
+    在本機 CPU 上量測每個 cipher/MAC 組合加密一個封包的速度，
+    回傳由快到慢排序的 [{"cipher", "mac", "mb_per_s"}]。
+    AES-GCM 本身帶有驗證，不需要另外的 MAC，mac 為空字串。
+    """
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    supported = supported_algorithms()
+    packet = os.urandom(CRYPTO_BENCH_PACKET)
+    results = []
+    for cipher in CRYPTO_CANDIDATE_CIPHERS:
+        if cipher not in supported["ciphers"]:
+            continue
+        key = os.urandom(CRYPTO_KEY_SIZES[cipher])
+        if is_aead(cipher):
+            aead = AESGCM(key)
+            nonce = os.urandom(12)
+            speed = _measure_throughput(lambda data: aead.encrypt(nonce, data, b"\0\0\0\0"), packet, duration)
+            results.append({"cipher": cipher, "mac": "", "mb_per_s": round(speed, 1)})
+            continue
+        for mac in CRYPTO_CANDIDATE_MACS:
+            if mac not in supported["digests"]:
+                continue
+            encryptor = Cipher(algorithms.AES(key), modes.CTR(os.urandom(16))).encryptor()
+            digest = CRYPTO_MAC_DIGESTS[mac]
+            mac_key = os.urandom(32)
+
+            def encrypt(data, encryptor=encryptor, digest=digest, mac_key=mac_key):
+                return hmac.new(mac_key, encryptor.update(data), digest).digest()
+
+            speed = _measure_throughput(encrypt, packet, duration)
+            results.append({"cipher": cipher, "mac": mac, "mb_per_s": round(speed, 1)})
+    results.sort(key=lambda r: r["mb_per_s"], reverse=True)
+    return results
+
+
+class CryptoProfile:
+    """
+    連線到伺服器時的加密偏好：優先使用的 cipher 與 MAC，以及是否啟用 zlib 壓縮。
+    偏好只調整協商順序，伺服器不支援時仍會退回 paramiko 的其他演算法。
+    對應 GLOBAL 行的選項 cipher、mac、compress；crypto=auto 則由 TunnelEngine 先量測再決定。
+    """
+
+    def __init__(self, cipher="", mac="", compress=False):
+        self.cipher = cipher
+        self.mac = mac
+        self.compress = compress
+
+    @classmethod
+    def from_options(cls, options):
+        compress = options.get("compress", "no").lower() in ("1", "yes", "true", "on", "zlib")
+        return cls(options.get("cipher", ""), options.get("mac", ""), compress)
+
+    @classmethod
+    def auto(cls, compress=False):
+        """依 benchmark_crypto() 選出本機最快的組合；壓縮取決於連線頻寬，沿用原本的設定"""
+        results = benchmark_crypto()
+        for r in results:
+            log.info("   %-24s %-30s %8s MB/s", r["cipher"], r["mac"] or "(AEAD)", r["mb_per_s"])
+        best = results[0]
+        log.info("🔐 自動選擇加密：%s %s", best["cipher"], best["mac"])
+        return cls(best["cipher"], best["mac"], compress)
+
+    def merged(self, options):
+        """回傳寫入這個設定後的新選項 dict（取代 crypto=auto 與舊的 cipher/mac/compress），不修改 options"""
+        replaced = ("crypto", "cipher", "mac", "compress")
+        options = {key: value for key, value in options.items() if key not in replaced}
+        if self.cipher:
+            options["cipher"] = self.cipher
+        if self.mac:
+            options["mac"] = self.mac
+        options["compress"] = "yes" if self.compress else "no"
+        return options
+
+    def key(self):
+        return (self.cipher, self.mac, self.compress)
+
+    def transport_factory(self, sock, **kwargs):
+        """給 SSHClient.connect 使用：建立 Transport 並把偏好的演算法排到協商清單最前面"""
+        transport = paramiko.Transport(sock, **kwargs)
+        options = transport.get_security_options()
+        for attr, preferred in (("ciphers", self.cipher), ("digests", self.mac)):
+            if not preferred:
+                continue
+            available = getattr(options, attr)
+            if preferred in available:
+                setattr(options, attr, (preferred,) + tuple(a for a in available if a != preferred))
+            else:
+                log.warning("⚠️ 不支援的演算法 %s，使用預設順序", preferred)
+        return transport
+
+
+class TransportPool:
+    """
+    依 (user, host, port, auth, 加密設定, slot) 共用 SSH Transport；slot 讓同一台伺服器可以有多條平行連線。
+    每個通道以 acquire/release 取用，採參考計數，最後一個使用者釋放時才關閉連線。
+    每條 Transport 都有探測執行緒定期送出 keepalive@openssh.com 並等待回覆，
+    探測逾時且這段期間也沒有從任何 channel 收到資料，或連線已斷時，由監看執行緒判定失效，
+    關閉它並呼叫各使用者在 acquire 時登記的 on_lost。
+    逾時取各使用者 acquire 時指定的 probe_timeout 中最大者；都沒指定時為
+    探測量得的 RTT 乘上 HEALTH_PROBE_RTT_FACTOR，且不低於 HEALTH_PROBE_MIN_TIMEOUT。
+    線路中斷後約 逾時 + HEALTH_PROBE_INTERVAL / 2 秒內判定失效：RTT 在 200 ms 以下時不到一秒。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._monitor = None
+
+    @staticmethod
+    def make_key(user, host, port, password, profile=None, slot=0):
+        # 密碼只以雜湊值作為 key 的一部分，避免明文留在字典中
+        auth = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        return (user, host, port, auth, profile.key() if profile else None, slot)
+
+    def acquire(self, user, host, port, password, on_lost=None, profile=None, slot=0, probe_timeout=None):
+        """
+        取得（必要時建立）共用 Transport，回傳 (key, transport)；profile 為 CryptoProfile。
+        slot 不同就是另一條 TCP 連線，各通道的第 i 條連線都共用 slot i。
+        probe_timeout 為這個使用者要求的探測逾時（秒），None 代表依 RTT 自動決定。
+        """
+        key = self.make_key(user, host, port, password, profile, slot)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"lock": threading.Lock(), "client": None, "transport": None, "refs": 0,
+                         "watchers": [], "probe_sent": None, "probe_timeouts": {}, "rtt": None, "rtt_probed": False}
+                self._entries[key] = entry
+            entry["refs"] += 1
+            if on_lost:
+                entry["watchers"].append(on_lost)
+                if probe_timeout:
+                    entry["probe_timeouts"][on_lost] = probe_timeout
+
+        # 同一台伺服器的並行 acquire 會在此排隊，只有第一個會真正握手
+        try:
+            with entry["lock"]:
+                transport = entry["transport"]
+                if transport is None or not transport.is_active():
+                    self._close_entry(entry)
+                    log.info("嘗試連線到 %s，使用帳號 %s%s...", host, user, f"（第 {slot + 1} 條連線）" if slot else "")
+                    client = paramiko.SSHClient()
+                    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                    started = time.monotonic()
+                    client.connect(host, port=port, username=user, password=password,
+                                   timeout=5, banner_timeout=5, auth_timeout=5,
+                                   compress=bool(profile and profile.compress),
+                                   transport_factory=profile.transport_factory if profile else None)
+                    transport = client.get_transport()
+                    # 握手要來回數次，以它當 RTT 的初始估計只會偏大，第一次探測回覆後就改用實際量到的值
+                    entry["rtt"] = time.monotonic() - started
+                    entry["rtt_probed"] = False
+                    log.info("🔐 %s 加密：%s %s，壓縮：%s", host, transport.local_cipher,
+                             "(AEAD)" if is_aead(transport.local_cipher) else transport.local_mac,
+                             transport.local_compression)
+                    transport.set_keepalive(30)
+                    # 多條 channel 共用一條 TCP 連線，小封包（channel 關閉、請求/回應）不能被 Nagle 延遲
+                    transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    entry["client"] = client
+                    entry["transport"] = transport
+                    self._start_probe(entry, transport)
+                return key, transport
+        except Exception:
+            self.release(key, on_lost)
+            raise
+
+    def release(self, key, on_lost=None):
+        """釋放一次參考，若已無任何通道使用則關閉 SSH 連線"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if on_lost in entry["watchers"]:
+                entry["watchers"].remove(on_lost)
+                entry["probe_timeouts"].pop(on_lost, None)
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return
+            del self._entries[key]
+        with entry["lock"]:
+            self._close_entry(entry)
+
+    def _start_probe(self, entry, transport):
+        if HEALTH_PROBE_INTERVAL <= 0:
+            return
+        threading.Thread(target=self._probe_loop, args=(entry, transport), name="ssh_probe", daemon=True).start()
+        with self._lock:
+            if self._monitor is None or not self._monitor.is_alive():
+                self._monitor = threading.Thread(target=self._monitor_loop, name="ssh_monitor", daemon=True)
+                self._monitor.start()
+
+    @staticmethod
+    def _probe_loop(entry, transport):
+        """持續送出需要回覆的 global request；伺服器拒絕也算有回應，來回時間併入 RTT 估計"""
+        while entry["transport"] is transport and transport.is_active():
+            sent = entry["probe_sent"] = time.monotonic()
+            try:
+                transport.global_request("keepalive@openssh.com", wait=True)
+            except Exception:
+                return
+            rtt = time.monotonic() - sent
+            if entry["rtt_probed"]:
+                rtt = entry["rtt"] + (rtt - entry["rtt"]) * HEALTH_PROBE_RTT_SMOOTHING
+            entry["rtt"], entry["rtt_probed"] = rtt, True
+            entry["probe_sent"] = None
+            time.sleep(HEALTH_PROBE_INTERVAL)
+
+    @staticmethod
+    def probe_timeout(entry):
+        """這條 Transport 的探測逾時（秒）"""
+        requested = list(entry["probe_timeouts"].values())
+        if requested:
+            return max(requested)
+        return max(HEALTH_PROBE_MIN_TIMEOUT, HEALTH_PROBE_RTT_FACTOR * (entry["rtt"] or 0.0))
+
+    def _monitor_loop(self):
+        while True:
+            time.sleep(HEALTH_PROBE_INTERVAL / 2)
+            now = time.monotonic()
+            with self._lock:
+                entries = list(self._entries.values())
+                if not entries:
+                    self._monitor = None
+                    return
+            for entry in entries:
+                transport = entry["transport"]
+                if transport is None:
+                    continue
+                sent = entry["probe_sent"]
+                if not transport.is_active():
+                    self._mark_dead(entry, transport, "連線已中斷")
+                    continue
+                if sent is None:
+                    continue
+                # 大量傳輸時探測回覆可能排在資料後面；期間有收到任何資料就表示連線仍然存活
+                timeout = self.probe_timeout(entry)
+                if now - max(sent, transport_inbound(transport).last) > timeout:
+                    self._mark_dead(entry, transport, f"{timeout:.1f} 秒內沒有回應")
+
+    def _mark_dead(self, entry, transport, reason):
+        with entry["lock"]:
+            if entry["transport"] is not transport:
+                return
+            log.warning("⚠️ SSH 連線失效（%s），通知 %d 條通道重新連線", reason, len(entry["watchers"]))
+            self._close_entry(entry)
+        with self._lock:
+            watchers = list(entry["watchers"])
+        for on_lost in watchers:
+            threading.Thread(target=on_lost, daemon=True).start()
+
+    @staticmethod
+    def _close_entry(entry):
+        entry["probe_sent"] = None
+        if entry["transport"]:
+            try:
+                entry["transport"].close()
+                log.info("SSH 連線已關閉")
+            except Exception as e:
+                log.warning("關閉 SSH 連線時發生錯誤: %s", e)
+            entry["transport"] = None
+        if entry["client"]:
+            try:
+                entry["client"].close()
+                log.info("SSH 客戶端已關閉")
+            except Exception as e:
+                log.warning("關閉 SSH 客戶端時發生錯誤: %s", e)
+            entry["client"] = None
+
+
+class TransportGroup:
+    """
+    同一台伺服器的多條 Transport（選項 transports=K），對轉發端提供與單一 Transport 相同的
+    open_channel / is_active。每次開啟 channel 都交給目前 channel 最少的那條，
+    讓大量連線分散到 K 條 TCP 連線與 K 條加密執行緒，不會共用同一個視窗與封包佇列。
+    """
+
+    def __init__(self, transports):
+        self.transports = list(transports)
+
+    def pick(self):
+        """回傳目前 channel 數最少的 Transport（跨所有共用它的通道計算）"""
+        active = [t for t in self.transports if t.is_active()] or self.transports
+        # 開通中的 channel 也算在內，同時湧入的連線才會被分散
+        return min(active, key=lambda t: len(transport_channels(t)))
+
+    def open_channel(self, *args, **kwargs):
+        return self.pick().open_channel(*args, **kwargs)
+
+    def is_active(self):
+        # 任何一條失效都視為整組失效，由 Tunnel 一起重新連線
+        return all(t.is_active() for t in self.transports)
+
+
+class ReconnectSupervisor:
+    """
+    連線失敗的通道交由這裡重試，同一台遠端伺服器的通道合併成一組：
+    每次只讓一條通道（leader）嘗試握手，成功後其餘通道直接沿用共用 Transport，
+    失敗則整組以指數退避加抖動延後，避免伺服器恢復時所有通道同時湧入。
+    本機端口無法綁定這類與伺服器無關的失敗，則以該端口自成一組各自退避。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    @staticmethod
+    def backoff(attempt):
+        """第 attempt 次重試的延遲：上限 RECONNECT_MAX_DELAY，並在後半段隨機抖動"""
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _group_key(tunnel, local):
+        return ("local", tunnel.spec.local_port) if local else tunnel.server_id()
+
+    def schedule(self, tunnel, local=False):
+        key = self._group_key(tunnel, local)
+        with self._lock:
+            group = self._groups.setdefault(key, {"tunnels": [], "attempt": 0, "timer": None, "due": 0.0,
+                                                  "leader": None})
+            if tunnel not in group["tunnels"]:
+                group["tunnels"].append(tunnel)
+            waiting = len(group["tunnels"])
+            if group["leader"] is not None and group["leader"] not in group["tunnels"]:
+                waiting += 1  # 正在握手的 leader 已從 tunnels 取出，但同樣在等這一輪的結果
+            if group["timer"] is not None:
+                tunnel.stats.reconnect_scheduled(group["due"])
+                return
+            connected_at = group.pop("connected_at", None)
+            if connected_at is not None:
+                if time.monotonic() - connected_at >= RECONNECT_STABLE_SECONDS:
+                    group["attempt"] = 0
+                else:
+                    # 連上不久又斷線（例如伺服器剛啟動就不穩），視同一次失敗，繼續拉長等待
+                    group["attempt"] += 1
+            delay = self.backoff(group["attempt"])
+            group["due"] = time.time() + delay
+            for member in group["tunnels"]:
+                member.stats.reconnect_scheduled(group["due"])
+            group["timer"] = threading.Timer(delay, self._fire, args=(key,))
+            group["timer"].daemon = True
+            group["timer"].start()
+        if local:
+            tunnel.stats.log.info("%.1f 秒後重試本機端口 %s", delay, tunnel.spec.local_port)
+        else:
+            log.info("%.1f 秒後重新連線 %s@%s（%d 條通道等待中）", delay, key[0], key[1], waiting)
+
+    def cancel(self, tunnel):
+        with self._lock:
+            for key in (self._group_key(tunnel, False), self._group_key(tunnel, True)):
+                group = self._groups.get(key)
+                if group and tunnel in group["tunnels"]:
+                    group["tunnels"].remove(tunnel)
+
+    def _fire(self, key):
+        local = key[0] == "local"
+        with self._lock:
+            group = self._groups.get(key)
+            group["timer"] = None
+            group["tunnels"] = [t for t in group["tunnels"] if t.enabled]
+            if not group["tunnels"]:
+                del self._groups[key]
+                return
+            leader = group["leader"] = group["tunnels"].pop(0)
+
+        result = leader.connect()
+        retry_group = result == "ssh_failed" or (local and result == "local_failed")
+        with self._lock:
+            group["leader"] = None
+            if retry_group:
+                # 仍然失敗：整組延後，下一輪由同一條通道再試
+                group["tunnels"].insert(0, leader)
+                group["attempt"] += 1
+                waiting = []
+            else:
+                # 退避次數等連線維持 RECONNECT_STABLE_SECONDS 後才歸零（見 schedule）
+                group["connected_at"] = time.monotonic()
+                waiting, group["tunnels"] = group["tunnels"], []
+        if retry_group:
+            self.schedule(leader, local)
+            return
+        if result == "local_failed":
+            self.schedule(leader, local=True)
+        # Transport 已經建立，其餘通道各自綁定本機端口即可
+        for tunnel in waiting:
+            threading.Thread(target=tunnel.start, daemon=True).start()
+
+
+reconnect_supervisor = ReconnectSupervisor()
+
+
+# 所有通道共用的 Transport 池
+transport_pool = TransportPool()
+
+class TokenBucket:
+    """
+    每秒補充 rate 位元組的權杖桶。consume() 一律先扣除，不足的部分記為欠款，
+    回傳要等多久才還清；呼叫端在這段時間內暫停讀取，讓來源端因背壓而放慢。
+    """
+    clock = staticmethod(time.monotonic)  # 補充權杖所依據的時鐘
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(self.rate * SHAPING_BURST_SECONDS, SHAPING_MIN_CHUNK)
+        self.tokens = self.burst
+        self.updated = self.clock()
+        self.lock = threading.Lock()
+
+    def _take(self, n):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= n
+        return max(0.0, -self.tokens / self.rate)
+
+    def set_rate(self, rate, burst=None):
+        """改變速率與容量；到目前為止的補充仍以舊速率計算，累積的權杖不超過新容量"""
+        with self.lock:
+            self._take(0)
+            self.rate = float(rate)
+            self.burst = burst or max(self.rate * SHAPING_BURST_SECONDS, SHAPING_MIN_CHUNK)
+            self.tokens = min(self.tokens, self.burst)
+
+    def consume(self, n, flow=None):
+        with self.lock:
+            return self._take(n)
+
+
+class FairShaper(TokenBucket):
+    """
+    多條連線共用的權杖桶（整條通道或整條 SSH 連線），加上簡單的公平排程：
+    近期速率低於平均分配（rate ÷ 活動中連線數）一定比例的連線視為互動流量，用量照扣但不必等待，
+    欠款只由大量傳輸的連線償還，因此互動流量的延遲不受同一通道上的大量下載影響。
+    免等待的用量另外記在 exempt（以 FAIR_SHARE_INTERACTIVE × rate 補充、容量一個 burst）：
+    新連線的速率從 0 算起，大量短連線全都算互動流量，額度用完後它們一樣要等待，總速率不會超過上限。
+    """
+
+    def __init__(self, rate, burst=None):
+        super().__init__(rate, burst)
+        self.flows = 0
+        self.exempt = TokenBucket(self.rate * FAIR_SHARE_INTERACTIVE, self.burst)
+
+    def attach(self):
+        with self.lock:
+            self.flows += 1
+
+    def detach(self):
+        with self.lock:
+            self.flows -= 1
+
+    def set_rate(self, rate, burst=None):
+        super().set_rate(rate, burst)
+        self.exempt.set_rate(self.rate * FAIR_SHARE_INTERACTIVE, self.burst)
+
+    def consume(self, n, flow=None):
+        with self.lock:
+            wait = self._take(n)
+            if wait and flow is not None and flow.rate() < FAIR_SHARE_INTERACTIVE * self.rate / max(1, self.flows):
+                if not self.exempt._take(n):
+                    return 0.0
+            return wait
+
+
+_transport_shapers = weakref.WeakKeyDictionary()
+_transport_state_lock = threading.Lock()  # 保護以下各個以 Transport 為 key 的表
+
+
+class _Inbound:
+    """一條 Transport 最後一次從 channel 讀到資料的時間（monotonic），由 Flow 更新、探測監看讀取"""
+    __slots__ = ("last",)
+
+    def __init__(self):
+        self.last = 0.0
+
+
+_transport_inbound = weakref.WeakKeyDictionary()
+
+
+def transport_inbound(transport):
+    """transport 的 _Inbound；每條連線開通時取一次，之後更新時不必再查表"""
+    with _transport_state_lock:
+        inbound = _transport_inbound.get(transport)
+        if inbound is None:
+            inbound = _transport_inbound[transport] = _Inbound()
+        return inbound
+
+
+class _ChannelSet:
+    """
+    一條 Transport 上由 open_direct_channel 開啟、尚未經 close_channel 關閉的 channel，加上開通中的數量。
+    只記 channel id，不持有 channel 本身，Transport 結束後整張表隨之釋放。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opening = 0
+        self.ids = set()
+
+    def __len__(self):
+        return self.opening + len(self.ids)
+
+
+_transport_channels = weakref.WeakKeyDictionary()
+
+
+def transport_channels(transport):
+    """transport 的 _ChannelSet"""
+    with _transport_state_lock:
+        channels = _transport_channels.get(transport)
+        if channels is None:
+            channels = _transport_channels[transport] = _ChannelSet()
+        return channels
+
+
+def close_channel(channel):
+    """關閉 channel 並把它從所在 Transport 的 channel 計數移除；重複呼叫無妨"""
+    channels = _transport_channels.get(channel.get_transport())
+    if channels is not None:
+        with channels.lock:
+            channels.ids.discard(channel.get_id())
+    channel.close()
+
+
+def transport_shaper(transport, rate):
+    """
+    同一條 SSH 連線上所有通道共用的 FairShaper。rate 與現有的不同時（例如重新載入設定後的新連線）
+    就地更新速率，已在轉發中的連線也立即改用新值。
+    """
+    with _transport_state_lock:
+        shaper = _transport_shapers.get(transport)
+        if shaper is None:
+            shaper = _transport_shapers[transport] = FairShaper(rate)
+        elif shaper.rate != rate:
+            shaper.set_rate(rate)
+        return shaper
+
+
+class ConnectionTrace:
+    """
+    一條被取樣連線各階段的時間點（相對 accept 的毫秒數）：
+    accept、admitted（取得名額與 fd 預算，排隊時間在此之前）、open_request / open_reply（預開則為 warm_channel）、
+    first_byte_out / first_byte_in（兩個方向第一次讀到資料）、close（被回收為 reaped）；
+    被拒絕或開通失敗時以 rejected / open_failed 結束。完成後交給 stats.trace_finished()。
+    """
+
+    def __init__(self, client, stats=None):
+        self.client = client
+        self.target = ""
+        self.stats = stats
+        self.started = time.time()
+        self.phases = [("accept", 0.0)]
+        self.finished = False
+        self._origin = time.perf_counter()
+
+    def mark(self, phase):
+        self.phases.append((phase, (time.perf_counter() - self._origin) * 1000))
+
+    def finish(self, phase="close"):
+        if self.finished:
+            return
+        self.finished = True
+        self.mark(phase)
+        if self.stats is not None:
+            self.stats.trace_finished(self.to_dict())
+
+    def to_dict(self):
+        return {
+            "client": self.client,
+            "target": self.target,
+            "started": self.started,
+            "phases": [[phase, round(ms, 3)] for phase, ms in self.phases],
+        }
+
+
+def chrome_trace(traces):
+    """
+    把 TunnelEngine.traces() 轉成 Chrome trace event 格式（chrome://tracing、Perfetto 可開啟）：
+    每條通道一個 process、每條連線一列，整段連線與相鄰階段之間各是一個區間。
+    """
+    events = []
+    pids = {}
+    for tid, trace in enumerate(traces, 1):
+        tunnel = str(trace.get("tunnel", ""))
+        if tunnel not in pids:
+            pids[tunnel] = len(pids) + 1
+            events.append({"ph": "M", "name": "process_name", "pid": pids[tunnel], "args": {"name": tunnel}})
+        pid = pids[tunnel]
+        base = trace["started"] * 1e6
+        phases = trace["phases"]
+        events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid,
+                       "args": {"name": f"{trace['client']} -> {trace['target']}"}})
+        events.append({"ph": "X", "name": "connection", "pid": pid, "tid": tid, "ts": base,
+                       "dur": phases[-1][1] * 1000, "args": {"client": trace["client"], "target": trace["target"]}})
+        for (previous, start), (phase, end) in zip(phases, phases[1:]):
+            events.append({"ph": "X", "name": f"{previous} -> {phase}", "pid": pid, "tid": tid,
+                           "ts": base + start * 1000, "dur": (end - start) * 1000})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class Flow:
+    """
+    一條轉發中的連線：依序套用連線、通道、SSH 連線三層限速，並記錄自己的流量與最後活動時間。
+    速率以時間常數 FLOW_RATE_WINDOW 的指數衰減估計，可由 TunnelStats.snapshot() 的 flows 查看。
+    設定 idle_timeout / max_lifetime 時登記到 connection_reaper，逾時由它呼叫 abort() 關閉連線。
+    """
+
+    def __init__(self, client, stats=None, bucket=None, shapers=(), target="", idle_timeout=0, max_lifetime=0,
+                 trace=None, inbound=None):
+        self.client = client
+        self.inbound = inbound  # 這條連線所在 Transport 的 _Inbound，收到資料即證明連線存活
+        self.target = target
+        self.trace = trace
+        self.stats = stats
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.closer = None     # 轉發端設定：從其他執行緒中斷這條連線
+        self.aborted = None    # 被回收時的原因
+        self.closed = False
+        self.bucket = bucket
+        self.shapers = [shaper for shaper in shapers if shaper is not None]
+        rates = [b.rate for b in [bucket] + self.shapers if b is not None]
+        # 有限速時縮小每次讀取量，讓等待時間分散成小段
+        self.chunk = int(max(SHAPING_MIN_CHUNK, min(rates) * SHAPING_BURST_SECONDS)) if rates else None
+        self.started = time.monotonic()
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.throttled_seconds = 0.0
+        self.last_active = self.started
+        self._rate = 0.0
+        self._updated = self.started
+        for shaper in self.shapers:
+            shaper.attach()
+        if stats is not None:
+            stats.flow_started(self)
+        if idle_timeout or max_lifetime:
+            connection_reaper.register(self)
+
+    def rate(self):
+        """近期速率（位元組/秒）"""
+        return self._rate * math.exp(-(time.monotonic() - self._updated) / FLOW_RATE_WINDOW)
+
+    def consume(self, sent=0, received=0):
+        """記錄讀到的位元組，回傳為了限速需要暫停讀取的秒數"""
+        n = sent + received
+        if self.trace is not None:
+            if sent and not self.bytes_out:
+                self.trace.mark("first_byte_out")
+            if received and not self.bytes_in:
+                self.trace.mark("first_byte_in")
+        self.bytes_out += sent
+        self.bytes_in += received
+        now = time.monotonic()
+        self._rate = self._rate * math.exp(-(now - self._updated) / FLOW_RATE_WINDOW) + n / FLOW_RATE_WINDOW
+        self._updated = now
+        self.last_active = now
+        if received and self.inbound is not None:
+            self.inbound.last = now
+        wait = self.bucket.consume(n) if self.bucket is not None else 0.0
+        for shaper in self.shapers:
+            wait = max(wait, shaper.consume(n, self))
+        if wait:
+            self.throttled_seconds += wait
+            if self.stats is not None:
+                self.stats.throttled(wait)
+        return wait
+
+    def expired(self, now):
+        """回傳應該回收的原因，不需回收時回傳 None"""
+        if self.max_lifetime and now - self.started > self.max_lifetime:
+            return f"超過存活時間 {self.max_lifetime:g} 秒"
+        if self.idle_timeout and now - self.last_active > self.idle_timeout:
+            return f"閒置超過 {self.idle_timeout:g} 秒"
+        return None
+
+    def abort(self, reason):
+        """由其他執行緒中斷轉發；轉發端結束時照常呼叫 close()"""
+        if self.closed or self.aborted:
+            return
+        self.aborted = reason
+        _log(self.stats).info("⏱️ 回收連線 %s -> %s：%s", self.client, self.target, reason)
+        if self.stats is not None:
+            self.stats.connection_reaped()
+        if self.closer is not None:
+            self.closer()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.trace is not None:
+            self.trace.finish("reaped" if self.aborted else "close")
+        for shaper in self.shapers:
+            shaper.detach()
+        self.shapers = []
+        if self.stats is not None:
+            self.stats.flow_finished(self)
+        connection_reaper.unregister(self)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "client": self.client,
+            "target": self.target,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "mb_per_s": round(self.rate() / MB, 3),
+            "seconds": round(now - self.started, 1),
+            "idle_seconds": round(now - self.last_active, 1),
+            "throttled_seconds": round(self.throttled_seconds, 3),
+        }
+
+
+class ConnectionReaper:
+    """
+    背景執行緒每 REAPER_INTERVAL 秒檢查有設定 idle_timeout / max_lifetime 的連線，
+    關閉閒置太久或存活太久的連線，避免半死的用戶端長期佔住執行緒、fd 與 channel。
+    """
+
+    def __init__(self, interval=REAPER_INTERVAL):
+        self.interval = interval
+        self._flows = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, flow):
+        with self._lock:
+            self._flows.add(flow)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="connection_reaper", daemon=True)
+                self._thread.start()
+
+    def unregister(self, flow):
+        with self._lock:
+            self._flows.discard(flow)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                if not self._flows:
+                    self._thread = None
+                    return
+                flows = list(self._flows)
+            for flow in flows:
+                reason = flow.expired(now)
+                if reason:
+                    self.unregister(flow)
+                    flow.abort(reason)
+
+
+connection_reaper = ConnectionReaper()
+
+
+class ResourceBudget:
+    """程序內所有轉發連線共用的 fd 預算；limit 為 0 代表不限制"""
+
+    def __init__(self):
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, cost, limit):
+        with self._lock:
+            if limit and self.in_use + cost > limit:
+                return False
+            self.in_use += cost
+            return True
+
+    def release(self, cost):
+        with self._lock:
+            self.in_use -= cost
+
+
+fd_budget = ResourceBudget()
+
+
+def default_fd_budget():
+    """依 RLIMIT_NOFILE 推算可分給轉發連線的 fd 數；無法取得（例如 Windows）時回傳 0（不限制）"""
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return 0
+    if soft == resource.RLIM_INFINITY:
+        return 0
+    return max(FDS_PER_CONNECTION, soft - FD_RESERVE)
+
+
+def channel_count(transport):
+    """Transport（TransportGroup 則為其中最空的一條）目前開著的 channel 數"""
+    if isinstance(transport, TransportGroup):
+        transport = transport.pick()
+    return len(transport_channels(transport))
+
+
+class TunnelLimits:
+    """
+    單一通道的連線准入設定與計數。
+    opening 限制同時進行中的 open_channel 數量；connections 限制同時轉發的連線數，
+    滿了以後依 overflow 排隊（最多 queue_timeout 秒）或立即拒絕。thread 模式以 admit() 在連線自己的執行緒中排隊，
+    asyncio 模式以 admit_async() 在事件迴圈上排隊，空出的名額由 release() 直接交給排在最前面的連線。
+    transports 為這條通道使用的 Transport 數；window_size / max_packet_size 傳給 open_channel，None 為 paramiko 預設。
+    rate / conn_rate / transport_rate 為整條通道、單一連線、整條 SSH 連線的限速（位元組/秒，None 不限速）。
+    idle_timeout / max_lifetime 交給 connection_reaper 回收連線；max_fds 為整個程序的 fd 預算（None 依 RLIMIT_NOFILE 推算），
+    max_channels 為每條 SSH 連線的 channel 上限（0 不限）。trace_rate 為追蹤連線各階段時間的取樣比例（0 到 1）。
+    probe_timeout 為 SSH 連線探測逾時（秒），None 依量測到的 RTT 自動決定。
+    """
+
+    def __init__(self, backlog=LISTEN_BACKLOG, max_opening=MAX_OPENING, max_connections=MAX_CONNECTIONS,
+                 overflow=OVERFLOW_POLICY, open_timeout=OPEN_TIMEOUT, queue_timeout=QUEUE_TIMEOUT,
+                 warm=0, warm_idle=WARM_IDLE_TIMEOUT, transports=TRANSPORTS_PER_TUNNEL,
+                 window_size=None, max_packet_size=None, rate=None, conn_rate=None, transport_rate=None,
+                 idle_timeout=0, max_lifetime=0, max_fds=None, max_channels=0, trace_rate=0, probe_timeout=None):
+        self.backlog = max(1, backlog)
+        self.max_opening = max(1, max_opening)
+        self.max_connections = max(0, max_connections)
+        self.overflow = overflow
+        self.open_timeout = open_timeout
+        self.queue_timeout = queue_timeout
+        self.warm = max(0, warm)
+        # 0 或負值沒有意義（會讓補充執行緒不停空轉），改用預設值；過小的值提高到 WARM_MIN_IDLE
+        self.warm_idle = max(WARM_MIN_IDLE, warm_idle) if warm_idle > 0 else WARM_IDLE_TIMEOUT
+        self.transports = min(max(1, transports), MAX_TRANSPORTS_PER_TUNNEL)
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.conn_rate = conn_rate
+        self.transport_rate = transport_rate
+        self.shaper = FairShaper(rate) if rate else None
+        self.idle_timeout = max(0, idle_timeout)
+        self.max_lifetime = max(0, max_lifetime)
+        self.max_fds = default_fd_budget() if max_fds is None else max(0, max_fds)
+        self.max_channels = max(0, max_channels)
+        self.trace_rate = min(1.0, max(0.0, trace_rate))
+        self.probe_timeout = probe_timeout if probe_timeout and probe_timeout > 0 else None
+        self.opening = threading.BoundedSemaphore(self.max_opening)
+        self._slots = threading.BoundedSemaphore(self.max_connections) if self.max_connections else None
+        self._queue_lock = threading.Lock()
+        self._waiters = collections.deque()  # admit_async() 排隊中的連線（asyncio Future）
+
+    @classmethod
+    def from_options(cls, options):
+        """由選項欄位建立；無法解析的值沿用預設"""
+        def number(key, default, kind=int):
+            try:
+                return kind(options[key])
+            except (KeyError, ValueError):
+                return default
+
+        def size(key):
+            # 位元組數，可加 K / M 單位，例如 window=8M
+            value = options.get(key, "").strip().upper()
+            unit = {"K": 1024, "M": MB}.get(value[-1:], 1)
+            try:
+                return int(float(value.rstrip("KM")) * unit) or None
+            except ValueError:
+                return None
+        overflow = options.get("overflow", OVERFLOW_POLICY)
+        return cls(
+            backlog=number("backlog", LISTEN_BACKLOG),
+            max_opening=number("max_opening", MAX_OPENING),
+            max_connections=number("max_conns", MAX_CONNECTIONS),
+            overflow=overflow if overflow in ("queue", "reject") else OVERFLOW_POLICY,
+            open_timeout=number("open_timeout", OPEN_TIMEOUT, float),
+            queue_timeout=number("queue_timeout", QUEUE_TIMEOUT, float),
+            warm=number("warm", 0),
+            warm_idle=number("warm_idle", WARM_IDLE_TIMEOUT, float),
+            transports=number("transports", TRANSPORTS_PER_TUNNEL),
+            window_size=size("window"),
+            max_packet_size=size("max_packet"),
+            rate=size("rate"),
+            conn_rate=size("conn_rate"),
+            transport_rate=size("transport_rate"),
+            idle_timeout=number("idle_timeout", 0, float),
+            max_lifetime=number("max_lifetime", 0, float),
+            max_fds=number("max_fds", None),
+            max_channels=number("max_channels", 0),
+            trace_rate=number("trace", 0, float),
+            probe_timeout=number("probe_timeout", None, float),
+        )
+
+    def admit(self):
+        """取得一個連線名額與它的 fd 預算；成功回傳 None，應拒絕時回傳原因"""
+        if self._slots is not None:
+            if self.overflow == "reject":
+                acquired = self._slots.acquire(blocking=False)
+            else:
+                acquired = self._slots.acquire(timeout=self.queue_timeout)
+            if not acquired:
+                return f"連線數已達上限 {self.max_connections}"
+        return self._admit_fds()
+
+    async def admit_async(self, loop):
+        """
+        asyncio 模式的 admit()，在事件迴圈中呼叫：名額已滿且 overflow=queue 時以 Future 排隊，
+        等待期間不佔用開通 channel 的執行緒；已有連線在排隊時新連線排在後面。
+        """
+        if self._slots is not None:
+            waiter = None
+            with self._queue_lock:
+                acquired = not self._waiters and self._slots.acquire(blocking=False)
+                if not acquired and self.overflow == "queue":
+                    waiter = loop.create_future()
+                    self._waiters.append(waiter)
+            if waiter is not None:
+                try:
+                    await asyncio.wait_for(waiter, self.queue_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                with self._queue_lock:
+                    # 逾時與交付名額同時發生時，以 waiter 是否已有結果為準
+                    acquired = waiter.done() and not waiter.cancelled()
+                    if not acquired and waiter in self._waiters:
+                        self._waiters.remove(waiter)
+            if not acquired:
+                return f"連線數已達上限 {self.max_connections}"
+        return self._admit_fds()
+
+    def _admit_fds(self):
+        if not fd_budget.acquire(FDS_PER_CONNECTION, self.max_fds):
+            self._release_slot()
+            return f"檔案描述元預算 {self.max_fds} 已用完"
+        return None
+
+    def release(self):
+        fd_budget.release(FDS_PER_CONNECTION)
+        self._release_slot()
+
+    def _release_slot(self):
+        if self._slots is None:
+            return
+        with self._queue_lock:
+            if not self._waiters:
+                self._slots.release()
+                return
+            loop = self._waiters[0].get_loop()
+        # 有連線在事件迴圈上排隊：名額不歸還，直接交給排在最前面的連線
+        loop.call_soon_threadsafe(self._hand_off)
+
+    def _hand_off(self):
+        with self._queue_lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+            self._slots.release()
+
+    def trace(self, addr, stats=None):
+        """依 trace_rate 取樣，決定是否追蹤這條剛 accept 的連線；回傳 ConnectionTrace 或 None"""
+        if self.trace_rate and random.random() < self.trace_rate:
+            return ConnectionTrace(f"{addr[0]}:{addr[1]}", stats)
+        return None
+
+    def flow(self, channel, addr, stats=None, trace=None):
+        """為一條剛開通的連線建立 Flow，套用這條通道的各層限速"""
+        transport = channel.get_transport()
+        return Flow(
+            f"{addr[0]}:{addr[1]}", stats,
+            TokenBucket(self.conn_rate) if self.conn_rate else None,
+            (self.shaper, transport_shaper(transport, self.transport_rate) if self.transport_rate else None),
+            channel.get_name(), self.idle_timeout, self.max_lifetime, trace, transport_inbound(transport),
+        )
+
+
+def _reject(client_socket, addr, reason, stats=None, trace=None, on_fail=None):
+    """拒絕一條連線：記錄原因、呼叫 on_fail(client_socket)（例如回覆 SOCKS 錯誤碼）後關閉"""
+    if trace is not None:
+        trace.finish("rejected")
+    if stats is not None:
+        stats.connection_rejected()
+    _log(stats).warning("⛔ %s，拒絕 %s:%s", reason, addr[0], addr[1])
+    if on_fail:
+        on_fail(client_socket)
+    client_socket.close()
+
+
+def admit_and_open(client_socket, addr, transport, remote_host, remote_port, stats=None, limits=None, warm=None,
+                   on_fail=None, trace=None, admitted=False):
+    """
+    依 limits 取得連線名額與 fd 預算並開啟 channel（SSH 連線的 channel 數已達 max_channels 時拒絕），成功時回傳 channel。
+    warm 為 WarmChannelPool 時優先取用預先開好的 channel，沒有才當場開啟。
+    失敗或被拒絕時會先呼叫 on_fail(client_socket)（例如回覆 SOCKS 錯誤碼），再關閉 client_socket、歸還名額並回傳 None；
+    成功時由呼叫端在轉發結束後呼叫 limits.release()。trace 為 ConnectionTrace 時記下排隊、開通各階段的時間。
+    admitted 為 True 代表呼叫端已取得名額（asyncio 模式在事件迴圈中以 admit_async() 排隊）。
+    """
+    if trace is not None:
+        trace.target = f"{remote_host}:{remote_port}"
+    if not admitted:
+        reason = limits.admit()
+        if reason:
+            _reject(client_socket, addr, reason, stats, trace, on_fail)
+            return None
+        if trace is not None:
+            trace.mark("admitted")
+    channel = warm.get() if warm is not None else None
+    if channel is not None:
+        if trace is not None:
+            trace.mark("warm_channel")
+        return channel
+    if limits.max_channels and channel_count(transport) >= limits.max_channels:
+        _reject(client_socket, addr, f"SSH 連線的 channel 數已達上限 {limits.max_channels}", stats, trace, on_fail)
+        limits.release()
+        return None
+    try:
+        with limits.opening:
+            if trace is not None:
+                trace.mark("open_request")
+            channel = open_direct_channel(transport, remote_host, remote_port, addr, stats, limits.open_timeout,
+                                          limits.window_size, limits.max_packet_size)
+    except Exception as e:
+        _log(stats).warning("⚠️ 轉發失敗: %s", e)
+        channel = None
+    if trace is not None:
+        trace.mark("open_reply")
+    if channel is None:
+        if trace is not None:
+            trace.finish("open_failed")
+        _log(stats).error("❌ 無法開啟通道 %s:%s，請確認 SSH 設定是否允許轉發", remote_host, remote_port)
+        if on_fail:
+            on_fail(client_socket)
+        client_socket.close()
+        limits.release()
+    return channel
+
+
+def _serve_client(client_socket, addr, opener, stats, limits, trace=None):
+    """thread 模式下每個連線的執行緒：opener 開通 channel 後直接在同一條執行緒轉發"""
+    channel = opener(client_socket, addr, trace)
+    if channel is None:
+        if trace is not None:
+            trace.finish()
+        return
+    try:
+        transfer(client_socket, channel, stats=stats, flow=limits.flow(channel, addr, stats, trace))
+    finally:
+        limits.release()
+
+
+def _listen_local(local_port, backlog):
+    """在 127.0.0.1 綁定並開始監聽，失敗時回傳 None"""
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", local_port))
+    except Exception as e:
+        log.error("❌ 無法綁定本機端口 %s: %s", local_port, e)
+        return None
+    sock.listen(backlog)
+    return sock
+
+
+def _serve_listener(sock, opener, stats, limits, mode, on_close=None, handshake=None, on_reject=None):
+    """
+    依 mode 啟動 accept 迴圈，回傳 (監聽物件, 執行緒)。
+    opener(client_socket, addr, trace) 負責開通 channel，回傳 None 代表已自行關閉 client_socket；
+    on_close 在監聽結束時呼叫。handshake、on_reject 見 AsyncForwardEngine.add_listener，thread 模式不使用。
+    """
+    if (mode or FORWARD_MODE) == "asyncio":
+        # 由共用事件迴圈負責 accept 與轉發，回傳的監聽物件同樣可用 close() 停止
+        listener = async_engine.add_listener(sock, opener, stats, limits, on_close, handshake, on_reject)
+        return listener, async_engine._thread
+
+    def handler():
+        while True:
+            try:
+                client_socket, addr = sock.accept()
+                # 開通與轉發交給連線自己的執行緒，慢的 open_channel 不會擋住後面的 accept
+                threading.Thread(
+                    target=_serve_client, args=(client_socket, addr, opener, stats, limits, limits.trace(addr, stats)),
+                    daemon=True
+                ).start()
+            except OSError as e:
+                # 監聽 socket 被 stop 關閉後 accept 會失敗（Windows 為 10038 WSAENOTSOCK），結束迴圈
+                if sock.fileno() == -1 or e.errno in (errno.EBADF, errno.EINVAL, getattr(errno, "WSAENOTSOCK", None)):
+                    break
+                _log(stats).warning("⚠️ 其他 socket 錯誤: %s", e)
+        sock.close()
+        if on_close:
+            on_close()
+
+    t = threading.Thread(target=handler, daemon=True)
+    t.start()
+    return sock, t
+
+
+def forward_tunnel(local_port, remote_host, remote_port, transport, stats=None, mode=None, limits=None):
+    """
+    建立本地端口轉發，並回傳監聽 socket 以及 handler 線程。
+    mode（預設 FORWARD_MODE）為 "asyncio" 時改由 async_engine 處理，回傳監聽物件與事件迴圈執行緒。
+    stats 為 TunnelStats 時，兩種模式都會把轉發位元組累加進去。
+    limits 為 TunnelLimits，決定 backlog、開通並行數與連線上限；accept 迴圈本身不會等待 open_channel。
+    limits.warm 大於 0 時會建立 WarmChannelPool，隨監聽一起關閉。
+    """
+    limits = limits or TunnelLimits()
+    sock = _listen_local(local_port, limits.backlog)
+    if sock is None:
+        return None, None
+    _log(stats).info("🚀 本機端口 %s 開始監聽，轉發到 %s:%s", local_port, remote_host, remote_port)
+    warm = None
+    if limits.warm:
+        warm = WarmChannelPool(transport, remote_host, remote_port, limits.warm, limits.warm_idle,
+                               stats, limits.open_timeout, limits.window_size, limits.max_packet_size)
+
+    def opener(client_socket, addr, trace=None, admitted=False):
+        return admit_and_open(client_socket, addr, transport, remote_host, remote_port, stats, limits, warm,
+                              trace=trace, admitted=admitted)
+
+    return _serve_listener(sock, opener, stats, limits, mode, warm.close if warm else None)
+
+
+def socks_tunnel(local_port, transport, stats=None, mode=None, limits=None, resolver=None):
+    """
+    ssh -D 式的動態轉發：本機端口是 SOCKS5 代理，依每個連線要求的目的地開啟 direct-tcpip channel。
+    主機名稱預設原樣交給伺服器解析（遠端 DNS）；resolver 為 DnsCache 時改在本機解析並快取。
+    回傳值與 forward_tunnel 相同，轉發、准入與統計也共用同一套機制。
+    """
+    limits = limits or TunnelLimits()
+    sock = _listen_local(local_port, limits.backlog)
+    if sock is None:
+        return None, None
+    _log(stats).info("🚀 本機端口 %s 開始監聽 SOCKS5（%s DNS）", local_port, "本機" if resolver else "遠端")
+
+    def opener(client_socket, addr, trace=None, request=None, admitted=False):
+        return socks_admit_and_open(client_socket, addr, transport, stats, limits, resolver, trace, request, admitted)
+
+    async def handshake(loop, client_socket, addr):
+        # asyncio 模式在事件迴圈中交握，執行緒池只負責開通 channel，慢的用戶端不會佔住開通名額
+        try:
+            return await asyncio.wait_for(socks5_handshake_async(loop, client_socket), SOCKS_HANDSHAKE_TIMEOUT)
+        except (OSError, SocksError, asyncio.TimeoutError) as e:
+            _socks_handshake_failed(client_socket, addr, stats, e)
+            return None
+
+    return _serve_listener(sock, opener, stats, limits, mode, handshake=handshake, on_reject=socks5_fail)
+
+
+class SocksError(Exception):
+    """SOCKS5 交握失敗；code 為要回覆給用戶端的錯誤碼，None 代表直接關閉連線"""
+
+    def __init__(self, message, code=SOCKS_GENERAL_FAILURE):
+        super().__init__(message)
+        self.code = code
+
+
+def _recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise SocksError("用戶端提前關閉連線", None)
+        data += chunk
+    return data
+
+
+async def _recv_exact_async(loop, sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = await loop.sock_recv(sock, size - len(data))
+        if not chunk:
+            raise SocksError("用戶端提前關閉連線", None)
+        data += chunk
+    return data
+
+
+def _socks5_steps():
+    """
+    SOCKS5 交握的步驟，與 I/O 無關：yield 整數代表要讀取的位元組數（以 send() 傳回讀到的資料），
+    yield bytes 代表要送出的回覆；結束時回傳 (host, port)。只支援免認證的 CONNECT。
+    """
+    version, method_count = yield 2
+    if version != 5:
+        raise SocksError(f"不支援的 SOCKS 版本 {version}", None)
+    if 0 not in (yield method_count):
+        yield b"\x05\xff"
+        raise SocksError("用戶端要求認證，目前只支援免認證", None)
+    yield b"\x05\x00"
+
+    _, command, _, address_type = yield 4
+    if command != 1:
+        raise SocksError(f"不支援的 SOCKS 指令 {command}", SOCKS_COMMAND_NOT_SUPPORTED)
+    if address_type == 1:
+        host = socket.inet_ntop(socket.AF_INET, (yield 4))
+    elif address_type == 3:
+        length = (yield 1)[0]
+        host = (yield length).decode("ascii", "replace")
+    elif address_type == 4:
+        host = socket.inet_ntop(socket.AF_INET6, (yield 16))
+    else:
+        raise SocksError(f"不支援的位址類型 {address_type}", SOCKS_ADDRESS_NOT_SUPPORTED)
+    port = int.from_bytes((yield 2), "big")
+    return host, port
+
+
+def socks5_handshake(sock):
+    """在阻塞的 socket 上完成 SOCKS5 交握，回傳 (host, port)"""
+    steps = _socks5_steps()
+    data = None
+    try:
+        while True:
+            step = steps.send(data)
+            if isinstance(step, int):
+                data = _recv_exact(sock, step)
+            else:
+                sock.sendall(step)
+                data = None
+    except StopIteration as done:
+        return done.value
+
+
+async def socks5_handshake_async(loop, sock):
+    """socks5_handshake 的事件迴圈版本，sock 須為非阻塞"""
+    steps = _socks5_steps()
+    data = None
+    try:
+        while True:
+            step = steps.send(data)
+            if isinstance(step, int):
+                data = await _recv_exact_async(loop, sock, step)
+            else:
+                await loop.sock_sendall(sock, step)
+                data = None
+    except StopIteration as done:
+        return done.value
+
+
+def socks5_reply(sock, code):
+    # 綁定位址對 CONNECT 沒有意義，一律回 0.0.0.0:0
+    sock.sendall(bytes((5, code, 0, 1, 0, 0, 0, 0, 0, 0)))
+
+
+def socks5_fail(sock):
+    """回覆一般錯誤；用戶端可能已經斷線"""
+    try:
+        socks5_reply(sock, SOCKS_GENERAL_FAILURE)
+    except OSError:
+        pass
+
+
+def _socks_handshake_failed(client_socket, addr, stats, error):
+    _log(stats).warning("⚠️ SOCKS 交握失敗 %s:%s: %s", addr[0], addr[1], str(error) or "逾時")
+    if isinstance(error, SocksError) and error.code is not None:
+        try:
+            socks5_reply(client_socket, error.code)
+        except OSError:
+            pass
+    client_socket.close()
+
+
+def socks_admit_and_open(client_socket, addr, transport, stats=None, limits=None, resolver=None, trace=None,
+                         request=None, admitted=False):
+    """
+    完成 SOCKS5 交握後開啟到請求目的地的 channel，並回覆用戶端結果；介面同 admit_and_open。
+    request 為已在別處交握取得的 (host, port)，此時只解析名稱與開通。
+    """
+    blocking = client_socket.getblocking()
+    client_socket.settimeout(SOCKS_HANDSHAKE_TIMEOUT)
+    try:
+        host, port = request or socks5_handshake(client_socket)
+        if resolver is not None:
+            host = resolver.resolve(host)
+    except (OSError, SocksError) as e:
+        _socks_handshake_failed(client_socket, addr, stats, e)
+        if admitted:
+            limits.release()
+        return None
+
+    channel = admit_and_open(client_socket, addr, transport, host, port, stats, limits, on_fail=socks5_fail,
+                             trace=trace, admitted=admitted)
+    if channel is None:
+        return None
+    try:
+        socks5_reply(client_socket, SOCKS_SUCCEEDED)
+    except OSError:
+        if trace is not None:
+            trace.finish("open_failed")
+        close_channel(channel)
+        client_socket.close()
+        limits.release()
+        return None
+    client_socket.setblocking(blocking)
+    return channel
+
+
+class DnsCache:
+    """
+    SOCKS 目的地的本機 DNS 快取（選項 dns=local）。
+    成功的結果保留 ttl 秒，失敗保留 negative_ttl 秒，避免同一個名稱反覆等待解析。
+    """
+
+    def __init__(self, ttl=SOCKS_DNS_TTL, negative_ttl=SOCKS_DNS_NEGATIVE_TTL, size=SOCKS_DNS_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # host -> (address 或 None, 到期時間)
+        self._lock = threading.Lock()
+
+    def resolve(self, host):
+        try:
+            ipaddress.ip_address(host)
+            return host  # 已經是 IP
+        except ValueError:
+            pass
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry and entry[1] > now:
+                self.hits += 1
+                address = entry[0]
+                if address is None:
+                    raise SocksError(f"無法解析 {host}", SOCKS_HOST_UNREACHABLE)
+                return address
+            self.misses += 1
+        try:
+            address = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)[0][4][0]
+            expires = now + self.ttl
+        except (socket.gaierror, UnicodeError):
+            address = None
+            expires = now + self.negative_ttl
+        with self._lock:
+            if len(self._entries) >= self.size:
+                # 先丟掉過期的，仍然太多就丟掉最早加入的
+                for key in [k for k, v in self._entries.items() if v[1] <= now]:
+                    del self._entries[key]
+                while len(self._entries) >= self.size:
+                    del self._entries[next(iter(self._entries))]
+            self._entries[host] = (address, expires)
+        if address is None:
+            raise SocksError(f"無法解析 {host}", SOCKS_HOST_UNREACHABLE)
+        return address
+
+
+class TunnelStats:
+    """
+    單一通道的統計：轉發位元組、連線數、被拒絕的連線數、open_channel 失敗次數、開通延遲分佈，
+    以及轉發中每條連線（Flow）的流量與因限速而暫停的時間。
+    轉發迴圈每讀一個緩衝區（最多 RELAY_BUFFER_SIZE）才累加一次，鎖的成本可忽略。
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.labels = {}  # 匯出 metrics 時附加的標籤，例如 local_port、target
+        self.lock = threading.Lock()
+        self.bytes_out = 0  # 本機 -> 遠端
+        self.bytes_in = 0   # 遠端 -> 本機
+        self.active_connections = 0
+        self.total_connections = 0
+        self.open_failures = 0
+        self.rejected_connections = 0
+        self.warm_hits = 0          # 直接取用預開 channel 的連線數
+        self.warm_misses = 0        # 啟用預開但沒有可用 channel、只能當場開啟的連線數
+        self.warm_saved_seconds = 0.0  # 因為取用預開 channel 而省下的開通時間（以預開時量到的平均延遲估算）
+        self.throttled_seconds = 0.0   # 所有連線因限速而暫停讀取的時間合計
+        self.reaped_connections = 0    # 因閒置或超過存活時間而被關閉的連線數
+        self.reconnect_attempts = 0    # 排入重新連線的次數（同組一起重試時每條通道各算一次）
+        self.next_retry = 0.0          # 下一次重試的時間（time.time()），只在 reconnecting 狀態下有意義
+        self.flows = set()
+        self.traces = collections.deque(maxlen=TRACE_BUFFER_SIZE)  # 最近完成的連線追蹤（ConnectionTrace.to_dict()）
+        # 開通延遲直方圖，最後一格為 +Inf
+        self.open_latency_buckets = [0] * (len(OPEN_LATENCY_BUCKETS) + 1)
+        self.open_latency_sum = 0.0
+        self.open_latency_count = 0
+
+    @property
+    def log(self):
+        """附帶這條通道名稱的記錄器（名稱可能因改備註而變動，每次重新取得）"""
+        return tunnel_log(self.name)
+
+    def add(self, sent=0, received=0):
+        with self.lock:
+            self.bytes_out += sent
+            self.bytes_in += received
+
+    def connection_opened(self):
+        with self.lock:
+            self.active_connections += 1
+            self.total_connections += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    def connection_rejected(self):
+        with self.lock:
+            self.rejected_connections += 1
+
+    def warm_hit(self, saved_seconds):
+        with self.lock:
+            self.warm_hits += 1
+            self.warm_saved_seconds += saved_seconds
+
+    def warm_miss(self):
+        with self.lock:
+            self.warm_misses += 1
+
+    def open_failed(self):
+        with self.lock:
+            self.open_failures += 1
+
+    def flow_started(self, flow):
+        with self.lock:
+            self.flows.add(flow)
+
+    def flow_finished(self, flow):
+        with self.lock:
+            self.flows.discard(flow)
+
+    def reconnect_scheduled(self, at):
+        with self.lock:
+            self.reconnect_attempts += 1
+            self.next_retry = at
+
+    def counters(self):
+        """STATUS_COUNTERS 的目前值：不取鎖、不複製 flows，GUI 每次定時更新只讀這些"""
+        return {key: getattr(self, key) for key in STATUS_COUNTERS}
+
+    def trace_finished(self, trace):
+        self.traces.append(trace)
+
+    def connection_reaped(self):
+        with self.lock:
+            self.reaped_connections += 1
+
+    def throttled(self, seconds):
+        with self.lock:
+            self.throttled_seconds += seconds
+
+    def observe_open(self, seconds):
+        index = bisect.bisect_left(OPEN_LATENCY_BUCKETS, seconds)
+        with self.lock:
+            self.open_latency_buckets[index] += 1
+            self.open_latency_sum += seconds
+            self.open_latency_count += 1
+
+    def snapshot(self):
+        """目前數值的複本（dict），供 metrics 端點輸出"""
+        with self.lock:
+            cumulative = []
+            total = 0
+            for bound, count in zip(OPEN_LATENCY_BUCKETS + (float("inf"),), self.open_latency_buckets):
+                total += count
+                cumulative.append(("+Inf" if bound == float("inf") else bound, total))
+            return {
+                "name": self.name,
+                "labels": dict(self.labels),
+                "bytes_out": self.bytes_out,
+                "bytes_in": self.bytes_in,
+                "active_connections": self.active_connections,
+                "total_connections": self.total_connections,
+                "open_failures": self.open_failures,
+                "rejected_connections": self.rejected_connections,
+                "warm_hits": self.warm_hits,
+                "warm_misses": self.warm_misses,
+                "warm_saved_seconds": self.warm_saved_seconds,
+                "throttled_seconds": self.throttled_seconds,
+                "reaped_connections": self.reaped_connections,
+                "reconnect_attempts": self.reconnect_attempts,
+                "next_retry": self.next_retry,
+                "flows": [flow.snapshot() for flow in self.flows],
+                "traces": list(self.traces),
+                "channel_open_seconds": {
+                    "buckets": cumulative,
+                    "sum": self.open_latency_sum,
+                    "count": self.open_latency_count,
+                },
+            }
+
+
+def open_direct_channel(transport, remote_host, remote_port, addr, stats=None, timeout=OPEN_TIMEOUT,
+                        window_size=None, max_packet_size=None):
+    """
+    開啟 direct-tcpip channel，並把開通延遲與失敗次數記到 stats；超過 timeout 秒未回覆視為失敗。
+    window_size 是伺服器在等我們確認前最多能送來的位元組數，高延遲線路上決定了下載速度的上限。
+    開啟的 channel 記在所在 Transport 的 transport_channels() 中，須以 close_channel() 關閉。
+    """
+    if isinstance(transport, TransportGroup):
+        transport = transport.pick()
+    channels = transport_channels(transport)
+    with channels.lock:
+        channels.opening += 1
+    started = time.perf_counter()
+    channel = None
+    try:
+        channel = transport.open_channel("direct-tcpip", (remote_host, remote_port), addr, timeout=timeout,
+                                         window_size=window_size, max_packet_size=max_packet_size)
+    except Exception:
+        if stats is not None:
+            stats.open_failed()
+        raise
+    finally:
+        with channels.lock:
+            channels.opening -= 1
+            if channel is not None:
+                channels.ids.add(channel.get_id())
+    if stats is not None:
+        if channel is None:
+            stats.open_failed()
+        else:
+            stats.observe_open(time.perf_counter() - started)
+    if channel is not None:
+        channel.set_name(f"{remote_host}:{remote_port}")  # 連線清單中顯示的目的地
+    return channel
+
+
+class WarmChannelPool:
+    """
+    為一個轉發目標預先開好 size 條 direct-tcpip channel，accept 時直接交出一條，
+    省下一次 open_channel 的來回。背景執行緒負責補滿，並關閉閒置超過 idle_timeout 的 channel
+    （對方服務可能已對這些閒置連線逾時）。
+    注意：預開時遠端就會連到目標服務，只適合連線本身沒有副作用的服務。
+    """
+
+    def __init__(self, transport, remote_host, remote_port, size, idle_timeout=WARM_IDLE_TIMEOUT,
+                 stats=None, open_timeout=OPEN_TIMEOUT, window_size=None, max_packet_size=None):
+        self.transport = transport
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.size = size
+        self.idle_timeout = max(WARM_MIN_IDLE, idle_timeout)
+        self.stats = stats
+        self.open_timeout = open_timeout
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.open_latency = 0.0  # 預開時量到的平均開通延遲（指數移動平均）
+        self._channels = collections.deque()  # (開啟時間, channel)
+        self._cond = threading.Condition()
+        self._closed = False
+        threading.Thread(target=self._refill_loop, name="warm_channels", daemon=True).start()
+
+    def get(self):
+        """取出一條仍可用的預開 channel，沒有時回傳 None"""
+        with self._cond:
+            channel = None
+            while self._channels:
+                _, candidate = self._channels.popleft()
+                if candidate.closed or candidate.eof_received:
+                    close_channel(candidate)
+                    continue
+                channel = candidate
+                break
+            self._cond.notify()
+        if self.stats is not None:
+            if channel is None:
+                self.stats.warm_miss()
+            else:
+                self.stats.warm_hit(self.open_latency)
+        return channel
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            channels, self._channels = self._channels, collections.deque()
+            self._cond.notify()
+        for _, channel in channels:
+            close_channel(channel)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        while self._channels and now - self._channels[0][0] > self.idle_timeout:
+            _, channel = self._channels.popleft()
+            close_channel(channel)
+
+    def _refill_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    self._evict_idle()
+                    if len(self._channels) < self.size and self.transport.is_active():
+                        break
+                    self._cond.wait(max(WARM_MIN_IDLE, self.idle_timeout) / 2)
+                if self._closed:
+                    return
+            started = time.perf_counter()
+            try:
+                # 此時還沒有真正的用戶端，來源位址只供伺服器記錄
+                channel = open_direct_channel(self.transport, self.remote_host, self.remote_port,
+                                              ("127.0.0.1", 0), self.stats, self.open_timeout,
+                                              self.window_size, self.max_packet_size)
+            except Exception as e:
+                channel = None
+                _log(self.stats).warning("⚠️ 預開通道失敗: %s", e)
+            if channel is None:
+                time.sleep(WARM_RETRY_DELAY)
+                continue
+            elapsed = time.perf_counter() - started
+            self.open_latency = elapsed if not self.open_latency else 0.8 * self.open_latency + 0.2 * elapsed
+            with self._cond:
+                if self._closed:
+                    close_channel(channel)
+                    return
+                self._channels.append((time.monotonic(), channel))
+
+
+class _RelayDirection:
+    """transfer() 的單一方向：src 讀出的資料寫入 dst，寫不完時保留在 pending 直到可寫"""
+
+    __slots__ = ("src", "dst", "buf", "view", "pending", "eof", "closed", "dst_is_channel", "count", "resume_at")
+
+    def __init__(self, src, dst, buffer_size):
+        self.src = src
+        self.dst = dst
+        # socket 支援 recv_into，重複使用同一塊緩衝區；channel 只能 recv
+        self.buf = bytearray(buffer_size) if hasattr(src, "recv_into") else None
+        self.view = memoryview(self.buf) if self.buf is not None else None
+        self.pending = None
+        self.eof = False
+        self.closed = False
+        self.dst_is_channel = isinstance(dst, paramiko.Channel)
+        self.count = 0
+        self.resume_at = 0.0  # 限速時在此時間之前不再讀取來源端
+
+    def read(self, buffer_size):
+        if self.buf is not None:
+            try:
+                n = self.src.recv_into(self.buf, buffer_size)
+            except (BlockingIOError, InterruptedError):
+                return
+            data = self.view[:n]
+        else:
+            try:
+                data = memoryview(self.src.recv(buffer_size))
+            except socket.timeout:
+                return
+            n = len(data)
+        if n == 0:
+            self.eof = True
+        else:
+            self.pending = data
+            self.count += n
+
+    def flush(self):
+        """盡量把 pending 寫出去；目的端暫時寫不下時保留剩餘資料（背壓）"""
+        while self.pending is not None:
+            if self.dst_is_channel and not self.dst.send_ready():
+                return
+            try:
+                n = self.dst.send(self.pending)
+            except (BlockingIOError, InterruptedError, socket.timeout):
+                return
+            self.pending = self.pending[n:] if n < len(self.pending) else None
+
+    def shutdown_write(self):
+        """來源端已 EOF 且資料都送出後，只關閉目的端的寫入方向（半關閉）"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.dst_is_channel:
+                self.dst.shutdown_write()
+            else:
+                self.dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    @property
+    def finished(self):
+        return self.eof and self.pending is None
+
+
+def _wait_io(rlist, wlist, timeout):
+    """
+    等待可讀/可寫，回傳 (可讀物件, 可寫物件)。
+    select() 無法處理超過 FD_SETSIZE（通常 1024）的 fd，連線數多時會失敗，
+    因此支援 poll() 的平台一律改用 poll()。
+    """
+    if not rlist and not wlist:
+        # 只剩限速中的方向（Windows 的 select 不接受全空的清單）
+        time.sleep(timeout)
+        return [], []
+    if not hasattr(select, "poll"):
+        r, w, x = select.select(rlist, wlist, [], timeout)
+        return r, w
+    poller = select.poll()
+    objects = {}
+    for obj in rlist:
+        fd = obj.fileno()
+        objects[fd] = obj
+        poller.register(fd, select.POLLIN)
+    for obj in wlist:
+        fd = obj.fileno()
+        objects[fd] = obj
+        poller.register(fd, select.POLLOUT | (select.POLLIN if obj in rlist else 0))
+    readable, writable = [], []
+    for fd, event in poller.poll(None if timeout is None else timeout * 1000):
+        obj = objects[fd]
+        if event & (select.POLLIN | select.POLLHUP | select.POLLERR) and obj in rlist:
+            readable.append(obj)
+        if event & (select.POLLOUT | select.POLLHUP | select.POLLERR) and obj in wlist:
+            writable.append(obj)
+    return readable, writable
+
+
+def _abort_transfer(source, destination):
+    """從回收執行緒中斷 transfer()：shutdown 會喚醒等待中的 poll，迴圈隨即結束"""
+    try:
+        source.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    close_channel(destination)
+
+
+def transfer(source, destination, buffer_size=RELAY_BUFFER_SIZE, stats=None, flow=None):
+    """
+    雙向轉發本機 socket (source) 與 SSH channel (destination)。
+    - 以 recv_into 重複使用固定大小的緩衝區，不會每個封包都配置記憶體
+    - 每個方向各自背壓：目的端寫不完前不會再讀取來源端
+    - 一端 EOF 時只半關閉另一端的寫入，等兩個方向都結束才關閉連線
+    - flow 為 Flow 時記錄這條連線的流量，並在超過限速時暫停讀取該方向；被回收（flow.abort）時立即結束
+    """
+    source.setblocking(False)
+    destination.setblocking(0)
+    if stats is not None:
+        stats.connection_opened()
+    upstream = _RelayDirection(source, destination, buffer_size)
+    downstream = _RelayDirection(destination, source, buffer_size)
+    directions = (upstream, downstream)
+    started = time.monotonic()
+    read_size = min(buffer_size, flow.chunk) if flow is not None and flow.chunk else buffer_size
+    if flow is not None:
+        flow.closer = lambda: _abort_transfer(source, destination)
+
+    while True:
+        if flow is not None and flow.aborted:
+            break
+        try:
+            rlist = []
+            wlist = []
+            poll = False
+            timeout = None
+            now = time.monotonic()
+            for d in directions:
+                if d.pending is None and not d.eof:
+                    if d.resume_at > now:
+                        timeout = d.resume_at - now if timeout is None else min(timeout, d.resume_at - now)
+                    else:
+                        rlist.append(d.src)
+                elif d.pending is not None:
+                    # channel 無法以 select 等待可寫，改為短間隔輪詢 SSH 視窗
+                    if d.dst_is_channel:
+                        poll = True
+                    else:
+                        wlist.append(d.dst)
+            if not rlist and not wlist and not poll and timeout is None:
+                break
+            if poll:
+                timeout = RELAY_POLL_INTERVAL if timeout is None else min(timeout, RELAY_POLL_INTERVAL)
+
+            r, w = _wait_io(rlist, wlist, timeout)
+            for d in directions:
+                if d.pending is None and d.src in r:
+                    before = d.count
+                    d.read(read_size)
+                    n = d.count - before
+                    if n and stats is not None:
+                        if d is upstream:
+                            stats.add(sent=n)
+                        else:
+                            stats.add(received=n)
+                    if n and flow is not None:
+                        wait = flow.consume(sent=n) if d is upstream else flow.consume(received=n)
+                        if wait:
+                            d.resume_at = time.monotonic() + wait
+                if d.pending is not None:
+                    d.flush()
+                if d.finished:
+                    d.shutdown_write()
+        except Exception as e:
+            _log(stats).warning("⚠️ 資料轉發錯誤: %s", e)
+            break
+    source.close()
+    close_channel(destination)
+    if flow is not None:
+        flow.close()
+    if stats is not None:
+        stats.connection_closed()
+
+    total = upstream.count + downstream.count
+    if total >= MB:
+        elapsed = max(time.monotonic() - started, 1e-6)
+        label = f"{stats.name} " if stats is not None and stats.name else ""
+        _log(stats).info("📈 %s連線結束：上傳 %.1f MB、下載 %.1f MB，平均 %.1f MB/s",
+                         label, upstream.count / MB, downstream.count / MB, total / elapsed / MB)
+
+
+class AsyncForwardEngine:
+    """
+    以單一 asyncio 事件迴圈驅動所有通道的 accept 與雙向轉發，
+    取代每個連線一條 transfer() 執行緒的作法。
+    open_channel 會等待伺服器回覆，因此交給每個監聽端口各自的小型執行緒池處理，
+    避免卡住事件迴圈，也不會讓某條通道的慢速開通拖累其他通道。
+    """
+
+    def __init__(self, buffer_size=ASYNC_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._accept_times = collections.deque()
+        self.total_connections = 0
+        self.active_connections = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def ensure_started(self):
+        """第一次使用時才建立事件迴圈執行緒"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            # Windows 的 Proactor 迴圈不支援 add_reader，一律使用 Selector 迴圈
+            self.loop = asyncio.SelectorEventLoop(selectors.DefaultSelector())
+            self._thread = threading.Thread(target=self._run, name="async_forward", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_later(ASYNC_STATS_INTERVAL, self._publish_stats)
+        self.loop.run_forever()
+
+    def add_listener(self, sock, opener, stats=None, limits=None, on_close=None, handshake=None, on_reject=None):
+        """
+        把已 bind/listen 的 socket 交給事件迴圈，回傳可 close() 的監聽物件。
+        連線名額在事件迴圈中以 limits.admit_async() 取得（排隊也在迴圈上等待），
+        取得後才以 opener(client_socket, addr, trace, admitted=True) 在執行緒池中開通 channel，介面同 admit_and_open。
+        被拒絕的連線在迴圈中先呼叫 on_reject(client_socket)（例如回覆 SOCKS 錯誤碼）再關閉。
+        handshake 為 coroutine 函式 handshake(loop, client_socket, addr)，在事件迴圈中先與用戶端交握，
+        其結果以 request= 傳給 opener；回傳 None 代表交握失敗且已自行關閉 client_socket。
+        """
+        self.ensure_started()
+        listener = _AsyncListener(self, sock, opener, stats, limits, on_close, handshake, on_reject)
+        self.loop.call_soon_threadsafe(listener.start)
+        return listener
+
+    def connections_per_second(self):
+        now = time.monotonic()
+        while self._accept_times and now - self._accept_times[0] > ASYNC_RATE_WINDOW:
+            self._accept_times.popleft()
+        return len(self._accept_times) / ASYNC_RATE_WINDOW
+
+    def stats(self):
+        """目前的轉發統計：每秒新連線數、進行中連線數與程序執行緒數"""
+        return {
+            "connections_per_second": round(self.connections_per_second(), 2),
+            "active_connections": self.active_connections,
+            "total_connections": self.total_connections,
+            "thread_count": threading.active_count(),
+        }
+
+    def _publish_stats(self):
+        if self.active_connections or self._accept_times:
+            s = self.stats()
+            log.info("📊 asyncio 轉發: %s 連線/秒, 進行中 %s, 執行緒 %s",
+                     s["connections_per_second"], s["active_connections"], s["thread_count"])
+        self.loop.call_later(ASYNC_STATS_INTERVAL, self._publish_stats)
+
+    def _on_connection_open(self):
+        self._accept_times.append(time.monotonic())
+        self.total_connections += 1
+        self.active_connections += 1
+
+    def _on_connection_close(self):
+        self.active_connections -= 1
+
+
+class _AsyncListener:
+    """事件迴圈中的一個監聽端口"""
+
+    def __init__(self, engine, sock, opener, stats=None, limits=None, on_close=None, handshake=None, on_reject=None):
+        self.engine = engine
+        self.stats = stats
+        self.limits = limits or TunnelLimits()
+        self.on_close = on_close
+        self.sock = sock
+        self.opener = opener
+        self.handshake = handshake
+        self.on_reject = on_reject
+        self.closed = False
+        from concurrent.futures import ThreadPoolExecutor
+        # 執行緒數即為這條通道同時進行中的 open_channel 上限；排隊等待名額的連線不佔用執行緒
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.limits.max_opening, thread_name_prefix="open_channel"
+        )
+
+    def start(self):
+        self.sock.setblocking(False)
+        self.engine.loop.add_reader(self.sock.fileno(), self._on_accept)
+
+    def close(self):
+        """可由任意執行緒呼叫，實際關閉動作在事件迴圈中執行"""
+        if self.closed:
+            return
+        self.closed = True
+        self.engine.loop.call_soon_threadsafe(self._close)
+
+    def _close(self):
+        try:
+            self.engine.loop.remove_reader(self.sock.fileno())
+        except (ValueError, OSError):
+            pass
+        self.sock.close()
+        self._executor.shutdown(wait=False)
+        if self.on_close:
+            self.on_close()
+
+    def _on_accept(self):
+        # 一次把 backlog 中等待的連線都接起來
+        while True:
+            try:
+                client_socket, addr = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                _log(self.stats).warning("⚠️ 其他 socket 錯誤: %s", e)
+                return
+            client_socket.setblocking(False)
+            trace = self.limits.trace(addr, self.stats)
+            if self.handshake is not None:
+                self.engine.loop.create_task(self._handshake(client_socket, addr, trace))
+            else:
+                self.engine.loop.create_task(self._admit(client_socket, addr, trace))
+
+    async def _handshake(self, client_socket, addr, trace):
+        request = await self.handshake(self.engine.loop, client_socket, addr)
+        if request is None or self.closed:
+            if request is not None:
+                client_socket.close()
+            if trace is not None:
+                trace.finish()
+            return
+        await self._admit(client_socket, addr, trace, request)
+
+    async def _admit(self, client_socket, addr, trace, request=None):
+        reason = await self.limits.admit_async(self.engine.loop)
+        if reason:
+            _reject(client_socket, addr, reason, self.stats, trace, self.on_reject)
+            return
+        if self.closed:
+            self.limits.release()
+            client_socket.close()
+            if trace is not None:
+                trace.finish()
+            return
+        if trace is not None:
+            trace.mark("admitted")
+        self._open(client_socket, addr, trace, request)
+
+    def _open(self, client_socket, addr, trace, request=None):
+        opener = functools.partial(self.opener, admitted=True)
+        if request is not None:
+            opener = functools.partial(opener, request=request)
+        future = self.engine.loop.run_in_executor(self._executor, opener, client_socket, addr, trace)
+        future.add_done_callback(
+            lambda f, client_socket=client_socket, addr=addr, trace=trace:
+                self._on_channel(f, client_socket, addr, trace)
+        )
+
+    def _on_channel(self, future, client_socket, addr, trace=None):
+        try:
+            channel = future.result()
+        except Exception as e:
+            # opener 發生未預期的例外；名額已在事件迴圈中取得，由這裡歸還
+            _log(self.stats).warning("⚠️ 轉發失敗: %s", e)
+            client_socket.close()
+            self.limits.release()
+            channel = None
+        if channel is None:
+            if trace is not None:
+                trace.finish()
+            return
+        flow = self.limits.flow(channel, addr, self.stats, trace)
+        _AsyncRelay(self.engine, client_socket, channel, self.stats, self.limits, flow).start()
+
+
+class _AsyncRelay:
+    """
+    在事件迴圈中轉發一組 socket 與 channel。
+    每個方向最多暫存 buffer_size 位元組；目的端寫不出去時暫停讀取來源端，
+    因此每條連線的記憶體用量有固定上限。超過限速（flow）時同樣暫停讀取，時間到才恢復。
+    """
+
+    def __init__(self, engine, sock, channel, stats=None, limits=None, flow=None):
+        self.engine = engine
+        self.stats = stats
+        self.limits = limits
+        self.flow = flow
+        self.read_size = min(engine.buffer_size, flow.chunk) if flow is not None and flow.chunk else engine.buffer_size
+        self.loop = engine.loop
+        if flow is not None:
+            flow.closer = lambda: self.loop.call_soon_threadsafe(self.close)
+        self.sock = sock
+        self.channel = channel
+        self.channel.setblocking(0)
+        self.closed = False
+        # 兩個方向的待送資料（memoryview，空的代表沒有積壓）
+        self.to_channel = b""
+        self.to_sock = b""
+        self.sock_eof = False
+        self.channel_eof = False
+        self.sock_reading = False
+        self.channel_reading = False
+        # 限速中：在計時器到期前不恢復讀取
+        self.sock_held = False
+        self.channel_held = False
+
+    def start(self):
+        self.engine._on_connection_open()
+        if self.stats is not None:
+            self.stats.connection_opened()
+        self._resume_sock()
+        self._resume_channel()
+
+    # 只在狀態改變時才更動 selector 註冊，避免每個封包都多一次系統呼叫
+    def _pause_sock(self):
+        if self.sock_reading:
+            self.sock_reading = False
+            self.loop.remove_reader(self.sock.fileno())
+
+    def _resume_sock(self):
+        if not self.sock_reading:
+            self.sock_reading = True
+            self.loop.add_reader(self.sock.fileno(), self._read_sock)
+
+    def _pause_channel(self):
+        if self.channel_reading:
+            self.channel_reading = False
+            self.loop.remove_reader(self.channel.fileno())
+
+    def _resume_channel(self):
+        if not self.channel_reading:
+            self.channel_reading = True
+            self.loop.add_reader(self.channel.fileno(), self._read_channel)
+
+    def _hold_sock(self, wait):
+        self.sock_held = True
+        self._pause_sock()
+        self.loop.call_later(wait, self._release_sock)
+
+    def _release_sock(self):
+        self.sock_held = False
+        if not self.closed and not self.sock_eof and not self.to_channel:
+            self._resume_sock()
+
+    def _hold_channel(self, wait):
+        self.channel_held = True
+        self._pause_channel()
+        self.loop.call_later(wait, self._release_channel)
+
+    def _release_channel(self):
+        self.channel_held = False
+        if not self.closed and not self.channel_eof and not self.to_sock:
+            self._resume_channel()
+
+    def _read_sock(self):
+        try:
+            data = self.sock.recv(self.read_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            _log(self.stats).warning("⚠️ 資料轉發錯誤: %s", e)
+            return self.close()
+        if not data:
+            self.sock_eof = True
+            self._pause_sock()
+            return self._flush_channel()
+        if self.stats is not None:
+            self.stats.add(sent=len(data))
+        if self.flow is not None:
+            wait = self.flow.consume(sent=len(data))
+            if wait:
+                self._hold_sock(wait)
+        self.to_channel = memoryview(data)
+        self._flush_channel()
+
+    def _read_channel(self):
+        try:
+            data = self.channel.recv(self.read_size)
+        except socket.timeout:
+            return
+        except Exception as e:
+            _log(self.stats).warning("⚠️ 資料轉發錯誤: %s", e)
+            return self.close()
+        if not data:
+            self.channel_eof = True
+            self._pause_channel()
+            return self._flush_sock()
+        if self.stats is not None:
+            self.stats.add(received=len(data))
+        if self.flow is not None:
+            wait = self.flow.consume(received=len(data))
+            if wait:
+                self._hold_channel(wait)
+        self.to_sock = memoryview(data)
+        self._flush_sock()
+
+    def _flush_channel(self):
+        if self.closed:
+            return
+        try:
+            while self.to_channel:
+                n = self.channel.send(self.to_channel)
+                self.to_channel = self.to_channel[n:]
+        except socket.timeout:
+            pass  # SSH 視窗已滿
+        except Exception as e:
+            _log(self.stats).warning("⚠️ 資料轉發錯誤: %s", e)
+            return self.close()
+
+        if self.to_channel:
+            # channel 沒有可寫事件可等待，暫停讀取來源並稍後重試
+            self._pause_sock()
+            self.loop.call_later(ASYNC_WINDOW_RETRY, self._flush_channel)
+        elif self.sock_eof:
+            self._half_close_channel()
+        elif not self.sock_held:
+            self._resume_sock()
+
+    def _flush_sock(self):
+        if self.closed:
+            return
+        try:
+            while self.to_sock:
+                n = self.sock.send(self.to_sock)
+                self.to_sock = self.to_sock[n:]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            _log(self.stats).warning("⚠️ 資料轉發錯誤: %s", e)
+            return self.close()
+
+        if self.to_sock:
+            # 本機端收不下，暫停讀取 channel，等 socket 可寫再續傳
+            self._pause_channel()
+            self.loop.add_writer(self.sock.fileno(), self._on_sock_writable)
+        elif self.channel_eof:
+            self._half_close_sock()
+        elif not self.channel_held:
+            self._resume_channel()
+
+    def _on_sock_writable(self):
+        self.loop.remove_writer(self.sock.fileno())
+        self._flush_sock()
+
+    def _half_close_channel(self):
+        try:
+            self.channel.shutdown_write()
+        except Exception:
+            pass
+        self._maybe_finish()
+
+    def _half_close_sock(self):
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self._maybe_finish()
+
+    def _maybe_finish(self):
+        if self.sock_eof and self.channel_eof and not self.to_channel and not self.to_sock:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for fd in (self.sock.fileno(), self.channel.fileno()):
+            self.loop.remove_reader(fd)
+            self.loop.remove_writer(fd)
+        self.sock.close()
+        close_channel(self.channel)
+        if self.flow is not None:
+            self.flow.close()
+        self.engine._on_connection_close()
+        if self.stats is not None:
+            self.stats.connection_closed()
+        if self.limits is not None:
+            self.limits.release()
+
+
+# 延遲建立：只有選用 asyncio 模式時才會啟動事件迴圈執行緒
+async_engine = AsyncForwardEngine()
+
+def default_config_path():
+    """設定檔預設放在程式所在的資料夾"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILE)
+
+
+def parse_options(text):
+    """解析選項欄位 "key=value;key=value"，回傳 dict"""
+    options = {}
+    for item in text.split(";"):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            options[key.strip()] = value.strip()
+    return options
+
+
+def format_options(options):
+    return ";".join(f"{key}={value}" for key, value in options.items())
+
+
+class TunnelSpec:
+    """一條通道的設定：本地 Port、對方 IP、對方 Port、備註，以及額外選項"""
+
+    def __init__(self, local_port="", target_ip="", target_port="", remark="", options=None):
+        self.local_port = str(local_port).strip()
+        self.target_ip = target_ip.strip()
+        self.target_port = str(target_port).strip()
+        self.remark = remark.strip()
+        self.options = dict(options or {})
+
+    @property
+    def kind(self):
+        """"forward"（固定目的地）或 "socks5"（動態轉發，不需要對方 IP / Port）"""
+        return "socks5" if self.options.get("type", "").lower() == "socks5" else "forward"
+
+    def is_complete(self):
+        if self.kind == "socks5":
+            return bool(self.local_port)
+        return bool(self.local_port and self.target_ip and self.target_port)
+
+    @property
+    def name(self):
+        return self.remark or self.local_port
+
+    @property
+    def target(self):
+        return "socks5" if self.kind == "socks5" else f"{self.target_ip}:{self.target_port}"
+
+    def __repr__(self):
+        return f"TunnelSpec({self.local_port} -> {self.target})"
+
+
+class TunnelConfig:
+    """
+    ssh通道.config 的內容。格式：
+        GLOBAL,user@host,password[,選項]
+        local_port,target_ip,target_port,remark[,選項]
+    選項欄位為 "key=value;key=value"，舊格式沒有此欄位也能正常讀取。
+    """
+
+    def __init__(self, remote="", password="", options=None, tunnels=None):
+        self.remote = remote
+        self.password = password
+        self.options = dict(options or {})
+        self.tunnels = list(tunnels or [])
+
+
+def load_config(path):
+    """讀取設定檔，檔案不存在時回傳空的 TunnelConfig"""
+    config = TunnelConfig()
+    if not os.path.exists(path):
+        return config
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    # 若第一行為全域設定 (以 "GLOBAL," 為開頭)
+    if len(lines) > 0 and lines[0].startswith("GLOBAL,"):
+        parts = lines[0].strip().split(",")
+        if len(parts) >= 3:
+            config.remote = parts[1]
+            config.password = parts[2]
+        if len(parts) >= 4:
+            config.options = parse_options(parts[3])
+        lines = lines[1:]  # 移除全域設定行
+
+    for line in lines:
+        parts = line.strip().split(",")
+        if len(parts) >= 3:
+            remark = parts[3] if len(parts) >= 4 else ""
+            options = parse_options(parts[4]) if len(parts) >= 5 else {}
+            config.tunnels.append(TunnelSpec(parts[0], parts[1], parts[2], remark, options))
+    return config
+
+
+def save_config(path, config):
+    """整份寫回設定檔；沒有選項時維持原本的欄位數"""
+    with open(path, "w", encoding="utf-8") as f:
+        global_line = f"GLOBAL,{config.remote},{config.password}"
+        if config.options:
+            global_line += "," + format_options(config.options)
+        f.write(global_line + "\n")
+        for spec in config.tunnels:
+            line = f"{spec.local_port},{spec.target_ip},{spec.target_port},{spec.remark}"
+            if spec.options:
+                line += "," + format_options(spec.options)
+            f.write(line + "\n")
+
+
+def store_crypto_profile(path, profile):
+    """
+    只把 crypto=auto 選出的加密設定寫進設定檔的 GLOBAL 行，其餘內容以檔案上的為準，
+    介面上尚未儲存的修改與命令列覆蓋的選項都不會一起寫入。設定檔不存在時不寫，回傳 False。
+    """
+    if not os.path.exists(path):
+        return False
+    config = load_config(path)
+    config.options = profile.merged(config.options)
+    save_config(path, config)
+    return True
+
+
+class ConfigWatcher:
+    """
+    每 interval 秒檢查設定檔的修改時間與大小，變更後（且下一次檢查時已不再變動，避免讀到寫到一半的檔案）
+    在監看執行緒中以重新讀取的 TunnelConfig 呼叫 on_change(config)。
+    程式自己存檔後呼叫 mark_seen()，就不會把自己的寫入當成外部修改。
+    """
+
+    def __init__(self, path, on_change, interval=CONFIG_POLL_INTERVAL):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._seen = self._stat()
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def mark_seen(self):
+        self._seen = self._stat()
+        self._pending = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="config_watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            current = self._stat()
+            if current is None or current == self._seen:
+                self._pending = None
+                continue
+            if current != self._pending:
+                self._pending = current  # 等下一次檢查確認已寫完
+                continue
+            self._seen, self._pending = current, None
+            try:
+                config = load_config(self.path)
+            except Exception as e:
+                log.error("❌ 重新讀取設定檔失敗: %s", e)
+                continue
+            log.info("🔄 設定檔 %s 已變更，套用差異...", self.path)
+            try:
+                self.on_change(config)
+            except Exception as e:
+                log.error("❌ 套用設定檔變更失敗: %s", e)
+
+
+class Tunnel:
+    """
+    執行中的一條通道。start() 會阻塞直到 SSH 連線與本機監聽都建立完成；
+    失敗或共用 Transport 失效時交給 reconnect_supervisor 依退避策略重試。
+    狀態變化透過 on_status(state) 通知，state 為 "connected"、"reconnecting"、"error" 或 "stopped"。
+    每次啟用都建立新的 Tunnel；stop() 之後這個物件就不再重新啟動。
+    """
+
+    def __init__(self, engine, spec, on_status=None):
+        self.engine = engine
+        self.spec = spec
+        self.on_status = on_status
+        self.enabled = True
+        self.state = "stopped"
+        self.stats = TunnelStats(spec.name)
+        self.stats.labels = {"local_port": spec.local_port, "target": spec.target}
+        self.pool_keys = []
+        self.transport = None  # 單一 Transport，或 transports > 1 時的 TransportGroup
+        self.tunnel_socket = None
+        self.tunnel_thread = None
+        self._server = engine.remote.split("@", 1) if "@" in engine.remote else None
+        self._lock = threading.Lock()
+
+    def set_status(self, state):
+        self.state = state
+        if self.on_status:
+            self.on_status(state)
+
+    def server_id(self):
+        """重試時用來合併同一台伺服器的 key"""
+        return (self._server[0], self._server[1], SSH_PORT)
+
+    def start(self):
+        result = self.connect()
+        if result in ("ssh_failed", "local_failed") and self.enabled:
+            reconnect_supervisor.schedule(self, local=result == "local_failed")
+
+    def connect(self):
+        """
+        嘗試建立一次通道，回傳 "connected"、"ssh_failed"（伺服器無法連線）、
+        "local_failed"（例如本機端口無法綁定）、"invalid" 或 "stopped"。
+        """
+        spec = self.spec
+        if self._server is None:
+            self.stats.log.error("錯誤：遠端伺服器格式錯誤 %s，請使用 user@host", self.engine.remote)
+            self.set_status("error")
+            return "invalid"
+
+        ssh_user, ssh_host = self._server
+        with self._lock:
+            if not self.enabled:
+                return "stopped"
+            limits = self.limits()
+            transports = []
+            try:
+                for slot in range(limits.transports):
+                    key, transport = transport_pool.acquire(
+                        ssh_user, ssh_host, SSH_PORT, self.engine.password, on_lost=self._on_transport_lost,
+                        profile=self.engine.crypto_profile(), slot=slot, probe_timeout=limits.probe_timeout
+                    )
+                    self.pool_keys.append(key)
+                    transports.append(transport)
+            except Exception as e:
+                self._release_transport()
+                self.set_status("reconnecting")
+                self.stats.log.error("❌ SSH 連線失敗: %s", e)
+                return "ssh_failed"
+            self.transport = transports[0] if len(transports) == 1 else TransportGroup(transports)
+
+            try:
+                # 保存 forward_tunnel / socks_tunnel 回傳的監聽 socket 與 handler 線程
+                options = dict(self.engine.options, **spec.options)
+                if spec.kind == "socks5":
+                    self.tunnel_socket, self.tunnel_thread = socks_tunnel(
+                        int(spec.local_port), self.transport, self.stats, self.engine.mode, limits,
+                        DnsCache() if options.get("dns") == "local" else None
+                    )
+                else:
+                    self.tunnel_socket, self.tunnel_thread = forward_tunnel(
+                        int(spec.local_port), spec.target_ip, int(spec.target_port), self.transport,
+                        self.stats, self.engine.mode, limits
+                    )
+            except Exception as e:
+                self.stats.log.error("❌ 建立隧道失敗: %s", e)
+                self.tunnel_socket = None
+            if self.tunnel_socket is None:
+                self._release_transport()
+                self.set_status("error")
+                return "local_failed"
+
+            self.set_status("connected")
+            self.stats.log.info("✅ 成功建立隧道: %s -> %s", spec.local_port, spec.target)
+            return "connected"
+
+    def rename(self, remark):
+        """只改備註：換上新名稱，之後的記錄與 metrics 都使用它，轉發中的連線不受影響"""
+        spec = self.spec
+        self.spec = TunnelSpec(spec.local_port, spec.target_ip, spec.target_port, remark, spec.options)
+        self.stats.name = self.spec.name
+
+    def limits(self):
+        """通道選項優先，其次是 GLOBAL 選項，都沒有時使用預設值"""
+        return TunnelLimits.from_options(dict(self.engine.options, **self.spec.options))
+
+    def _on_transport_lost(self):
+        """共用 Transport 被判定失效：收掉本機監聽並排入重新連線"""
+        with self._lock:
+            # 若已經改用新的 Transport，舊連線的通知就忽略
+            if not self.enabled or self.transport is None or self.transport.is_active():
+                return
+            self._close_listener()
+            self._release_transport()
+            self.set_status("reconnecting")
+        reconnect_supervisor.schedule(self)
+
+    def stop(self):
+        self.enabled = False
+        if self._server is not None:
+            reconnect_supervisor.cancel(self)
+
+        with self._lock:
+            self._close_listener()
+            self._release_transport()
+        self.set_status("stopped")
+
+    def _close_listener(self):
+        if self.tunnel_socket:
+            try:
+                if isinstance(self.tunnel_socket, socket.socket):
+                    # 先 shutdown 才能喚醒阻塞在 accept() 的 handler，否則端口會一直被佔用
+                    try:
+                        self.tunnel_socket.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                self.tunnel_socket.close()
+                self.stats.log.info("監聽 socket 已關閉")
+            except Exception as e:
+                self.stats.log.warning("關閉監聽 socket 時發生錯誤: %s", e)
+            self.tunnel_socket = None
+
+    def _release_transport(self):
+        # 只釋放共用 Transport 的參考，最後一個通道停用時才真正斷線
+        for key in self.pool_keys:
+            transport_pool.release(key, self._on_transport_lost)
+        self.pool_keys = []
+        self.transport = None
+
+
+class TunnelEngine:
+    """
+    管理所有通道；GUI 與無介面模式都透過它啟動、停止通道。
+    選項 workers 大於 1 時，通道改在 tunnel_workers 的 worker 程序中執行。
+    """
+
+    def __init__(self, remote="", password="", options=None):
+        self.remote = remote
+        self.password = password
+        self.options = dict(options or {})
+        self.tunnels = []
+        self.metrics_server = None
+        self.worker_pool = None
+        self.profiler = None  # start_profiler() 時才建立
+        # crypto=auto 量測完成後以 CryptoProfile 呼叫，讓 GUI / 無介面模式把結果存回設定檔
+        self.on_profile_chosen = None
+        self._lock = threading.Lock()
+        self._crypto_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.remote, config.password, config.options)
+
+    def set_server(self, remote, password):
+        self.remote = remote
+        self.password = password
+
+    def signature(self, spec):
+        """
+        決定通道是否需要重新啟動的設定：伺服器、目的地與生效的選項（通道選項覆蓋 GLOBAL）。
+        備註、metrics_port 與記錄選項不影響轉發，不算在內。
+        """
+        options = dict(self.options, **spec.options)
+        for key in ("metrics_port", "log_level", "log_file"):
+            options.pop(key, None)
+        return (self.remote, self.password, spec.target_ip, spec.target_port, tuple(sorted(options.items())))
+
+    def update_settings(self, remote, password, options):
+        """
+        套用重新讀取的伺服器與 GLOBAL 選項，不動到執行中的通道（由呼叫端依 signature 決定重啟哪些）。
+        workers 只在啟動時決定，執行中修改會被忽略；metrics_port 變更時重新開啟端點，log_level / log_file 變更時重新設定記錄。
+        """
+        options = dict(options)
+        if options.get("workers", "1") != self.options.get("workers", "1"):
+            log.warning("⚠️ workers 選項需重新啟動程式才會生效")
+            options.pop("workers", None)
+            if "workers" in self.options:
+                options["workers"] = self.options["workers"]
+        metrics_changed = options.get("metrics_port") != self.options.get("metrics_port")
+        logging_changed = any(options.get(key) != self.options.get(key) for key in ("log_level", "log_file"))
+        self.set_server(remote, password)
+        with self._lock:
+            self.options = options
+        if logging_changed:
+            self.start_logging()
+        if metrics_changed:
+            if self.metrics_server:
+                self.metrics_server.stop()
+                self.metrics_server = None
+            self.start_metrics_server()
+
+    def apply_config(self, config, on_status=None):
+        """
+        依重新讀取的設定檔增量更新通道（以本地 Port 識別）：新增的啟動、刪除的停止、
+        目的地或選項有變更的重新啟動；其餘通道、它們的連線與共用 Transport 都不受影響。
+        只改備註時直接更新名稱。回傳 {"started": [...], "stopped": [...], "restarted": [...]}（TunnelSpec 清單）。
+        """
+        with self._reload_lock:
+            running = {tunnel.spec.local_port: tunnel for tunnel in list(self.tunnels)}
+            before = {port: self.signature(tunnel.spec) for port, tunnel in running.items()}
+            self.update_settings(config.remote, config.password, config.options)
+            wanted = {}
+            for spec in config.tunnels:
+                if not spec.is_complete():
+                    continue
+                if spec.local_port in wanted:
+                    log.warning("⚠️ 本地端口 %s 重複，只使用第一條設定", spec.local_port)
+                    continue
+                wanted[spec.local_port] = spec
+
+            changes = {"started": [], "stopped": [], "restarted": []}
+            for port, tunnel in running.items():
+                spec = wanted.get(port)
+                if spec is None:
+                    self.remove_tunnel(tunnel)
+                    changes["stopped"].append(tunnel.spec)
+                elif self.signature(spec) != before[port]:
+                    # 先停止才能重新綁定同一個本地端口
+                    self.remove_tunnel(tunnel)
+                    changes["restarted"].append(spec)
+                elif spec.remark != tunnel.spec.remark:
+                    tunnel.rename(spec.remark)
+            for port, spec in wanted.items():
+                if port not in running:
+                    changes["started"].append(spec)
+            for spec in changes["started"] + changes["restarted"]:
+                tunnel = self.add_tunnel(spec, on_status)
+                threading.Thread(target=tunnel.start, daemon=True).start()
+            return changes
+
+    @property
+    def mode(self):
+        return self.options.get("mode", FORWARD_MODE)
+
+    @property
+    def workers(self):
+        try:
+            return int(self.options.get("workers", 1))
+        except ValueError:
+            return 1
+
+    def crypto_profile(self):
+        """
+        目前的加密偏好；crypto=auto 時只在第一次呼叫時量測，結果換成一份新的 options。
+        其他執行緒可能正在讀取 options，因此一律整份替換、不在原地修改。
+        """
+        with self._crypto_lock:
+            if self.options.get("crypto") == "auto":
+                profile = CryptoProfile.auto(CryptoProfile.from_options(self.options).compress)
+                with self._lock:
+                    self.options = profile.merged(self.options)
+                if self.on_profile_chosen:
+                    self.on_profile_chosen(profile)
+                return profile
+        return CryptoProfile.from_options(self.options)
+
+    def add_tunnel(self, spec, on_status=None):
+        if self.workers > 1:
+            # 只有啟用多程序時才載入，worker 程序本身也是以 workers=1 執行 Tunnel
+            from tunnel_workers import RemoteTunnel, WorkerPool
+            with self._lock:
+                if self.worker_pool is None:
+                    self.worker_pool = WorkerPool(self.workers)
+            tunnel = RemoteTunnel(self, self.worker_pool, spec, on_status)
+        else:
+            tunnel = Tunnel(self, spec, on_status)
+        with self._lock:
+            self.tunnels.append(tunnel)
+        return tunnel
+
+    def remove_tunnel(self, tunnel):
+        """停止並移除通道（會阻塞到監聽 socket 關閉為止）"""
+        tunnel.stop()
+        with self._lock:
+            if tunnel in self.tunnels:
+                self.tunnels.remove(tunnel)
+
+    def start_all(self):
+        """以背景執行緒同時啟動所有通道；同一台伺服器只會握手一次"""
+        for tunnel in list(self.tunnels):
+            threading.Thread(target=tunnel.start, daemon=True).start()
+
+    def stop_all(self):
+        for tunnel in list(self.tunnels):
+            self.remove_tunnel(tunnel)
+
+    def collect_metrics(self):
+        """所有通道的統計快照，以及程序層級的數值"""
+        tunnels = []
+        for tunnel in list(self.tunnels):
+            snapshot = tunnel.stats.snapshot()
+            snapshot.pop("traces", None)  # 另由 /traces 提供
+            snapshot["up"] = 1 if tunnel.state == "connected" else 0
+            tunnels.append(snapshot)
+        metrics = {"tunnels": tunnels, "threads": threading.active_count()}
+        if async_engine.running:
+            # 只有 mode=asyncio 的通道用過事件迴圈後才有這一段
+            metrics["asyncio"] = async_engine.stats()
+        return metrics
+
+    def connections(self):
+        """目前轉發中的所有連線（跨通道），依存活時間由長到短排序，供 GUI 與 /connections 查詢"""
+        result = []
+        for tunnel in list(self.tunnels):
+            snapshot = tunnel.stats.snapshot()
+            for flow in snapshot["flows"]:
+                result.append(dict(flow, tunnel=snapshot["name"]))
+        result.sort(key=lambda flow: flow["seconds"], reverse=True)
+        return result
+
+    def traces(self):
+        """所有通道最近完成的連線追蹤（選項 trace 取樣），依開始時間排序，供 /traces 與 export_traces 使用"""
+        result = []
+        for tunnel in list(self.tunnels):
+            snapshot = tunnel.stats.snapshot()
+            for trace in snapshot.get("traces", ()):
+                result.append(dict(trace, tunnel=snapshot["name"]))
+        result.sort(key=lambda trace: trace["started"])
+        return result
+
+    def export_traces(self, path):
+        """把連線追蹤寫成 Chrome trace 檔（可用 chrome://tracing 或 Perfetto 開啟），回傳 path"""
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(chrome_trace(self.traces()), file)
+        return path
+
+    def start_profiler(self):
+        """開始對這個程序的所有執行緒取樣（通道照常運作），已在執行時回傳 False"""
+        from tunnel_profiler import SamplingProfiler
+        if self.profiler is None:
+            self.profiler = SamplingProfiler()
+        started = self.profiler.start()
+        if started:
+            log.info("🔬 開始效能分析（每 %g ms 取樣所有執行緒）", self.profiler.interval * 1000)
+        return started
+
+    def stop_profiler(self, directory=None):
+        """
+        停止效能分析，回傳 SamplingProfiler（沒有在執行時回傳 None）。
+        指定 directory 時另外寫出 profile-時間.txt（collapsed stack）與 traces-時間.json（Chrome trace）。
+        """
+        if self.profiler is None or not self.profiler.stop():
+            return None
+        log.info("🔬 效能分析結束\n%s", self.profiler.summary())
+        if directory:
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            profile_path = self.profiler.dump(os.path.join(directory, f"profile-{stamp}.txt"))
+            traces_path = self.export_traces(os.path.join(directory, f"traces-{stamp}.json"))
+            log.info("🔬 已寫出 %s 與 %s", profile_path, traces_path)
+        return self.profiler
+
+    def toggle_profiler(self, directory):
+        """未執行時開始效能分析，執行中則停止並把結果寫到 directory；回傳是否正在分析"""
+        if self.profiler is not None and self.profiler.running:
+            self.stop_profiler(directory)
+            return False
+        return self.start_profiler()
+
+    def start_logging(self):
+        """依 GLOBAL 選項 log_level、log_file 設定記錄（可重複呼叫）"""
+        setup_logging(self.options.get("log_level", LOG_LEVEL), self.options.get("log_file"))
+
+    def start_metrics_server(self, port=None):
+        """
+        依參數或 metrics_port 選項啟動本機 metrics 端點；未設定時不啟動。
+        回傳 MetricsServer 或 None。
+        """
+        port = port or self.options.get("metrics_port")
+        if not port or self.metrics_server:
+            return self.metrics_server
+        try:
+            self.metrics_server = MetricsServer(self, int(port))
+            self.metrics_server.start()
+            log.info("📊 metrics 端點：http://%s:%s/metrics", METRICS_HOST, port)
+        except Exception as e:
+            self.metrics_server = None
+            log.error("❌ 無法啟動 metrics 端點 %s: %s", port, e)
+        return self.metrics_server
+
+    def close(self):
+        """停止所有通道、worker 程序與 metrics 端點"""
+        self.stop_all()
+        if self.worker_pool:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+
+def _prometheus_labels(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+def render_prometheus(metrics):
+    """把 collect_metrics() 的結果轉成 Prometheus 文字格式"""
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    tunnels = metrics["tunnels"]
+    label_sets = [dict({"tunnel": t["name"]}, **t["labels"]) for t in tunnels]
+
+    family("ssh_tunnel_up", "gauge", "1 if the tunnel is connected")
+    for labels, t in zip(label_sets, tunnels):
+        lines.append(f"ssh_tunnel_up{{{_prometheus_labels(labels)}}} {t['up']}")
+
+    family("ssh_tunnel_bytes_total", "counter", "Bytes forwarded through the tunnel")
+    for labels, t in zip(label_sets, tunnels):
+        for direction, key in (("out", "bytes_out"), ("in", "bytes_in")):
+            lines.append(f"ssh_tunnel_bytes_total{{{_prometheus_labels(dict(labels, direction=direction))}}} {t[key]}")
+
+    for name, kind, key, help_text in (
+        ("ssh_tunnel_connections_active", "gauge", "active_connections", "Connections currently being forwarded"),
+        ("ssh_tunnel_connections_total", "counter", "total_connections", "Connections forwarded since start"),
+        ("ssh_tunnel_open_failures_total", "counter", "open_failures", "Failed direct-tcpip channel opens"),
+        ("ssh_tunnel_connections_rejected_total", "counter", "rejected_connections",
+         "Connections refused because the tunnel was at max_conns"),
+        ("ssh_tunnel_warm_hits_total", "counter", "warm_hits", "Connections served by a pre-opened channel"),
+        ("ssh_tunnel_warm_misses_total", "counter", "warm_misses",
+         "Connections that found the warm pool empty and opened a channel on demand"),
+        ("ssh_tunnel_warm_saved_seconds_total", "counter", "warm_saved_seconds",
+         "Estimated channel-open latency saved by pre-opened channels"),
+        ("ssh_tunnel_throttled_seconds_total", "counter", "throttled_seconds",
+         "Time connections spent paused by rate limits"),
+        ("ssh_tunnel_connections_reaped_total", "counter", "reaped_connections",
+         "Connections closed for exceeding idle_timeout or max_lifetime"),
+        ("ssh_tunnel_reconnect_attempts_total", "counter", "reconnect_attempts",
+         "Reconnect attempts scheduled for the tunnel"),
+    ):
+        family(name, kind, help_text)
+        for labels, t in zip(label_sets, tunnels):
+            lines.append(f"{name}{{{_prometheus_labels(labels)}}} {t[key]}")
+
+    family("ssh_tunnel_channel_open_seconds", "histogram", "Latency of direct-tcpip channel opens")
+    for labels, t in zip(label_sets, tunnels):
+        histogram = t["channel_open_seconds"]
+        for bound, count in histogram["buckets"]:
+            lines.append(f"ssh_tunnel_channel_open_seconds_bucket{{{_prometheus_labels(dict(labels, le=bound))}}} {count}")
+        lines.append(f"ssh_tunnel_channel_open_seconds_sum{{{_prometheus_labels(labels)}}} {histogram['sum']}")
+        lines.append(f"ssh_tunnel_channel_open_seconds_count{{{_prometheus_labels(labels)}}} {histogram['count']}")
+
+    family("ssh_tunnel_process_threads", "gauge", "Threads in the tunnel process")
+    lines.append(f"ssh_tunnel_process_threads {metrics['threads']}")
+
+    if "asyncio" in metrics:
+        for name, kind, key, help_text in (
+            ("ssh_tunnel_asyncio_connections_per_second", "gauge", "connections_per_second",
+             "New connections per second on the shared asyncio event loop"),
+            ("ssh_tunnel_asyncio_connections_active", "gauge", "active_connections",
+             "Connections currently relayed by the asyncio event loop"),
+            ("ssh_tunnel_asyncio_connections_total", "counter", "total_connections",
+             "Connections relayed by the asyncio event loop since start"),
+        ):
+            family(name, kind, help_text)
+            lines.append(f"{name} {metrics['asyncio'][key]}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler:
+    """MetricsServer 的請求處理，與 http.server.BaseHTTPRequestHandler 組合使用（啟用 metrics 時才載入 http.server）"""
+
+    def do_GET(self):
+        engine = self.server.engine
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = render_prometheus(engine.collect_metrics()).encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(engine.collect_metrics(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        elif path == "/connections":
+            connections = {"connections": engine.connections(), "fds_in_use": fd_budget.in_use}
+            body = json.dumps(connections, ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        elif path == "/traces":
+            body = json.dumps(engine.traces(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        elif path == "/traces.chrome":
+            body = json.dumps(chrome_trace(engine.traces()), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        elif path == "/profile/start":
+            body = ("started\n" if engine.start_profiler() else "already running\n").encode("utf-8")
+            content_type = "text/plain; charset=utf-8"
+        elif path == "/profile/stop":
+            # 回傳 collapsed stack，可直接存檔後交給 flamegraph.pl / speedscope
+            profiler = engine.stop_profiler()
+            body = (profiler.collapsed() if profiler else "not running\n").encode("utf-8")
+            content_type = "text/plain; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不把每次抓取都印到主控台
+
+
+class MetricsServer:
+    """
+    本機 HTTP 端點：/metrics 為 Prometheus 文字格式，/metrics.json 為 JSON，/connections 列出目前的連線，
+    /traces、/traces.chrome 為取樣的連線追蹤，/profile/start、/profile/stop 切換效能分析。
+    """
+
+    def __init__(self, engine, port, host=METRICS_HOST):
+        import http.server
+        handler = type("MetricsRequestHandler", (_MetricsHandler, http.server.BaseHTTPRequestHandler), {})
+        self.httpd = http.server.ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.engine = engine
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def run_headless(config_path, mode=None, metrics_port=None, workers=None, log_level=None, log_file=None):
+    """無介面模式：載入設定檔、啟動所有欄位完整的通道，直到收到中斷訊號"""
+    # 讀到設定檔之前先依命令列參數設定記錄，載入失敗的訊息也走同一套 handler
+    setup_logging(log_level or LOG_LEVEL, log_file)
+    if not os.path.exists(config_path):
+        log.error("❌ 找不到設定檔 %s", config_path)
+        return 1
+    config = load_config(config_path)
+    engine = TunnelEngine.from_config(config)
+    # 命令列覆蓋的選項，重新讀取設定檔時也要保留
+    overrides = {}
+    if mode:
+        overrides["mode"] = mode
+    if workers:
+        overrides["workers"] = str(workers)
+    if log_level:
+        overrides["log_level"] = log_level
+    if log_file:
+        overrides["log_file"] = log_file
+    engine.options.update(overrides)
+    engine.start_logging()
+
+    def _save_profile(profile):
+        # 只寫回加密設定，命令列覆蓋的選項不寫進設定檔
+        if store_crypto_profile(config_path, profile):
+            watcher.mark_seen()
+            log.info("已將加密設定寫入 %s", config_path)
+
+    def _reload(new_config):
+        effective = TunnelConfig(new_config.remote, new_config.password, dict(new_config.options, **overrides),
+                                 new_config.tunnels)
+        changes = engine.apply_config(effective)
+        log.info("🔄 設定檔已套用：啟動 %d、停止 %d、重新啟動 %d 條通道，其餘維持不動",
+                 len(changes["started"]), len(changes["stopped"]), len(changes["restarted"]))
+
+    engine.on_profile_chosen = _save_profile
+    watcher = ConfigWatcher(config_path, _reload)
+
+    for spec in config.tunnels:
+        if spec.is_complete():
+            engine.add_tunnel(spec)
+        else:
+            log.warning("略過欄位不完整的通道：%s", spec)
+    if not engine.tunnels:
+        log.error("設定檔中沒有可啟用的通道")
+        return 1
+
+    stop_event = threading.Event()
+
+    def _on_signal(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, _on_signal)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, _on_signal)
+    if hasattr(signal, "SIGUSR1"):
+        # kill -USR1 <pid>：開始 / 停止效能分析，結果與連線追蹤寫到設定檔所在的資料夾
+        profile_dir = os.path.dirname(os.path.abspath(config_path))
+        signal.signal(signal.SIGUSR1, lambda signum, frame: engine.toggle_profiler(profile_dir))
+
+    log.info("以無介面模式啟動 %d 條通道（%s 模式，%s 個程序）", len(engine.tunnels), engine.mode, engine.workers)
+    engine.start_metrics_server(metrics_port)
+    engine.start_all()
+    watcher.start()
+    # 以逾時等待，讓 Windows 上的 Ctrl+C 也能被處理
+    while not stop_event.wait(1.0):
+        pass
+
+    log.info("收到停止訊號，關閉所有通道...")
+    watcher.stop()
+    engine.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SSH 通道管理")
+    parser.add_argument("--headless", action="store_true", help="不開啟 GUI，直接啟動設定檔中的通道")
+    parser.add_argument("--config", default=default_config_path(), help="設定檔路徑（預設為程式目錄下的 ssh通道.config）")
+    parser.add_argument("--mode", choices=("thread", "asyncio"), help="轉發模式，覆蓋設定檔中的 mode 選項")
+    parser.add_argument("--metrics-port", type=int, help="在 127.0.0.1 的此 port 提供 /metrics、/metrics.json 與 /connections")
+    parser.add_argument("--workers", type=int, help="把通道分散到幾個 worker 程序，覆蓋設定檔中的 workers 選項")
+    parser.add_argument("--log-level", choices=("debug", "info", "warning", "error"),
+                        help="記錄等級，覆蓋設定檔中的 log_level 選項（預設 info）")
+    parser.add_argument("--log-file", help="另外寫入輪替的記錄檔，覆蓋設定檔中的 log_file 選項")
+    parser.add_argument("--crypto-benchmark", action="store_true", help="量測本機各 cipher/MAC 組合的速度後結束")
+    args = parser.parse_args(argv)
+    if args.crypto_benchmark:
+        for r in benchmark_crypto():
+            print(f"{r['cipher']:24s} {r['mac'] or '(AEAD)':30s} {r['mb_per_s']:>8} MB/s")
+        return 0
+    return run_headless(args.config, args.mode, args.metrics_port, args.workers, args.log_level, args.log_file)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+取樣式效能分析：不必重新啟動通道，定期擷取程序內所有執行緒的呼叫堆疊並累計次數。
+
+結果為 collapsed stack 格式（每行「執行緒;最外層函式;...;最內層函式 次數」），
+可直接交給 flamegraph.pl 或 https://www.speedscope.app 畫成火焰圖。
+取樣的是牆上時間：阻塞在 select / recv 的執行緒也會被計入，因此看得出時間花在等待還是運算。
+GUI 的「效能分析」按鈕、metrics 端點的 /profile/start、/profile/stop，以及無介面模式的 SIGUSR1 都使用這裡的 profiler。
+"""
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+PROFILE_INTERVAL = 0.005   # 取樣間隔（秒）
+PROFILE_MAX_DEPTH = 64     # 每個堆疊最多記錄的層數
+PROFILE_SUMMARY_TOP = 20   # summary() 列出的函式數
+
+
+def _thread_label(name):
+    # 「Thread-12 (_serve_client)」、「open_channel_3」之類的編號去掉，同一種執行緒才會合併成一條堆疊
+    return re.sub(r"[-_]\d+", "", name)
+
+
+class SamplingProfiler:
+    """背景執行緒每 interval 秒擷取一次 sys._current_frames()，start() / stop() 可重複切換"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self.elapsed = 0.0
+        self._started = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """開始取樣並清除上一次的結果；已在執行時回傳 False"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.samples = collections.Counter()
+            self.sample_count = 0
+            self.elapsed = 0.0
+            self._stop.clear()
+            self._started = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name="sampling_profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """停止取樣，結果保留到下一次 start()；沒有在執行時回傳 False"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return False
+        self._stop.set()
+        thread.join()
+        self.elapsed = time.perf_counter() - self._started
+        return True
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(_thread_label(names.get(ident, str(ident))))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def collapsed(self):
+        """collapsed stack 格式的結果，取樣次數多的在前"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+    def summary(self, top=PROFILE_SUMMARY_TOP):
+        """依函式本身（堆疊最內層）的取樣次數排序的前 top 名，每行一個函式"""
+        own = collections.Counter()
+        for stack, count in self.samples.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        total = sum(own.values()) or 1
+        lines = [f"取樣 {self.sample_count} 次，共 {self.elapsed:.1f} 秒，間隔 {self.interval * 1000:g} ms"]
+        for function, count in own.most_common(top):
+            lines.append(f"{count / total * 100:6.1f}%  {function}")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """把 collapsed stack 寫到 path，回傳 path"""
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(self.collapsed())
+        return path
@@ -0,0 +1,273 @@
+"""
+多程序轉發：把通道分散到多個 worker 程序，讓加密與轉發不再受限於單一程序的 GIL。
+
+每個 worker 各自擁有 TunnelEngine、SSH Transport 與本機監聽 socket；
+主程序（GUI 或無介面模式）只透過 Pipe 下達啟動 / 停止指令，並接收狀態與統計。
+由 GLOBAL 選項 workers=N（無介面模式也可用 --workers N）啟用，TunnelEngine 會自動改用 RemoteTunnel。
+"""
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+
+import tunnel_engine
+from tunnel_engine import (LOG_LEVEL, STATUS_COUNTERS, TunnelEngine, TunnelSpec, TunnelStats, log, setup_logging,
+                           tunnel_log)
+
+WORKER_METRICS_INTERVAL = 1.0   # worker 回報統計的間隔（秒）
+WORKER_STOP_TIMEOUT = 10.0      # 等待 worker 確認通道已停止的上限（秒）
+WORKER_JOIN_TIMEOUT = 5.0       # 關閉時等待 worker 程序結束的上限（秒）
+
+
+class _PipeLogHandler(logging.Handler):
+    """worker 內的記錄送回主程序，由主程序統一寫到主控台、記錄檔與 GUI 的記錄窗格"""
+
+    def __init__(self, send):
+        super().__init__()
+        self.send = send
+
+    def emit(self, record):
+        self.send(("log", {
+            "name": record.name,
+            "levelno": record.levelno,
+            "levelname": record.levelname,
+            "msg": record.getMessage(),
+            "created": record.created,
+            "tunnel": getattr(record, "tunnel", "-"),
+        }))
+
+
+def _worker_main(conn, ssh_port):
+    """
+    worker 程序的進入點：依主程序的指令啟動 / 停止通道，並回報狀態與統計。
+    spawn 出的程序會重新匯入 tunnel_engine，主程序執行期間改過的 SSH_PORT 由 ssh_port 帶入。
+    """
+    tunnel_engine.SSH_PORT = ssh_port
+    engine = TunnelEngine()
+    tunnels = {}
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                pass  # 主程序已結束
+
+    def report_metrics():
+        while True:
+            time.sleep(WORKER_METRICS_INTERVAL)
+            snapshots = {tunnel_id: tunnel.stats.snapshot() for tunnel_id, tunnel in list(tunnels.items())}
+            if snapshots:
+                send(("metrics", snapshots))
+
+    threading.Thread(target=report_metrics, name="worker_metrics", daemon=True).start()
+    logging_ready = False
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        command = message[0]
+        if command == "start":
+            _, tunnel_id, remote, password, options, fields = message
+            engine.set_server(remote, password)
+            engine.options = dict(options)
+            engine.options.pop("workers", None)  # worker 內一律直接執行 Tunnel
+            if not logging_ready:
+                setup_logging(engine.options.get("log_level", LOG_LEVEL), console=False,
+                              handlers=[_PipeLogHandler(send)])
+                logging_ready = True
+            tunnel = engine.add_tunnel(
+                TunnelSpec(*fields), on_status=lambda state, tunnel_id=tunnel_id: send(("status", tunnel_id, state))
+            )
+            tunnels[tunnel_id] = tunnel
+            threading.Thread(target=tunnel.start, daemon=True).start()
+        elif command == "rename":
+            tunnel = tunnels.get(message[1])
+            if tunnel is not None:
+                tunnel.rename(message[2])
+        elif command == "stop":
+            tunnel = tunnels.pop(message[1], None)
+            if tunnel is None:
+                send(("status", message[1], "stopped"))
+            else:
+                threading.Thread(target=engine.remove_tunnel, args=(tunnel,), daemon=True).start()
+        elif command == "shutdown":
+            break
+    engine.close()
+
+
+class _Worker:
+    """主程序端的一個 worker：持有 Pipe，並由讀取執行緒把訊息轉給對應的 RemoteTunnel"""
+
+    def __init__(self, context, index):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, tunnel_engine.SSH_PORT),
+                                       name=f"tunnel_worker_{index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.index = index
+        self.tunnels = {}
+        self.alive = True
+        self._send_lock = threading.Lock()
+        threading.Thread(target=self._read_loop, name=f"worker_reader_{index}", daemon=True).start()
+
+    def send(self, message):
+        """送出指令，worker 已結束時回傳 False"""
+        with self._send_lock:
+            if not self.alive:
+                return False
+            try:
+                self.conn.send(message)
+                return True
+            except (OSError, EOFError):
+                return False
+
+    def _read_loop(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == "status":
+                tunnel = self.tunnels.get(message[1])
+                if tunnel is not None:
+                    tunnel.set_status(message[2])
+            elif message[0] == "log":
+                log.handle(logging.makeLogRecord(message[1]))
+            elif message[0] == "metrics":
+                for tunnel_id, snapshot in message[1].items():
+                    tunnel = self.tunnels.get(tunnel_id)
+                    if tunnel is not None:
+                        tunnel.stats.update(snapshot)
+        # worker 程序結束（正常關閉或當掉）：其上的通道都不再運作
+        self.alive = False
+        for tunnel in list(self.tunnels.values()):
+            if tunnel.state != "stopped":
+                tunnel_log(tunnel.spec.name).error("❌ worker %s 已結束，通道 %s 停止運作", self.index, tunnel.spec.name)
+                tunnel.set_status("error")
+
+    def close(self):
+        self.send(("shutdown",))
+        self.process.join(WORKER_JOIN_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.alive = False
+        self.conn.close()
+
+
+class WorkerPool:
+    """固定數量的 worker 程序；新通道分配給目前通道最少的 worker，結束的 worker 在下次分配時重建"""
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        # 一律使用 spawn：主程序已有許多執行緒，fork 可能複製到被鎖住的鎖
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [None] * self.size
+        self._lock = threading.Lock()
+
+    def assign(self, tunnel):
+        with self._lock:
+            for index, worker in enumerate(self._workers):
+                if worker is None or not worker.alive:
+                    self._workers[index] = _Worker(self._context, index)
+            worker = min(self._workers, key=lambda w: len(w.tunnels))
+            worker.tunnels[tunnel.id] = tunnel
+            return worker
+
+    def forget(self, tunnel):
+        with self._lock:
+            for worker in self._workers:
+                if worker is not None:
+                    worker.tunnels.pop(tunnel.id, None)
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._workers = self._workers, [None] * self.size
+        for worker in workers:
+            if worker is not None:
+                worker.close()
+
+
+class _RemoteStats:
+    """
+    worker 最近一次回報的統計快照，介面與 TunnelStats.snapshot() 相同。
+    名稱以主程序為準：改備註後、worker 收到 rename 之前送來的快照不會把舊名稱帶回來。
+    """
+
+    def __init__(self, name, labels):
+        self.name = name
+        empty = TunnelStats(name)
+        empty.labels = labels
+        self._snapshot = empty.snapshot()
+
+    def update(self, snapshot):
+        self._snapshot = snapshot
+
+    def snapshot(self):
+        return dict(self._snapshot, name=self.name)
+
+    def counters(self):
+        return {key: self._snapshot.get(key, 0) for key in STATUS_COUNTERS}
+
+
+class RemoteTunnel:
+    """
+    在 worker 程序中執行的通道，對 GUI 與 TunnelEngine 提供和 Tunnel 相同的介面。
+    start() 只送出指令就返回，狀態之後由 worker 回報；stop() 會等到 worker 確認監聽已關閉。
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, engine, pool, spec, on_status=None):
+        self.engine = engine
+        self.pool = pool
+        self.spec = spec
+        self.on_status = on_status
+        self.id = next(self._ids)
+        self.enabled = True
+        self.state = "stopped"
+        self.stats = _RemoteStats(spec.name, {"local_port": spec.local_port, "target": spec.target})
+        self.worker = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def set_status(self, state):
+        self.state = state
+        if state == "stopped":
+            self._stopped.set()
+        if self.on_status:
+            self.on_status(state)
+
+    def start(self):
+        # crypto=auto 在主程序量測並存檔一次，worker 直接使用結果
+        self.engine.crypto_profile()
+        spec = self.spec
+        with self._lock:
+            if not self.enabled:
+                return
+            self.worker = self.pool.assign(self)
+            self.worker.send(("start", self.id, self.engine.remote, self.engine.password, self.engine.options,
+                              (spec.local_port, spec.target_ip, spec.target_port, spec.remark, spec.options)))
+
+    def rename(self, remark):
+        spec = self.spec
+        self.spec = TunnelSpec(spec.local_port, spec.target_ip, spec.target_port, remark, spec.options)
+        self.stats.name = self.spec.name
+        with self._lock:
+            worker = self.worker
+        if worker is not None:
+            worker.send(("rename", self.id, remark))
+
+    def stop(self):
+        with self._lock:
+            self.enabled = False
+            worker = self.worker
+        if worker is not None and worker.send(("stop", self.id)):
+            if not self._stopped.wait(WORKER_STOP_TIMEOUT):
+                tunnel_log(self.spec.name).warning("⚠️ worker %s 未在時間內確認停止通道 %s", worker.index, self.spec.name)
+        self.pool.forget(self)
+        if self.state != "stopped":
+            self.set_status("stopped")